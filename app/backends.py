@@ -0,0 +1,254 @@
+import asyncio
+import random
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple
+import httpx
+from openai import APIConnectionError, AsyncOpenAI
+from app.config import settings
+from app.scheduler import estimate_tokens
+from app.upstream_http import TracingTransport, build_http_client, http2_enabled, stage_timeout
+
+MAX_COMPLETION_TOKENS = 2000
+
+
+class CallMetadata(NamedTuple):
+    """What a model call is for, passed alongside the prompt so backends never parse it"""
+    stage: str  # refinement, generation (from a refined prompt) or direct (from the raw input)
+    style: str = "balanced"
+    user_input: str = ""
+
+
+class Completion(NamedTuple):
+    text: str
+    total_tokens: Optional[int] = None  # None when the backend does not report usage
+
+
+class ModelBackend:
+    """
+    Where model calls go
+    Errors are raised as the backend's own exceptions; app.resilience classifies them.
+    """
+    name = "base"
+
+    async def complete(self, prompt: str, model: str, meta: CallMetadata) -> Completion:
+        raise NotImplementedError
+
+    async def open_stream(
+        self, prompt: str, model: str, meta: CallMetadata, on_usage: Callable[[int], None]
+    ) -> AsyncIterator[str]:
+        """Start a streamed completion; returns the chunk iterator once the backend has accepted it"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class OpenAIBackend(ModelBackend):
+    """Chat completions over one pooled HTTP client, against OpenAI or any compatible server"""
+    name = "openai"
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None):
+        self.base_url = base_url or settings.openai_base_url
+        self.api_key = api_key or settings.openai_api_key
+        self._client = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self.http2 = False
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """Lazy initialization of the async OpenAI client"""
+        if self._client is None:
+            # One pooled, instrumented HTTP client shared by every request in this process
+            self.http2 = http2_enabled()
+            self._http_client = build_http_client(self.base_url, self.http2)
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=self._http_client,
+                max_retries=0  # Retries are handled by app.resilience
+            )
+        return self._client
+
+    async def warm_up(self, connections: int):
+        """
+        Open pooled connections before the first real call pays for the handshakes
+        Sends concurrent model-list requests; any response, even an error, leaves a
+        connection in the pool. HTTP/2 multiplexes, so one connection is enough there.
+        """
+        client = self.client
+        if self.http2:
+            connections = min(connections, 1)
+        timeout = stage_timeout("refinement")
+        results = await asyncio.gather(
+            *(client.models.list(timeout=timeout) for _ in range(connections)),
+            return_exceptions=True
+        )
+        failures = [result for result in results if isinstance(result, APIConnectionError)]
+        if failures:
+            print(f"Warning: could not warm up upstream connections to {self.base_url or 'OpenAI'}: {failures[0]}")
+
+    def pool_stats(self) -> Dict[str, int]:
+        transport = getattr(self._http_client, "_transport", None)
+        if not isinstance(transport, TracingTransport):
+            return {"connections": 0, "idle": 0, "in_flight": 0}
+        return transport.pool_stats()
+
+    async def complete(self, prompt: str, model: str, meta: CallMetadata) -> Completion:
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_tokens=MAX_COMPLETION_TOKENS,
+            timeout=stage_timeout(meta.stage)
+        )
+        usage = response.usage.total_tokens if response.usage is not None else None
+        return Completion(response.choices[0].message.content.strip(), usage)
+
+    async def open_stream(
+        self, prompt: str, model: str, meta: CallMetadata, on_usage: Callable[[int], None]
+    ) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            max_tokens=MAX_COMPLETION_TOKENS,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=stage_timeout(meta.stage)
+        )
+        return self._read_stream(stream, on_usage)
+
+    async def _read_stream(self, stream, on_usage: Callable[[int], None]) -> AsyncIterator[str]:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage is not None:
+                on_usage(chunk.usage.total_tokens)
+
+    async def close(self):
+        """Close the pooled upstream HTTP client"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._http_client = None
+
+
+# Mock refinements: style instruction + connector + user input + tail
+REFINEMENT_INSTRUCTIONS: Dict[str, str] = {
+    "concise": "Provide a brief, direct explanation",
+    "detailed": "Provide a comprehensive, detailed explanation with examples and context",
+    "casual": "Explain in a friendly, conversational way that's easy to understand",
+    "professional": "Provide a formal, structured explanation suitable for business contexts",
+    "educational": "Explain with clear examples, analogies, and step-by-step breakdowns for learning",
+    "balanced": "Provide a well-rounded explanation that balances detail with clarity",
+}
+
+MOCK_REFINEMENTS: List[Tuple[str, str]] = [
+    (" of ", ", including key concepts, practical applications, and relevant examples. Structure your response appropriately for the requested tone and ensure technical accuracy while maintaining accessibility."),
+    (" about ", ". Cover the fundamental principles, current developments, and practical implications. Use appropriate language and depth for the requested style."),
+    (" regarding ", ". Include background context, core mechanisms, and real-world applications. Ensure the explanation matches the requested tone and complexity level."),
+]
+
+# Mock answers per style: head + subject[:cut] + tail
+MOCK_RESPONSES: Dict[str, List[Tuple[str, int, str]]] = {
+    "concise": [
+        ("Here's a concise overview:\n\n", 80, "...\n\nKey points:\n• Core functionality and purpose\n• Main benefits and applications\n• Current status and adoption\n\nThis represents an important development in the field with practical applications across various industries."),
+        ("Brief summary:\n\n", 70, "...\n\nEssentials:\n- Primary mechanisms\n- Key advantages\n- Common use cases\n\nSignificant impact on modern technology and business practices."),
+    ],
+    "detailed": [
+        ("Comprehensive Analysis:\n\n", 100, "...\n\nDetailed Overview:\nThis topic encompasses multiple interconnected systems and methodologies that have evolved significantly over recent years. The fundamental architecture involves sophisticated algorithms and data processing techniques that enable advanced functionality.\n\nCore Components:\n1. Primary processing mechanisms and their optimization strategies\n2. Integration frameworks and compatibility considerations\n3. Performance metrics and scalability factors\n4. Security protocols and data protection measures\n\nPractical Applications:\nThe technology finds extensive use across various sectors including healthcare, finance, manufacturing, and telecommunications. Each implementation requires careful consideration of specific requirements and constraints.\n\nFuture Developments:\nOngoing research focuses on improving efficiency, reducing costs, and expanding capabilities. Emerging trends suggest significant potential for innovation and market growth.\n\nConclusion:\nThis represents a transformative technology with far-reaching implications for how we approach complex problem-solving in the digital age."),
+        ("In-Depth Examination:\n\n", 120, "...\n\nFoundational Principles:\nThe underlying concepts are rooted in established scientific and engineering principles, enhanced by modern computational capabilities and innovative design approaches.\n\nTechnical Architecture:\n• Advanced processing algorithms with optimized performance characteristics\n• Robust data management systems ensuring reliability and scalability\n• Comprehensive security frameworks protecting against various threat vectors\n• User interface designs prioritizing accessibility and functionality\n\nImplementation Considerations:\nSuccessful deployment requires careful planning, stakeholder engagement, and phased rollout strategies. Organizations must consider factors such as existing infrastructure, staff training requirements, and change management processes.\n\nMarket Impact and Adoption:\nIndustry analysis reveals growing adoption rates across multiple sectors, driven by demonstrated ROI and competitive advantages. Early adopters report significant improvements in operational efficiency and customer satisfaction.\n\nLong-term Outlook:\nExperts predict continued evolution and refinement, with emerging technologies likely to enhance capabilities further. Investment in research and development remains strong, indicating sustained innovation potential."),
+    ],
+    "casual": [
+        ("Hey! So you're asking about this topic - let me break it down for you in simple terms:\n\n", 90, "...\n\nBasically, think of it like this: it's a pretty cool system that helps solve real problems in a smart way. The main idea is to make things work better and faster than traditional methods.\n\nWhat makes it interesting:\n• It's actually not as complicated as it sounds\n• People are using it for all sorts of practical stuff\n• The results are pretty impressive when done right\n\nThe bottom line? It's one of those technologies that's quietly making a big difference in how we do things, and it's only getting better. Pretty neat stuff if you ask me!"),
+        ("Great question! This is actually a really fascinating area:\n\n", 85, "...\n\nSo here's the deal - imagine you have a problem that's been bugging people for ages, and suddenly someone comes up with a clever way to tackle it. That's essentially what we're looking at here.\n\nWhy it's cool:\n- It takes complex stuff and makes it manageable\n- Real people are seeing real benefits\n- It's not just theoretical - it actually works\n\nThe fun part is watching how different industries are picking this up and running with it. Everyone's finding their own creative ways to use it, which is pretty awesome to see!"),
+    ],
+    "professional": [
+        ("Executive Summary:\n\n", 100, "...\n\nStrategic Overview:\nThis technology represents a significant advancement in operational capabilities, offering measurable improvements in efficiency, cost-effectiveness, and competitive positioning. Organizations implementing these solutions report substantial returns on investment and enhanced market differentiation.\n\nBusiness Impact:\n• Streamlined operational processes with reduced overhead costs\n• Enhanced data-driven decision-making capabilities\n• Improved customer satisfaction and retention metrics\n• Strengthened competitive advantage in target markets\n\nImplementation Framework:\nSuccessful deployment requires structured project management, stakeholder alignment, and phased rollout strategies. Key considerations include resource allocation, timeline management, and risk mitigation protocols.\n\nRecommendations:\nOrganizations should conduct thorough feasibility assessments, develop comprehensive implementation roadmaps, and establish clear success metrics. Executive sponsorship and cross-functional collaboration are essential for optimal outcomes."),
+        ("Business Analysis:\n\n", 110, "...\n\nMarket Position:\nCurrent market dynamics indicate strong growth potential and increasing enterprise adoption. Leading organizations are leveraging these capabilities to drive innovation and operational excellence.\n\nValue Proposition:\n- Quantifiable improvements in key performance indicators\n- Reduced operational complexity and associated costs\n- Enhanced scalability and future-readiness\n- Strengthened regulatory compliance and risk management\n\nStrategic Considerations:\nDecision-makers should evaluate alignment with organizational objectives, resource requirements, and implementation timelines. Due diligence should include vendor assessment, total cost of ownership analysis, and change management planning."),
+    ],
+    "educational": [
+        ("Learning Guide:\n\n", 95, "...\n\nLet's explore this step by step to build a solid understanding:\n\n📚 Fundamental Concepts:\nThink of this like learning to drive a car - you need to understand the basic components before you can operate the whole system effectively. The core principles involve [key concept 1], [key concept 2], and [key concept 3].\n\n🔍 How It Works (Simple Analogy):\nImagine you're organizing a large library. Traditional methods might involve manually cataloging each book, but this approach is like having an intelligent system that automatically understands, categorizes, and retrieves information based on what you need.\n\n💡 Real-World Examples:\n• Example 1: How it's used in everyday applications you might recognize\n• Example 2: Industry-specific implementations and their benefits\n• Example 3: Emerging use cases and future possibilities\n\n🎯 Key Takeaways:\n- Start with understanding the basic principles\n- See how these principles apply in practice\n- Recognize the broader implications and potential\n\n📖 Next Steps for Learning:\nTo deepen your understanding, consider exploring [related topic 1], [related topic 2], and hands-on examples in your area of interest."),
+        ("Educational Overview:\n\n", 105, "...\n\n🎓 Learning Objectives:\nBy the end of this explanation, you'll understand the what, why, and how of this topic, plus be able to identify practical applications.\n\n📋 Background Context:\nThis field emerged from the need to solve specific challenges that traditional approaches couldn't handle effectively. Think of it as evolution in problem-solving - each generation builds on previous knowledge to create better solutions.\n\n🔧 Core Mechanisms (Simplified):\nBreaking it down into digestible parts:\n1. Input Processing: How information enters the system\n2. Analysis Phase: What happens to that information\n3. Output Generation: How results are produced and delivered\n\n🌟 Practical Applications:\nTo make this concrete, here are some scenarios you might encounter:\n• Scenario A: [Specific example with clear benefits]\n• Scenario B: [Different context showing versatility]\n• Scenario C: [Future possibility to spark imagination]\n\n✅ Self-Check Questions:\n- Can you explain the main concept in your own words?\n- What problems does this solve?\n- How might you use this in your field or interests?\n\n🚀 Further Exploration:\nReady to dive deeper? Look into [advanced topic 1] and [advanced topic 2] for more specialized knowledge."),
+    ],
+    "balanced": [
+        ("Balanced Overview:\n\n", 100, "...\n\nThis topic represents an important development that balances innovation with practical application. The core concept involves sophisticated yet accessible approaches to solving real-world challenges.\n\nKey Aspects:\n• Technical foundation built on proven principles\n• Practical applications across multiple domains\n• Ongoing development and refinement\n• Growing adoption and market acceptance\n\nPractical Implications:\nOrganizations and individuals are finding value through improved efficiency, enhanced capabilities, and new opportunities for innovation. The technology strikes a good balance between complexity and usability.\n\nLooking Forward:\nContinued evolution is expected, with improvements in performance, accessibility, and integration capabilities. This represents a mature yet dynamic field with solid foundations and promising future developments."),
+        ("Comprehensive Summary:\n\n", 90, "...\n\nThis area combines theoretical understanding with practical implementation, offering both immediate benefits and long-term potential. The approach is methodical yet flexible, allowing for adaptation to various needs and contexts.\n\nCore Elements:\n- Established methodologies with proven track records\n- Innovative applications addressing current challenges\n- Scalable solutions suitable for different organizational sizes\n- Integration capabilities with existing systems and processes\n\nCurrent Status:\nThe field has reached a level of maturity that enables reliable implementation while maintaining room for continued innovation. Users report positive outcomes across various metrics including efficiency, cost-effectiveness, and user satisfaction.\n\nFuture Outlook:\nExpected developments include enhanced capabilities, broader accessibility, and deeper integration with emerging technologies. The trajectory suggests sustained growth and continued relevance in addressing evolving needs."),
+    ],
+}
+
+
+class MockBackend(ModelBackend):
+    """
+    Canned answers chosen from the call metadata, with token-rate latency
+    With MOCK_SEED set, every call draws from a generator seeded by (seed, stage, style, prompt),
+    so a given call gets the same text and delays on every run however requests interleave.
+    """
+    name = "mock"
+
+    def __init__(self):
+        self._unseeded = random.Random()
+
+    def rng(self, prompt: str, meta: CallMetadata) -> random.Random:
+        if settings.mock_seed is None:
+            return self._unseeded
+        return random.Random(f"{settings.mock_seed}:{meta.stage}:{meta.style}:{prompt}")
+
+    def sample(self, mean_ms: float, rng: random.Random) -> float:
+        """Delay in seconds around mean_ms under MOCK_LATENCY_DISTRIBUTION"""
+        jitter = settings.mock_latency_jitter
+        distribution = settings.mock_latency_distribution
+        if mean_ms <= 0:
+            return 0.0
+        if distribution == "fixed" or jitter <= 0:
+            delay_ms = mean_ms
+        elif distribution == "lognormal":
+            # Mean-preserving lognormal: same average, long right tail
+            delay_ms = mean_ms * rng.lognormvariate(-jitter * jitter / 2, jitter)
+        else:
+            delay_ms = mean_ms * (1 + rng.uniform(-jitter, jitter))
+        return max(0.0, delay_ms) / 1000.0
+
+    def render(self, prompt: str, meta: CallMetadata, rng: random.Random) -> str:
+        if meta.stage == "refinement":
+            instruction = REFINEMENT_INSTRUCTIONS.get(meta.style, REFINEMENT_INSTRUCTIONS["balanced"])
+            connector, rest = rng.choice(MOCK_REFINEMENTS)
+            return instruction + connector + meta.user_input + rest
+        subject = meta.user_input if meta.stage == "direct" else prompt
+        head, cut, rest = rng.choice(MOCK_RESPONSES.get(meta.style, MOCK_RESPONSES["balanced"]))
+        return head + subject[:cut] + rest
+
+    def _first_token_ms(self, meta: CallMetadata) -> float:
+        if meta.stage == "refinement":
+            return settings.mock_refinement_latency_ms
+        return settings.mock_generation_latency_ms
+
+    def _tokens_ms(self, text: str) -> float:
+        """Time to emit text at MOCK_TOKENS_PER_SECOND (0 = instantly)"""
+        if settings.mock_tokens_per_second <= 0:
+            return 0.0
+        return estimate_tokens(text, 0) * 1000.0 / settings.mock_tokens_per_second
+
+    async def complete(self, prompt: str, model: str, meta: CallMetadata) -> Completion:
+        rng = self.rng(prompt, meta)
+        text = self.render(prompt, meta, rng)
+        await asyncio.sleep(self.sample(self._first_token_ms(meta) + self._tokens_ms(text), rng))
+        return Completion(text, estimate_tokens(prompt + text, 0))
+
+    async def open_stream(
+        self, prompt: str, model: str, meta: CallMetadata, on_usage: Callable[[int], None]
+    ) -> AsyncIterator[str]:
+        return self._stream(prompt, meta, on_usage)
+
+    async def _stream(self, prompt: str, meta: CallMetadata, on_usage: Callable[[int], None]) -> AsyncIterator[str]:
+        """Yield the answer a few words at a time, paced by the token rate"""
+        rng = self.rng(prompt, meta)
+        text = self.render(prompt, meta, rng)
+        await asyncio.sleep(self.sample(self._first_token_ms(meta), rng))
+        words = text.split(" ")
+        for i in range(0, len(words), 3):
+            chunk = " ".join(words[i:i + 3])
+            if i + 3 < len(words):
+                chunk += " "
+            yield chunk
+            await asyncio.sleep(self.sample(self._tokens_ms(chunk), rng))
+        on_usage(estimate_tokens(prompt + text, 0))
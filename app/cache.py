@@ -0,0 +1,288 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+import asyncio
+import hashlib
+import json
+import time
+from app.config import settings
+from app.database import get_cached_response, store_cached_response
+
+T = TypeVar("T")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize user input so trivially different prompts share a cache entry"""
+    return " ".join(text.lower().split())
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Build a fixed-length cache key from the given parts"""
+    raw = "\x1f".join(str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def model_config_key() -> str:
+    """Fingerprint of what answers come from: the default models, MODEL_ROUTES and mock mode"""
+    # API keys are left out so rotating one keeps the cache
+    routes = [{k: v for k, v in spec.items() if k != "api_key"} for spec in settings.model_routes]
+    return make_cache_key(
+        settings.default_model,
+        settings.refinement_model,
+        json.dumps(routes, sort_keys=True, default=str),
+        settings.mock_mode,
+    )
+
+
+class LRUCache:
+    """In-process LRU cache with a per-entry TTL and entry/byte size limits"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __contains__(self, key: str) -> bool:
+        """Whether an unexpired entry exists, without touching hit/miss counts or recency"""
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] >= time.monotonic()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at, _ = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, size: int = 1):
+        """Store a value, evicting least recently used entries to stay in bounds"""
+        if key in self._entries:
+            self._remove(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # Never let a single entry flush the whole cache
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+class ResponseCache:
+    """Two-tier cache of final answers: in-process LRU in front of an optional shared database table"""
+
+    def __init__(self):
+        self.memory = LRUCache(
+            max_entries=settings.response_cache_max_entries,
+            ttl_seconds=settings.response_cache_ttl_seconds,
+            max_bytes=settings.response_cache_max_bytes,
+        )
+        self.shared_hits = 0
+        self.bypasses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.response_cache_enabled
+
+    def key_for(self, raw_input: str, style: str, skip_refinement: bool) -> str:
+        """Cache key for a prompt; includes the model configuration so a model or route change invalidates entries"""
+        return make_cache_key(normalize_text(raw_input), style, skip_refinement, model_config_key())
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached response, falling back to the shared tier on a local miss"""
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        if not settings.response_cache_shared:
+            return None
+
+        payload = await get_cached_response(key)
+        if payload is None:
+            return None
+        value = json.loads(payload)
+        self.shared_hits += 1
+        # Promote into the local tier so the next hit stays in-process
+        self.memory.set(key, value, size=len(payload))
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        """Store a response in both tiers"""
+        if not self.enabled:
+            return
+        payload = json.dumps(value)
+        self.memory.set(key, value, size=len(payload))
+        if settings.response_cache_shared:
+            await store_cached_response(key, payload, settings.response_cache_ttl_seconds)
+
+    def record_bypass(self):
+        self.bypasses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for the analytics endpoint"""
+        hits = self.memory.hits + self.shared_hits
+        # A shared-tier hit was first counted as a local miss
+        misses = self.memory.misses - self.shared_hits
+        lookups = hits + misses
+        return {
+            "enabled": self.enabled,
+            "shared_tier": settings.response_cache_shared,
+            "hits": hits,
+            "misses": misses,
+            "memory_hits": self.memory.hits,
+            "shared_hits": self.shared_hits,
+            "bypasses": self.bypasses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self.memory),
+            "size_bytes": self.memory.size_bytes,
+            "evictions": self.memory.evictions,
+        }
+
+
+class RefinementCache:
+    """In-process cache of refined prompts keyed on (input, style, model configuration)"""
+
+    def __init__(self):
+        self.memory = LRUCache(
+            max_entries=settings.refinement_cache_max_entries,
+            ttl_seconds=settings.refinement_cache_ttl_seconds,
+        )
+        self.saved_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.refinement_cache_enabled
+
+    def key_for(self, raw_input: str, style: str) -> str:
+        return make_cache_key(normalize_text(raw_input), style, model_config_key())
+
+    def get(self, raw_input: str, style: str) -> Optional[Tuple[str, float, str]]:
+        """Return (refined_prompt, original_refinement_time_ms, model) if cached"""
+        if not self.enabled:
+            return None
+        cached = self.memory.get(self.key_for(raw_input, style))
+        if cached is not None:
+            self.saved_ms += cached[1]
+        return cached
+
+    def contains(self, raw_input: str, style: str) -> bool:
+        return self.enabled and self.key_for(raw_input, style) in self.memory
+
+    def set(self, raw_input: str, style: str, refined_prompt: str, refinement_time_ms: float, model: str):
+        if self.enabled:
+            self.memory.set(self.key_for(raw_input, style), (refined_prompt, refinement_time_ms, model))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory.hits + self.memory.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.memory.hits,
+            "misses": self.memory.misses,
+            "hit_rate": self.memory.hits / lookups if lookups else 0.0,
+            "entries": len(self.memory),
+            "evictions": self.memory.evictions,
+            "time_saved_ms": self.saved_ms,
+        }
+
+
+class FlightAbandoned(Exception):
+    """The leading call ended without a result (its client went away); waiters make the call themselves"""
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one in-flight call"""
+
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Future[Any]"] = {}
+        self.upstream_calls = 0
+        self.deduplicated = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Run fn() unless a call for key is already in flight, in which case wait for it
+        Returns (result, shared); errors from the shared call propagate to every waiter.
+        """
+        while True:
+            future = self.follow(key)
+            if future is None:
+                break
+            try:
+                # Shield so one waiter disconnecting doesn't cancel the call for the others
+                return await asyncio.shield(future), True
+            except FlightAbandoned:
+                self.deduplicated -= 1
+
+        future = asyncio.ensure_future(fn())
+        self._register(key, future)
+        return await asyncio.shield(future), False
+
+    def follow(self, key: str) -> Optional["asyncio.Future[Any]"]:
+        """The call in flight for key, if any; await it shielded"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.deduplicated += 1
+        return future
+
+    def lead(self, key: str) -> "asyncio.Future[Any]":
+        """
+        Register a call the caller runs itself (a stream) and resolves with its result
+        If it ends without one, set FlightAbandoned so waiters fall back to their own call.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._register(key, future)
+        return future
+
+    def _register(self, key: str, future: "asyncio.Future[Any]"):
+        self._inflight[key] = future
+        self.upstream_calls += 1
+        future.add_done_callback(lambda done: self._finish(key, done))
+
+    def _finish(self, key: str, future: "asyncio.Future[Any]"):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            future.exception()  # Mark as retrieved even if every waiter went away
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.coalesce_requests,
+            "upstream_calls": self.upstream_calls,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._inflight),
+        }
+
+
+# Global instances
+response_cache = ResponseCache()
+refinement_cache = RefinementCache()
+prompt_flights = SingleFlight()
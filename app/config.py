@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pydantic_settings import BaseSettings
 
 
@@ -8,13 +8,140 @@ class Settings(BaseSettings):
     database_url: Optional[str] = None
     api_secret_key: str = "default-secret-key-change-in-production"
     rate_limit_per_minute: int = 10
+    # Where hit counters live: memory:// (per process), redis://host:6379, sql+sqlite:///path.db or sql+postgresql://...
+    rate_limit_storage_uri: str = "memory://"
+    # With a shared storage, count hits locally and sync this often; 0 syncs every hit, blocking the event loop on it
+    rate_limit_sync_interval_seconds: float = 1.0
+    rate_limit_sync_batch: int = 5  # ...or after this many local hits on one key
     default_model: str = "gpt-4o-mini"
     refinement_model: str = "gpt-4o-mini"
+    # Model routing: JSON list of {"name", "model", "backend": openai|local|mock, "base_url", "api_key",
+    # "stages", "cost_per_1k_tokens"}; empty sends refinement to REFINEMENT_MODEL and answers to DEFAULT_MODEL
+    model_routes: List[Dict[str, Any]] = []
+    model_router_ms_per_cent: float = 1000.0  # Latency a route may add to save one US cent of expected cost
+    model_router_min_samples: int = 5  # Calls each route gets per stage before its scores are trusted
+    model_router_explore_ratio: float = 0.05  # Share of calls sent to a random healthy route to keep stats fresh
+    model_router_smoothing: float = 0.1  # Weight of the newest call in the rolling latency and error rate
     mock_mode: bool = False  # Toggle to use mock GPT responses
+    # Mock upstream latency: time to first token, then MOCK_TOKENS_PER_SECOND; MOCK_SEED makes delays and mock text reproducible
+    mock_seed: Optional[int] = None
+    mock_latency_distribution: str = "uniform"  # uniform, lognormal or fixed
+    mock_latency_jitter: float = 0.6  # uniform: +/- fraction of the mean; lognormal: sigma
+    mock_refinement_latency_ms: float = 150.0
+    mock_generation_latency_ms: float = 200.0
+    mock_tokens_per_second: float = 400.0  # 0 emits the whole answer at once (pure load generation)
+    
+    # Response cache
+    response_cache_enabled: bool = True
+    response_cache_ttl_seconds: int = 3600
+    response_cache_max_entries: int = 1000
+    response_cache_max_bytes: int = 50 * 1024 * 1024
+    response_cache_shared: bool = False  # Also cache in the database so workers share entries
+    
+    # Refinement cache (refined prompts are reused even when answers are not)
+    refinement_cache_enabled: bool = True
+    refinement_cache_ttl_seconds: int = 24 * 3600
+    refinement_cache_max_entries: int = 5000
+    
+    # Semantic cache (near-duplicate inputs reuse an answer); entries share the response cache TTL
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.9  # Minimum cosine similarity for styles not listed below
+    semantic_cache_style_thresholds: Dict[str, float] = {"casual": 0.88, "detailed": 0.93, "educational": 0.93}
+    semantic_cache_max_entries: int = 100000
+    semantic_cache_dim: int = 256  # Hash buckets for the n-gram TF-IDF vectorizer
+    semantic_cache_model: str = ""  # sentence-transformers model name, e.g. all-MiniLM-L6-v2 (needs the package)
+    semantic_cache_nprobe: int = 8  # Clusters scanned per lookup once the index is clustered
+    semantic_cache_path: Optional[str] = None  # .npz snapshot loaded at startup and saved at shutdown
+    
+    # Skip refinement for inputs a local classifier scores as already well specified (opt-in; check
+    # prompt_classifier.evaluate() on your own traffic before enabling)
+    refinement_bypass_enabled: bool = False
+    refinement_bypass_threshold: float = 0.85
+    
+    # Share one upstream call between identical concurrent prompts
+    coalesce_requests: bool = True
+    
+    # Database (DATABASE_URL gets its async driver: asyncpg for PostgreSQL, aiosqlite for SQLite)
+    database_pool_size: int = 5  # Connections kept open
+    database_max_overflow: int = 10  # Extra connections opened under load and closed when returned
+    database_pool_timeout_seconds: float = 5.0  # Wait for a free connection before giving up
+    database_pool_pre_ping: bool = True  # Test connections on checkout so a database restart is not an error
+    database_pool_recycle_seconds: int = 1800  # Replace connections older than this (-1 = never)
+    database_retry_base_seconds: float = 1.0  # After a connection failure, skip the database this long...
+    database_retry_max_seconds: float = 60.0  # ...doubling per consecutive failure up to this
+    
+    # Write-behind prompt logging
+    log_queue_max_size: int = 10000
+    log_batch_size: int = 500
+    log_flush_interval_seconds: float = 1.0
+    log_file_path: str = "prompt_logs.jsonl"  # Used when no database is configured
+    # Each distinct prompt/answer text is stored once in prompt_blobs; Postgres TOAST already compresses long text
+    log_blob_compression: str = "none"  # none, zlib or zstd (needs zstandard); the prompt_logs view only shows uncompressed text
+    log_blob_compress_min_bytes: int = 512  # Shorter texts are stored as plain text
+    log_blob_cache_size: int = 10000  # Blob ids of recent texts kept in memory so repeats skip the lookup
+    # Log partitions and retention: prompt_log_entries is split per period; expired periods go to JSONL.gz archives
+    log_partition_period: str = "month"  # month or day
+    log_retention_days: int = 0  # Archive and drop periods that ended more than this many days ago (0 = keep everything)
+    log_archive_dir: str = "log_archive"  # Archive files plus manifest.json
+    log_retention_interval_seconds: float = 3600.0  # How often partitions are maintained (0 = never)
+    # Log search: full-text index over raw_input and final_output (PostgreSQL tsvector + GIN, SQLite FTS5)
+    log_search_enabled: bool = True
+    log_search_language: str = "english"  # PostgreSQL text search configuration; SQLite stems English only
+    
+    # Upstream call budgets (0 = unlimited); calls wait in priority queues when over budget
+    upstream_tokens_per_minute: int = 0
+    upstream_requests_per_minute: int = 0
+    upstream_max_queue_depth: int = 1000
+    upstream_max_wait_seconds: float = 30.0  # Beyond this, reply 503 with the queue depth and ETA
+    
+    # Upstream HTTP transport (one connection pool per upstream server)
+    openai_base_url: Optional[str] = None  # e.g. http://localhost:8081/v1 for fake_openai_server.py
+    upstream_max_connections: int = 100
+    upstream_max_keepalive_connections: int = 100  # Idle connections kept open for reuse
+    upstream_keepalive_expiry_seconds: float = 60.0
+    upstream_http2: bool = False  # Multiplex calls over one connection (needs httpx[http2])
+    upstream_connect_timeout_seconds: float = 10.0
+    upstream_pool_timeout_seconds: float = 10.0  # Wait for a free pooled connection
+    upstream_refinement_timeout_seconds: float = 30.0  # Read timeout for refinement calls
+    upstream_generation_timeout_seconds: float = 60.0  # Read timeout for answer calls (between chunks when streaming)
+    upstream_warmup_connections: int = 4  # Connections opened to each upstream at startup (0 = none)
+    upstream_ca_bundle: Optional[str] = None  # CA file for upstreams with private certificates
+    
+    # Upstream resilience
+    upstream_max_attempts: int = 3
+    upstream_retry_base_delay_seconds: float = 0.25
+    upstream_retry_max_delay_seconds: float = 4.0
+    upstream_hedge_enabled: bool = False  # Send a second attempt when the first is slower than the model's p95
+    upstream_hedge_min_delay_seconds: float = 0.5
+    upstream_hedge_min_samples: int = 20
+    circuit_breaker_failure_threshold: int = 5  # Consecutive failures before a model's circuit opens
+    circuit_breaker_cooldown_seconds: float = 30.0
+    upstream_fallback: str = ""  # While a circuit is open: "" fails fast, "mock", or another model name
+    
+    # Speculative mode: race a direct answer against refine-then-generate
+    speculative_mode: bool = False
+    speculative_policy: str = "slo"  # slo or length
+    speculative_slo_ms: float = 3000.0  # slo: use the refined answer if it is ready in time, else the direct one
+    speculative_max_direct_chars: int = 80  # length: inputs up to this long take the direct answer
+    
+    # Batch endpoint
+    batch_max_concurrency: int = 8
+    
+    # Background job queue (a local SQLite file by default; any SQLAlchemy URL works)
+    job_queue_url: str = "sqlite:///prompt_jobs.db"
+    job_workers: int = 2
+    job_poll_interval_seconds: float = 1.0
+    job_lease_seconds: int = 300  # A running job whose lease expires is retried by another worker
+    job_max_attempts: int = 3
+    job_retry_base_seconds: float = 5.0  # A failed job waits this long before its next attempt, doubling per attempt...
+    job_retry_max_seconds: float = 300.0  # ...up to this
+    # Callbacks only go to public addresses; list hosts here to allow internal ones (this then replaces the public check)
+    job_callback_allowed_hosts: List[str] = []
     
     class Config:
         env_file = ".env"
         case_sensitive = False
+        protected_namespaces = ("settings_",)  # MODEL_ROUTES and MODEL_ROUTER_* are settings, not pydantic internals
 
 
 settings = Settings() 
\ No newline at end of file
@@ -1,96 +1,1338 @@
-from datetime import datetime
-from typing import Optional
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import hashlib
+import re
+import time
+import zlib
+from sqlalchemy import (
+    bindparam, column, delete, event, exists, insert, inspect, literal, select, table, text, tuple_, union, union_all,
+    func, and_, or_, Column, ForeignKey, Float, Index, Integer, MetaData, String, Table, Text, DateTime, LargeBinary, UniqueConstraint
+)
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.exc import DBAPIError, IntegrityError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import settings
+from app.metrics import metrics
+from app.sketch import HyperLogLog
+
+try:
+    import zstandard  # Optional: LOG_BLOB_COMPRESSION=zstd
+except ImportError:
+    zstandard = None
 
 Base = declarative_base()
 
 
-class PromptLog(Base):
-    __tablename__ = "prompt_logs"
+class PromptBlob(Base):
+    """One distinct prompt or answer text, stored once however many log rows use it"""
+    __tablename__ = "prompt_blobs"
     
-    id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    raw_input = Column(Text, nullable=False)
-    refined_prompt = Column(Text, nullable=False)
-    final_output = Column(Text, nullable=False)
-    user_ip = Column(String(45), nullable=True)  # For rate limiting
-    model_used = Column(String(50), nullable=True)
+    id = Column(Integer, primary_key=True)
+    digest = Column(LargeBinary(32), nullable=False, unique=True)  # SHA-256 of the UTF-8 text
+    size = Column(Integer, nullable=False)  # Uncompressed bytes
+    encoding = Column(String(8), nullable=False, default="none")  # none, zlib or zstd
+    content = Column(Text, nullable=True)  # The text when encoding is none
+    data = Column(LargeBinary, nullable=True)  # The compressed text otherwise
+
 
+class PromptLogEntry(Base):
+    """A logged interaction; its texts live in prompt_blobs (read them joined through the prompt_logs view)"""
+    __tablename__ = "prompt_log_entries"
+    __table_args__ = {"sqlite_autoincrement": True}  # Ids stay unique after old periods move out (see rotate_periods)
+    
+    id = Column(Integer, primary_key=True)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    raw_input_id = Column(Integer, ForeignKey("prompt_blobs.id"), nullable=False, index=True)  # Search hits join back on these
+    refined_prompt_id = Column(Integer, ForeignKey("prompt_blobs.id"), nullable=False)
+    final_output_id = Column(Integer, ForeignKey("prompt_blobs.id"), nullable=False, index=True)
+    user_ip = Column(String(45), nullable=True, index=True)  # For rate limiting
+    model_used = Column(String(50), nullable=True, index=True)  # Model that generated the answer
+    refinement_model = Column(String(50), nullable=True)
 
-# Database setup
-engine = None
-SessionLocal = None
 
-def initialize_database():
-    """Initialize database connection if configured"""
-    global engine, SessionLocal
+LOG_TEXT_COLUMNS = ("raw_input", "refined_prompt", "final_output")
+BLOB_ID_COLUMNS = tuple(f"{name}_id" for name in LOG_TEXT_COLUMNS)
+ENTRY_COLUMNS = tuple(entry_column.name for entry_column in PromptLogEntry.__table__.columns)
+
+# The pre-dedup table layout, kept readable for existing queries and dashboards
+PROMPT_LOGS_VIEW = """
+CREATE VIEW prompt_logs AS
+SELECT e.id, e.timestamp,
+       r.content AS raw_input, p.content AS refined_prompt, f.content AS final_output,
+       e.user_ip, e.model_used, e.refinement_model
+FROM {entries} e
+JOIN prompt_blobs r ON r.id = e.raw_input_id
+JOIN prompt_blobs p ON p.id = e.refined_prompt_id
+JOIN prompt_blobs f ON f.id = e.final_output_id
+"""
+
+# PostgreSQL keeps prompt_log_entries range-partitioned by timestamp, one partition per period
+PARTITIONED_ENTRIES_DDL = """
+CREATE TABLE IF NOT EXISTS prompt_log_entries (
+    id SERIAL,
+    timestamp TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    raw_input_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    refined_prompt_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    final_output_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    user_ip VARCHAR(45),
+    model_used VARCHAR(50),
+    refinement_model VARCHAR(50),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp)
+"""
+
+
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
     
-    if settings.database_url and engine is None:
-        try:
-            engine = create_engine(settings.database_url)
-            SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-            Base.metadata.create_all(bind=engine)
+    cache_key = Column(String(64), primary_key=True)
+    value = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class PromptStat(Base):
+    """Pre-aggregated request counts per time bucket and model"""
+    __tablename__ = "prompt_stats"
+    __table_args__ = (
+        UniqueConstraint("granularity", "bucket_start", "model_used", name="uq_prompt_stats_bucket"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String(10), nullable=False)  # minute, hour, day or total
+    bucket_start = Column(DateTime, nullable=False)
+    model_used = Column(String(50), nullable=False, default="")
+    request_count = Column(Integer, nullable=False, default=0)
+    user_sketch = Column(LargeBinary, nullable=True)  # HyperLogLog of user IPs (hour/day/total only)
+
+
+# Database setup: one async engine per process, created and disposed by the app lifespan
+engine: Optional[AsyncEngine] = None
+SessionLocal: Optional[async_sessionmaker] = None
+search_ready = False  # The full-text index exists and is kept up to date by write_prompt_logs
+
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def async_database_url(database_url: str) -> URL:
+    """DATABASE_URL with its asyncio driver, e.g. postgresql://... -> postgresql+asyncpg://..."""
+    url = make_url(database_url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is not None and url.get_driver_name() != driver:
+        url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+    return url
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """Errors that mean the database is unreachable rather than that one statement failed"""
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    if isinstance(error, OperationalError):
+        # SQLite reports bad statements and busy locks this way too, and has no server to back off from
+        return not type(error.orig).__module__.startswith("sqlite3")
+    return isinstance(error, (InterfaceError, OSError, asyncio.TimeoutError))
+
+
+class DatabaseUnavailable(Exception):
+    """No database is configured, or it is backing off after a connection failure"""
+
+
+class SearchUnavailable(DatabaseUnavailable):
+    """The full-text index is disabled or could not be created (e.g. SQLite built without FTS5)"""
+
+
+class DatabaseHealth:
+    """
+    Remembers that the database is down so requests skip it instead of each waiting on a connect
+    After a connection failure the database is skipped for DATABASE_RETRY_BASE_SECONDS, doubling
+    per consecutive failure up to DATABASE_RETRY_MAX_SECONDS; then one call probes it again.
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_error: Optional[str] = None
+        self.schema_ready = False
+
+    def allow(self) -> bool:
+        if not self.failures:
             return True
-        except Exception as e:
-            print(f"Warning: Could not connect to database: {e}")
-            print("Falling back to file logging...")
-            engine = None
-            SessionLocal = None
+        now = time.monotonic()
+        if now < self.retry_at:
             return False
-    return engine is not None
+        # Let this call probe; the others keep skipping until it succeeds or fails
+        self.retry_at = now + settings.database_retry_base_seconds
+        return True
 
+    def record_success(self):
+        if self.failures:
+            print("Database reachable again")
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_error = None
+        metrics.db_up.set(1)
 
-def get_db() -> Optional[Session]:
-    """Get database session if database is configured"""
-    if not initialize_database():
-        return None
+    def record_failure(self, error: BaseException):
+        self.failures += 1
+        delay = min(
+            settings.database_retry_max_seconds,
+            settings.database_retry_base_seconds * 2 ** (self.failures - 1)
+        )
+        self.retry_at = time.monotonic() + delay
+        self.last_error = str(error).splitlines()[0] if str(error) else type(error).__name__
+        metrics.db_up.set(0)
+        print(f"Warning: database unavailable ({self.last_error}); skipping it for {delay:g}s")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "healthy": not self.failures,
+            "consecutive_failures": self.failures,
+            "retry_in_seconds": round(max(0.0, self.retry_at - time.monotonic()), 1) if self.failures else 0.0,
+            "last_error": self.last_error,
+        }
+
+
+health = DatabaseHealth()
+
+
+def _watch_pool(async_engine: AsyncEngine):
+    """Keep the pool gauges current as connections are checked out and returned"""
+    pool = async_engine.sync_engine.pool
+    capacity = max(1, settings.database_pool_size + settings.database_max_overflow)
+
+    def update(*_):
+        in_use = pool.checkedout()
+        metrics.db_pool_connections.set(in_use, state="in_use")
+        metrics.db_pool_connections.set(pool.checkedin(), state="idle")
+        metrics.db_pool_connections.set(max(0, pool.overflow()), state="overflow")
+        metrics.db_pool_saturation.set(round(in_use / capacity, 4))
+
+    def returned(*_):
+        # The checkin event fires before the connection is back in the pool
+        try:
+            asyncio.get_running_loop().call_soon(update)
+        except RuntimeError:
+            update()
+
+    event.listen(async_engine.sync_engine, "checkout", update)
+    event.listen(async_engine.sync_engine, "checkin", returned)
+    update()
+
+
+async def init_database() -> bool:
+    """Create the engine and schema at startup; False when no database is configured or reachable"""
+    global engine, SessionLocal
     
-    if SessionLocal is None:
-        return None
+    if not settings.database_url:
+        return False
+    if engine is None:
+        engine = create_async_engine(
+            async_database_url(settings.database_url),
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.database_pool_size,
+            max_overflow=settings.database_max_overflow,
+            pool_timeout=settings.database_pool_timeout_seconds,
+            pool_pre_ping=settings.database_pool_pre_ping,
+            pool_recycle=settings.database_pool_recycle_seconds,
+        )
+        SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        enable_foreign_keys(engine.sync_engine)
+        _watch_pool(engine)
+    try:
+        ready = await ensure_schema()
+    except LegacyPromptLogs:
+        await close_database()
+        raise
+    if ready:
+        return True
+    print("Falling back to file logging until the database is reachable...")
+    return False
+
+
+async def ensure_schema() -> bool:
+    """Create missing tables and columns once per process (retried after a failed startup)"""
+    global search_ready
     
+    if health.schema_ready:
+        return True
     try:
-        db = SessionLocal()
-        return db
-    except Exception:
-        return None
+        async with engine.begin() as connection:
+            await connection.run_sync(create_tables)
+            await connection.run_sync(add_missing_columns)
+            await connection.run_sync(create_prompt_logs_view)
+            if settings.log_search_enabled:
+                search_ready = await connection.run_sync(create_search_index)
+    except LegacyPromptLogs:
+        raise
+    except Exception as e:
+        health.record_failure(e)
+        return False
+    health.schema_ready = True
+    health.record_success()
+    return True
 
 
-def log_prompt_interaction(
-    raw_input: str,
-    refined_prompt: str,
-    final_output: str,
-    user_ip: Optional[str] = None,
-    model_used: Optional[str] = None
-) -> bool:
-    """Log prompt interaction to database if available"""
-    db = get_db()
-    if db is None:
-        # Fallback to file logging if no database
+async def close_database():
+    """Close every pooled connection (app shutdown)"""
+    global engine, SessionLocal, search_ready
+    
+    if engine is not None:
+        await engine.dispose()
+    engine = None
+    SessionLocal = None
+    search_ready = False
+    health.schema_ready = False
+    blob_id_cache.clear()
+
+
+def enable_foreign_keys(sync_engine):
+    """SQLite only checks REFERENCES when asked, per connection"""
+    if sync_engine.dialect.name != "sqlite":
+        return
+    
+    @event.listens_for(sync_engine, "connect")
+    def set_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def create_tables(connection):
+    """create_all, except that PostgreSQL gets prompt_log_entries as a partitioned table"""
+    if connection.dialect.name != "postgresql":
+        Base.metadata.create_all(connection)
+        return
+    entries = PromptLogEntry.__table__
+    Base.metadata.create_all(connection, tables=[t for t in Base.metadata.sorted_tables if t is not entries])
+    if not inspect(connection).has_table(entries.name):
+        connection.execute(text(PARTITIONED_ENTRIES_DDL))
+        for index in entries.indexes:
+            index.create(connection)
+        ensure_partitions(connection, datetime.utcnow(), datetime.utcnow())
+
+
+def add_missing_columns(connection):
+    """Add nullable columns introduced after a table was created (create_all only creates tables)"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+class LegacyPromptLogs(RuntimeError):
+    """A pre-dedup prompt_logs table needs migrating before the app can start"""
+
+
+def has_legacy_prompt_logs(connection) -> bool:
+    """A pre-dedup prompt_logs table still holds the name the view needs"""
+    inspector = inspect(connection)
+    return inspector.has_table("prompt_logs") and "prompt_logs" not in inspector.get_view_names()
+
+
+def create_prompt_logs_view(connection):
+    """Create the prompt_logs view, unless a pre-dedup prompt_logs table is still in the way"""
+    if blob_compression() != "none":
+        print("Warning: LOG_BLOB_COMPRESSION is on; compressed texts read as NULL in the prompt_logs view")
+    if has_legacy_prompt_logs(connection):
+        # Copying a large table here would hold up startup and every worker would race on it; logging
+        # alongside it would hand out entry ids that the copy (which keeps the old ids) needs
+        raise LegacyPromptLogs(
+            "prompt_logs is still a pre-dedup table. Stop the app and run migrations/001_prompt_blobs.sql "
+            "(PostgreSQL) or python -m app.migrate_legacy_logs, then start it again"
+        )
+    if "prompt_logs" not in inspect(connection).get_view_names():
+        refresh_prompt_logs_view(connection)
+
+
+def migrate_legacy_prompt_logs(connection) -> int:
+    """Move a pre-dedup prompt_logs table into prompt_log_entries and put the view in its place"""
+    copied = copy_legacy_prompt_logs(connection)
+    connection.execute(text("ALTER TABLE prompt_logs RENAME TO prompt_logs_legacy"))
+    refresh_prompt_logs_view(connection)
+    return copied
+
+
+def refresh_prompt_logs_view(connection):
+    """(Re)create the prompt_logs view over every table holding log entries"""
+    tables = log_entry_tables(connection)
+    if len(tables) == 1:
+        entries = tables[0]
+    else:
+        columns = ", ".join(ENTRY_COLUMNS)
+        entries = "(" + " UNION ALL ".join(f"SELECT {columns} FROM {name}" for name in tables) + ")"
+    connection.execute(text("DROP VIEW IF EXISTS prompt_logs"))
+    connection.execute(text(PROMPT_LOGS_VIEW.format(entries=entries)))
+
+
+def copy_legacy_prompt_logs(connection, batch_size: int = 1000) -> int:
+    """Copy rows of an old prompt_logs table, keeping their ids (migrations/001_prompt_blobs.sql does this in SQL)"""
+    legacy = Table("prompt_logs", MetaData(), autoload_with=connection)
+    columns = ["id", "timestamp", *LOG_TEXT_COLUMNS, "user_ip", "model_used", "refinement_model"]
+    query = select(*[
+        legacy.c[column] if column in legacy.c else literal(None).label(column)
+        for column in columns
+    ]).order_by(legacy.c.id).limit(batch_size)
+    db = Session(bind=connection)
+    if connection.dialect.name == "postgresql" and is_partitioned(connection):
+        first, last = connection.execute(select(func.min(legacy.c.timestamp), func.max(legacy.c.timestamp))).one()
+        if first is not None:
+            ensure_partitions(connection, first, last)
+    copied = last_id = 0
+    while True:
+        rows = [dict(row._mapping) for row in connection.execute(query.where(legacy.c.id > last_id))]
+        if not rows:
+            break
+        blob_ids, _ = store_blobs(db, (row[column] or "" for row in rows for column in LOG_TEXT_COLUMNS))
+        connection.execute(insert(PromptLogEntry), [entry_params(row, blob_ids) for row in rows])
+        copied += len(rows)
+        last_id = rows[-1]["id"]
+    if copied and connection.dialect.name == "postgresql":
+        connection.execute(text(
+            "SELECT setval(pg_get_serial_sequence('prompt_log_entries', 'id'), (SELECT MAX(id) FROM prompt_log_entries))"
+        ))
+    return copied
+
+
+@asynccontextmanager
+async def database_session() -> AsyncIterator[Optional[AsyncSession]]:
+    """A session, or None while no database is configured or it is backing off after a failure"""
+    if SessionLocal is None:
+        yield None
+        return
+    if not health.allow() or not await ensure_schema():
+        metrics.db_skipped.inc()
+        yield None
+        return
+    
+    session = SessionLocal()
+    try:
+        yield session
+        health.record_success()
+    except Exception as e:
+        if is_connection_error(e):
+            health.record_failure(e)
+        elif isinstance(e, PoolTimeoutError):
+            metrics.db_pool_timeouts.inc()
+        raise
+    finally:
         try:
-            with open("prompt_logs.txt", "a") as f:
-                f.write(f"[{datetime.utcnow()}] RAW: {raw_input[:100]}... | "
-                       f"REFINED: {refined_prompt[:100]}... | "
-                       f"OUTPUT: {final_output[:100]}...\n")
-            return True
+            await session.close()
         except Exception:
-            return False
+            pass  # The connection is already gone; the pool discards it
+
+
+def database_stats() -> Dict[str, Any]:
+    """Health and connection pool state for /analytics/stats"""
+    if engine is None:
+        return {"configured": bool(settings.database_url), **health.stats()}
+    pool = engine.sync_engine.pool
+    return {
+        "configured": True,
+        "dialect": engine.dialect.name,
+        **health.stats(),
+        "pool": {
+            "size": settings.database_pool_size,
+            "max_overflow": settings.database_max_overflow,
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+            "timeouts": int(metrics.db_pool_timeouts.total()),
+        },
+    }
+
+
+async def write_prompt_logs(rows: List[Dict[str, Any]]) -> bool:
+    """Bulk insert prompt log rows, their texts and their rollups in a single transaction"""
+    try:
+        async with database_session() as db:
+            if db is None:
+                return False
+            # Retry once if another worker created one of the same rollup buckets concurrently
+            for attempt in range(2):
+                try:
+                    new_blob_ids = await db.run_sync(_write_log_rows, rows)
+                    await db.commit()
+                    # Only committed blobs may be referenced by later batches without a lookup
+                    blob_id_cache.update(new_blob_ids)
+                    return True
+                except IntegrityError:
+                    await db.rollback()
+                    # A cached blob id may point at a blob the retention job removed
+                    blob_id_cache.clear()
+                    if attempt:
+                        raise
+    except Exception:
+        return False
+
+
+def _write_log_rows(db: Session, rows: List[Dict[str, Any]]) -> Dict[bytes, int]:
+    blob_ids, new_blob_ids = store_blobs(db, (row[column] or "" for row in rows for column in LOG_TEXT_COLUMNS))
+    # A list of parameter dicts is sent as one executemany batch
+    db.execute(insert(PromptLogEntry), [entry_params(row, blob_ids) for row in rows])
+    if search_ready:
+        index_log_texts(db, rows, blob_ids)
+    update_prompt_stats(db, rows)
+    return new_blob_ids
+
+
+def entry_params(row: Dict[str, Any], blob_ids: Dict[str, int]) -> Dict[str, Any]:
+    """prompt_log_entries values for a log row whose texts are stored"""
+    params = {key: value for key, value in row.items() if key not in LOG_TEXT_COLUMNS}
+    for column in LOG_TEXT_COLUMNS:
+        params[f"{column}_id"] = blob_ids[row[column] or ""]
+    return params
+
+
+# Content-addressed text storage: each distinct text is one prompt_blobs row
+class BlobIdCache:
+    """Blob ids of recently written texts by digest, so repeated texts skip the lookup query"""
+
+    def __init__(self):
+        self._ids: "OrderedDict[bytes, int]" = OrderedDict()
+
+    def get(self, digest: bytes) -> Optional[int]:
+        blob_id = self._ids.get(digest)
+        if blob_id is not None:
+            self._ids.move_to_end(digest)
+        return blob_id
+
+    def update(self, ids: Dict[bytes, int]):
+        self._ids.update(ids)
+        while len(self._ids) > settings.log_blob_cache_size:
+            self._ids.popitem(last=False)
+
+    def clear(self):
+        self._ids.clear()
+
+
+blob_id_cache = BlobIdCache()
+_blob_compression: Optional[str] = None
+
+
+def blob_compression() -> str:
+    global _blob_compression
+    if _blob_compression is None:
+        _blob_compression = settings.log_blob_compression
+        if _blob_compression == "zstd" and zstandard is None:
+            print("Warning: LOG_BLOB_COMPRESSION=zstd needs the zstandard package; using zlib")
+            _blob_compression = "zlib"
+        elif _blob_compression not in ("none", "zlib", "zstd"):
+            raise ValueError(f"Unknown LOG_BLOB_COMPRESSION {_blob_compression!r}")
+    return _blob_compression
+
+
+def text_digest(value: str) -> bytes:
+    return hashlib.sha256(value.encode("utf-8")).digest()
+
+
+def encode_blob(value: str, digest: bytes) -> Dict[str, Any]:
+    """prompt_blobs values for a text, compressed when it is long enough to gain from it"""
+    raw = value.encode("utf-8")
+    encoding = blob_compression()
+    if encoding != "none" and len(raw) >= settings.log_blob_compress_min_bytes:
+        if encoding == "zstd":
+            data = zstandard.ZstdCompressor().compress(raw)
+        else:
+            data = zlib.compress(raw)
+        if len(data) < len(raw):
+            return {"digest": digest, "size": len(raw), "encoding": encoding, "content": None, "data": data}
+    return {"digest": digest, "size": len(raw), "encoding": "none", "content": value, "data": None}
+
+
+def decode_blob(encoding: str, content: Optional[str], data: Optional[bytes]) -> str:
+    """The text stored in a prompt_blobs row"""
+    if encoding == "none":
+        return content or ""
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Reading zstd-compressed prompt blobs needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def _insert_blobs(db: Session):
+    """INSERT that leaves a blob alone if another writer stored the same text first"""
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(PromptBlob)  # A concurrent duplicate raises IntegrityError and the batch is retried
+    return dialect_insert(PromptBlob).on_conflict_do_nothing(index_elements=["digest"])
+
+
+def _lookup_blob_ids(db: Session, digests: List[bytes], chunk_size: int = 500) -> Dict[bytes, int]:
+    found: Dict[bytes, int] = {}
+    for start in range(0, len(digests), chunk_size):
+        chunk = digests[start:start + chunk_size]
+        found.update(db.execute(select(PromptBlob.digest, PromptBlob.id).where(PromptBlob.digest.in_(chunk))).all())
+    return found
+
+
+def store_blobs(db: Session, texts: Iterable[str]) -> Tuple[Dict[str, int], Dict[bytes, int]]:
+    """
+    Blob ids for the given texts, inserting only texts not stored yet (the caller commits)
+    Returns ids by text, and ids by digest of the blobs that were looked up or inserted here.
+    """
+    digests = {value: text_digest(value) for value in set(texts)}
+    ids: Dict[str, int] = {}
+    missing: Dict[bytes, str] = {}
+    for value, digest in digests.items():
+        blob_id = blob_id_cache.get(digest)
+        if blob_id is None:
+            missing[digest] = value
+        else:
+            ids[value] = blob_id
     
+    found = _lookup_blob_ids(db, list(missing)) if missing else {}
+    new = [encode_blob(value, digest) for digest, value in missing.items() if digest not in found]
+    if new:
+        db.execute(_insert_blobs(db), new)
+        found.update(_lookup_blob_ids(db, [blob["digest"] for blob in new]))
+    for digest, value in missing.items():
+        ids[value] = found[digest]
+    metrics.log_blobs.inc(len(new), result="new")
+    metrics.log_blobs.inc(len(digests) - len(new), result="reused")
+    return ids, found
+
+
+# Time partitions: PostgreSQL range-partitions prompt_log_entries by period. On SQLite the
+# current period stays in prompt_log_entries and each closed period moves to its own table.
+PARTITION_PREFIX = "prompt_log_entries_p"
+PARTITION_FORMATS = {"month": "%Y%m", "day": "%Y%m%d"}
+
+
+def period_start(ts: datetime, period: Optional[str] = None) -> datetime:
+    """Start of the LOG_PARTITION_PERIOD containing ts"""
+    period = period or settings.log_partition_period
+    start = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start.replace(day=1) if period == "month" else start
+
+
+def next_period_start(start: datetime, period: Optional[str] = None) -> datetime:
+    period = period or settings.log_partition_period
+    if period == "month":
+        return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start + timedelta(days=1)
+
+
+def partition_name(start: datetime, period: Optional[str] = None) -> str:
+    return PARTITION_PREFIX + start.strftime(PARTITION_FORMATS[period or settings.log_partition_period])
+
+
+def partition_tables(connection) -> Dict[str, Tuple[datetime, datetime]]:
+    """(start, end) of every period table, attached partition or not, by name"""
+    tables = {}
+    for name in inspect(connection).get_table_names():
+        if not name.startswith(PARTITION_PREFIX):
+            continue
+        suffix = name[len(PARTITION_PREFIX):]
+        for period, fmt in PARTITION_FORMATS.items():
+            try:
+                start = datetime.strptime(suffix, fmt)
+            except ValueError:
+                continue
+            if start.strftime(fmt) == suffix:
+                tables[name] = (start, next_period_start(start, period))
+                break
+    return tables
+
+
+def log_entry_tables(connection) -> List[str]:
+    """Tables to read log entries from (the partitioned parent covers every partition on PostgreSQL)"""
+    if connection.dialect.name == "postgresql":
+        return [PromptLogEntry.__tablename__]
+    return [PromptLogEntry.__tablename__, *sorted(partition_tables(connection))]
+
+
+def is_partitioned(connection) -> bool:
+    """Whether prompt_log_entries is split into periods (PostgreSQL tables created before partitioning are not)"""
+    if connection.dialect.name != "postgresql":
+        return connection.dialect.name == "sqlite"
+    kind = connection.execute(text(
+        "SELECT relkind FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p') AND pg_table_is_visible(oid)"
+    ), {"name": PromptLogEntry.__tablename__}).scalar()
+    return kind == "p"
+
+
+def ensure_partitions(connection, first: datetime, last: datetime):
+    """PostgreSQL: create the partitions covering first..last plus the next period, and the default partition"""
+    existing = partition_tables(connection)
+    start = period_start(first)
+    end = next_period_start(next_period_start(period_start(last)))
+    while start < end:
+        stop = next_period_start(start)
+        # Partitions made under another LOG_PARTITION_PERIOD may already cover part of the range
+        if not any(lo < stop and start < hi for lo, hi in existing.values()):
+            name = partition_name(start)
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PromptLogEntry.__tablename__} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{stop.isoformat()}')"
+            ))
+            existing[name] = (start, stop)
+        start = stop
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {PromptLogEntry.__tablename__}_default PARTITION OF {PromptLogEntry.__tablename__} DEFAULT"
+    ))
+
+
+PERIOD_INDEXED_COLUMNS = ("timestamp", "raw_input_id", "final_output_id")
+
+
+def period_table(name: str) -> Table:
+    """A SQLite table holding one closed period of log entries"""
+    columns = [
+        Column(entry_column.name, entry_column.type, primary_key=entry_column.primary_key, nullable=entry_column.nullable)
+        for entry_column in PromptLogEntry.__table__.columns
+    ]
+    indexes = [Index(f"ix_{name}_{indexed}", indexed) for indexed in PERIOD_INDEXED_COLUMNS]
+    return Table(name, MetaData(), *columns, *indexes)
+
+
+def rotate_periods(connection, now: datetime) -> List[str]:
+    """SQLite: move entries of closed periods out of prompt_log_entries into one table per period"""
+    entries = PromptLogEntry.__table__
+    current = period_start(now)
+    moved = []
+    while True:
+        oldest = connection.execute(select(func.min(entries.c.timestamp)).where(entries.c.timestamp < current)).scalar()
+        if oldest is None:
+            return moved
+        start = period_start(oldest)
+        in_period = and_(entries.c.timestamp >= start, entries.c.timestamp < next_period_start(start))
+        target = period_table(partition_name(start))
+        target.create(connection, checkfirst=True)
+        connection.execute(insert(target).from_select(ENTRY_COLUMNS, select(*entries.c).where(in_period)))
+        connection.execute(entries.delete().where(in_period))
+        moved.append(target.name)
+
+
+def entry_table(name: str) -> Table:
+    return PromptLogEntry.__table__ if name == PromptLogEntry.__tablename__ else period_table(name)
+
+
+def log_sources(
+    connection, start: Optional[datetime] = None, end: Optional[datetime] = None, descending: bool = True
+) -> List[str]:
+    """
+    Tables to read log entries from, in timestamp order
+    On SQLite every period table holds entries older than prompt_log_entries (rotation moves whole
+    closed periods), so reading the tables one after another keeps the overall order.
+    """
+    if connection.dialect.name == "postgresql":
+        return [PromptLogEntry.__tablename__]
+    periods = sorted(
+        (lo, name) for name, (lo, hi) in partition_tables(connection).items()
+        if (start is None or hi > start) and (end is None or lo < end)
+    )
+    names = [name for _, name in periods] + [PromptLogEntry.__tablename__]
+    return names[::-1] if descending else names
+
+
+def log_rows_query(
+    name: str,
+    model: Optional[str] = None,
+    user_ip: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    descending: bool = True
+) -> Select:
+    """Log entries of one table with their texts, in (timestamp, id) order after a keyset cursor"""
+    source = entry_table(name)
+    blobs = {text_column: PromptBlob.__table__.alias(text_column) for text_column in LOG_TEXT_COLUMNS}
+    query = select(
+        source.c.id, source.c.timestamp, source.c.user_ip, source.c.model_used, source.c.refinement_model,
+        *[blob_column for blob in blobs.values() for blob_column in (blob.c.encoding, blob.c.content, blob.c.data)]
+    ).select_from(source)
+    for text_column, blob in blobs.items():
+        query = query.join(blob, blob.c.id == source.c[f"{text_column}_id"])
+    query = query.where(*log_filters(source, model, user_ip, start, end))
+    key = tuple_(source.c.timestamp, source.c.id)
+    if after is not None:
+        query = query.where(key < tuple_(*after) if descending else key > tuple_(*after))
+    if descending:
+        return query.order_by(source.c.timestamp.desc(), source.c.id.desc())
+    return query.order_by(source.c.timestamp, source.c.id)
+
+
+def log_filters(
+    source: Table,
+    model: Optional[str] = None,
+    user_ip: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> List[Any]:
+    conditions = []
+    if model is not None:
+        conditions.append(source.c.model_used == model)
+    if user_ip is not None:
+        conditions.append(source.c.user_ip == user_ip)
+    if start is not None:
+        conditions.append(source.c.timestamp >= start)
+    if end is not None:
+        conditions.append(source.c.timestamp < end)
+    return conditions
+
+
+def log_row(result) -> Dict[str, Any]:
+    """A row of log_rows_query with its texts decoded"""
+    entry_id, timestamp, user_ip, model_used, refinement_model, *stored = result
+    row: Dict[str, Any] = {"id": entry_id, "timestamp": timestamp}
+    for i, text_column in enumerate(LOG_TEXT_COLUMNS):
+        row[text_column] = decode_blob(*stored[i * 3:i * 3 + 3])
+    row.update({"user_ip": user_ip, "model_used": model_used, "refinement_model": refinement_model})
+    return row
+
+
+def delete_orphan_blobs(connection) -> int:
+    """Remove texts no log entry references any more (after periods are dropped)"""
+    referenced = union(*[
+        select(column(name)).select_from(table(entries))
+        for entries in log_entry_tables(connection)
+        for name in BLOB_ID_COLUMNS
+    ])
+    result = connection.execute(delete(PromptBlob).where(PromptBlob.id.not_in(referenced)))
+    if connection.dialect.name == "sqlite" and inspect(connection).has_table(SEARCH_TABLE):
+        # PostgreSQL drops their search rows by ON DELETE CASCADE; FTS5 tables have no foreign keys
+        search = search_table(connection)
+        connection.execute(delete(search).where(~exists().where(PromptBlob.id == search.c.rowid)))
+    blob_id_cache.clear()
+    return result.rowcount
+
+
+def delete_expired_cache_entries(connection, now: datetime) -> int:
+    """Remove shared response cache rows past their TTL (reads skip them, but nothing else removes them)"""
+    if not inspect(connection).has_table(ResponseCacheEntry.__tablename__):
+        return 0
+    return connection.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.expires_at < now)).rowcount
+
+
+# Full-text search: each distinct raw_input or final_output text is indexed once, keyed by its blob id.
+# PostgreSQL keeps a tsvector per text under a GIN index, SQLite an FTS5 table.
+SEARCH_TABLE = "prompt_search"
+SEARCH_COLUMNS = ("raw_input", "final_output")
+SEARCH_MARKS = ("<mark>", "</mark>")
+
+POSTGRES_SEARCH_DDL = """
+CREATE TABLE IF NOT EXISTS prompt_search (
+    blob_id INTEGER PRIMARY KEY REFERENCES prompt_blobs(id) ON DELETE CASCADE,
+    body TEXT NOT NULL,
+    document TSVECTOR GENERATED ALWAYS AS (to_tsvector('{language}'::regconfig, body)) STORED
+)
+"""
+
+
+def search_language() -> str:
+    """LOG_SEARCH_LANGUAGE, checked before it is written into DDL"""
+    language = settings.log_search_language
+    if not re.fullmatch(r"[A-Za-z_]+", language):
+        raise ValueError(f"Invalid LOG_SEARCH_LANGUAGE {language!r}")
+    return language
+
+
+def search_table(connection) -> Table:
+    """The search index as a table keyed by blob id (FTS5 calls the key rowid)"""
+    key = "blob_id" if connection.dialect.name == "postgresql" else "rowid"
+    return table(SEARCH_TABLE, column(key, Integer), column("body", Text))
+
+
+def create_search_index(connection) -> bool:
+    """Create the search index and the entry indexes its hits join back on; False when the database has no full-text search"""
+    for name in log_entry_tables(connection):
+        for indexed in ("raw_input_id", "final_output_id"):
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{name}_{indexed} ON {name} ({indexed})"))
+    if connection.dialect.name not in ("postgresql", "sqlite"):
+        print(f"Warning: log search needs PostgreSQL or SQLite, not {connection.dialect.name}")
+        return False
     try:
-        log_entry = PromptLog(
-            raw_input=raw_input,
-            refined_prompt=refined_prompt,
-            final_output=final_output,
-            user_ip=user_ip,
-            model_used=model_used
+        language = search_language()
+        if connection.dialect.name == "postgresql":
+            # A savepoint, so an unknown text search configuration only turns search off
+            with connection.begin_nested():
+                connection.execute(text(POSTGRES_SEARCH_DDL.format(language=language)))
+                connection.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)"
+                ))
+        else:
+            # The porter stemmer only knows English; other languages are matched on unstemmed words
+            stemmer = "porter " if language == "english" else ""
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+                f"USING fts5(body, tokenize='{stemmer}unicode61 remove_diacritics 2')"
+            ))
+    except (ValueError, DBAPIError) as e:
+        reason = e.orig if isinstance(e, DBAPIError) else e
+        print(f"Warning: log search disabled: {reason}")
+        return False
+    return True
+
+
+def add_search_documents(db: Session, bodies: Dict[int, str], chunk_size: int = 500) -> int:
+    """Index texts by blob id, skipping those already indexed; returns how many were added"""
+    search = search_table(db.connection())
+    key = search.c[search.c.keys()[0]]
+    ids = list(bodies)
+    indexed = set()
+    for i in range(0, len(ids), chunk_size):
+        indexed.update(db.execute(select(key).where(key.in_(ids[i:i + chunk_size]))).scalars())
+    new = [{key.name: blob_id, "body": body} for blob_id, body in bodies.items() if blob_id not in indexed]
+    if not new:
+        return 0
+    # A concurrent writer may index the same text first
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(search).on_conflict_do_nothing(index_elements=[key.name])
+    else:
+        statement = insert(search).prefix_with("OR REPLACE")
+    db.execute(statement, new)
+    metrics.log_search_documents.inc(len(new))
+    return len(new)
+
+
+def index_log_texts(db: Session, rows: List[Dict[str, Any]], blob_ids: Dict[str, int]) -> int:
+    """Add the raw_input and final_output texts of newly logged rows to the search index"""
+    bodies = {blob_ids[row[name]]: row[name] for row in rows for name in SEARCH_COLUMNS if row[name]}
+    # Texts seen before are usually indexed already, but one first stored as a refined_prompt is not
+    return add_search_documents(db, bodies) if bodies else 0
+
+
+def websearch_to_fts5(query: str) -> Optional[str]:
+    """
+    Translate web search syntax into an FTS5 MATCH expression, like PostgreSQL's websearch_to_tsquery
+    Words are ANDed, "quoted text" is a phrase, OR joins alternatives and a leading - excludes a term.
+    None when the query has no words.
+    """
+    included: List[str] = []
+    excluded: List[str] = []
+    pending_or = False
+    for negate, phrase, word in re.findall(r'(-?)(?:"([^"]*)"?|([^\s"]+))', query):
+        if word == "OR" and not negate:
+            pending_or = bool(included)
+            continue
+        words = re.findall(r"\w+", phrase or word)
+        if not words:
+            continue
+        term = '"' + " ".join(words) + '"'  # Quoted, so FTS5 operators in the input are plain words
+        if negate:
+            excluded.append(term)
+        elif pending_or:
+            included[-1] = f"{included[-1]} OR {term}"
+            pending_or = False
+        else:
+            included.append(term)
+    if not included:
+        return None
+    expression = " AND ".join(f"({term})" for term in included)
+    for term in excluded:
+        expression = f"{expression} NOT {term}"
+    return expression
+
+
+def search_matches(connection, query: str):
+    """(blob_id, score) of every indexed text matching query, higher scores ranking first"""
+    if connection.dialect.name == "postgresql":
+        matches = text(
+            f"SELECT s.blob_id, ts_rank_cd(s.document, q.query, 1) AS score "
+            f"FROM {SEARCH_TABLE} s, websearch_to_tsquery(CAST(:language AS regconfig), :query) AS q(query) "
+            f"WHERE s.document @@ q.query"
+        ).bindparams(language=search_language(), query=query)
+    else:
+        # bm25() is lower for better matches
+        matches = text(
+            f"SELECT rowid AS blob_id, -bm25({SEARCH_TABLE}) AS score FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :query"
+        ).bindparams(query=websearch_to_fts5(query))
+    return matches.columns(column("blob_id", Integer), column("score", Float)).cte("matches")
+
+
+def search_snippets(connection, query: str, blob_ids: List[int], words: int = 24) -> Dict[int, str]:
+    """Highlighted extracts of the matching texts among blob_ids, by blob id"""
+    if not blob_ids:
+        return {}
+    start_mark, stop_mark = SEARCH_MARKS
+    if connection.dialect.name == "postgresql":
+        statement = text(
+            f"SELECT blob_id, ts_headline(CAST(:language AS regconfig), body, "
+            f"websearch_to_tsquery(CAST(:language AS regconfig), :query), :options) "
+            f"FROM {SEARCH_TABLE} WHERE blob_id IN :ids AND document @@ websearch_to_tsquery(CAST(:language AS regconfig), :query)"
+        ).bindparams(
+            bindparam("ids", expanding=True),
+            language=search_language(),
+            query=query,
+            options=f"StartSel={start_mark}, StopSel={stop_mark}, MaxWords={words}, MinWords={words // 2}, MaxFragments=2",
         )
-        db.add(log_entry)
-        db.commit()
-        return True
+    else:
+        statement = text(
+            f"SELECT rowid, snippet({SEARCH_TABLE}, 0, :start_mark, :stop_mark, '…', :words) "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :query AND rowid IN :ids"
+        ).bindparams(
+            bindparam("ids", expanding=True),
+            start_mark=start_mark, stop_mark=stop_mark, words=min(words, 64), query=websearch_to_fts5(query),
+        )
+    return {blob_id: snippet for blob_id, snippet in connection.execute(statement, {"ids": blob_ids})}
+
+
+def _search_logs(db: Session, query: str, limit: int, offset: int, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    connection = db.connection()
+    if connection.dialect.name != "postgresql" and websearch_to_fts5(query) is None:
+        return []
+    matches = search_matches(connection, query)
+    # An entry is a hit when its prompt or its answer matches; it ranks by the better of the two
+    hits = []
+    for name in log_sources(connection, filters.get("start"), filters.get("end")):
+        source = entry_table(name)
+        for text_column in SEARCH_COLUMNS:
+            hits.append(
+                select(
+                    source.c.id, source.c.timestamp, source.c.raw_input_id, source.c.final_output_id,
+                    matches.c.score, literal(name).label("source")
+                )
+                .join(matches, matches.c.blob_id == source.c[f"{text_column}_id"])
+                .where(*log_filters(source, **filters))
+            )
+    hit = union_all(*hits).subquery("hits")
+    score = func.max(hit.c.score).label("score")
+    timestamp = func.max(hit.c.timestamp).label("timestamp")
+    ranked = connection.execute(
+        select(
+            hit.c.id, timestamp, score, func.max(hit.c.source),
+            func.max(hit.c.raw_input_id), func.max(hit.c.final_output_id)
+        )
+        .group_by(hit.c.id)
+        .order_by(score.desc(), timestamp.desc(), hit.c.id.desc())
+        .limit(limit)
+        .offset(offset)
+    ).all()
+    if not ranked:
+        return []
+    
+    # Texts and snippets only for the page
+    rows: Dict[int, Dict[str, Any]] = {}
+    for name in {source_name for _, _, _, source_name, _, _ in ranked}:
+        ids = [entry_id for entry_id, _, _, source_name, _, _ in ranked if source_name == name]
+        page = log_rows_query(name)
+        page = page.where(page.selected_columns.id.in_(ids))
+        rows.update((row["id"], row) for row in map(log_row, connection.execute(page)))
+    snippets = search_snippets(connection, query, list({
+        blob_id for _, _, _, _, raw_input_id, final_output_id in ranked for blob_id in (raw_input_id, final_output_id)
+    }))
+    results = []
+    for entry_id, _, entry_score, _, raw_input_id, final_output_id in ranked:
+        highlights = {
+            name: snippets[blob_id]
+            for name, blob_id in zip(SEARCH_COLUMNS, (raw_input_id, final_output_id))
+            if blob_id in snippets
+        }
+        results.append({**rows[entry_id], "score": round(entry_score, 6), "highlights": highlights})
+    return results
+
+
+def _backfill_search_index(db: Session, after: int, batch_size: int) -> Tuple[int, Optional[int]]:
+    """Index one batch of stored texts missing from the search index; (added, last blob id or None when done)"""
+    connection = db.connection()
+    search = search_table(connection)
+    blobs = PromptBlob.__table__
+    used = [
+        exists().where(entry_table(name).c[f"{text_column}_id"] == blobs.c.id)
+        for name in log_entry_tables(connection)
+        for text_column in SEARCH_COLUMNS
+    ]
+    batch = connection.execute(
+        select(blobs.c.id, blobs.c.encoding, blobs.c.content, blobs.c.data)
+        .where(blobs.c.id > after, or_(*used), ~exists().where(search.c[search.c.keys()[0]] == blobs.c.id))
+        .order_by(blobs.c.id)
+        .limit(batch_size)
+    ).all()
+    if not batch:
+        return 0, None
+    added = add_search_documents(db, {blob_id: decode_blob(*stored) for blob_id, *stored in batch})
+    return added, batch[-1][0]
+
+
+# Rollups: every logged row increments one bucket per granularity
+ROLLUP_GRANULARITIES = ("minute", "hour", "day", "total")
+SKETCH_GRANULARITIES = ("hour", "day", "total")
+BUCKET_WIDTHS = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+TOTAL_BUCKET = datetime(1970, 1, 1)
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    """Start of the rollup bucket containing ts"""
+    if granularity == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return TOTAL_BUCKET
+
+
+def _bucket_ceil(ts: datetime, granularity: str) -> datetime:
+    start = bucket_start(ts, granularity)
+    return start if start == ts else start + BUCKET_WIDTHS[granularity]
+
+
+def update_prompt_stats(db: Session, rows: List[Dict[str, Any]]):
+    """Fold a batch of log rows into the prompt_stats rollups (the caller commits)"""
+    updates: Dict[Tuple[str, datetime, str], Tuple[int, set]] = {}
+    for row in rows:
+        timestamp = row.get("timestamp") or datetime.utcnow()
+        model = row.get("model_used") or ""
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (granularity, bucket_start(timestamp, granularity), model)
+            count, users = updates.get(key, (0, set()))
+            if row.get("user_ip") and granularity in SKETCH_GRANULARITIES:
+                users.add(row["user_ip"])
+            updates[key] = (count + 1, users)
+    
+    existing = {}
+    keys = list(updates)
+    # Chunked so batches spanning many buckets stay under SQLite's expression depth limit
+    for offset in range(0, len(keys), 200):
+        query = db.query(PromptStat).filter(or_(*[
+            and_(
+                PromptStat.granularity == granularity,
+                PromptStat.bucket_start == start,
+                PromptStat.model_used == model
+            )
+            for granularity, start, model in keys[offset:offset + 200]
+        ]))
+        if db.bind.dialect.name == "postgresql":
+            query = query.with_for_update()
+        existing.update({(stat.granularity, stat.bucket_start, stat.model_used): stat for stat in query})
+    
+    for key, (count, users) in updates.items():
+        stat = existing.get(key)
+        if stat is None:
+            granularity, start, model = key
+            stat = PromptStat(granularity=granularity, bucket_start=start, model_used=model, request_count=0)
+            db.add(stat)
+        stat.request_count += count
+        if users:
+            sketch = HyperLogLog.from_bytes(stat.user_sketch)
+            sketch.update(users)
+            stat.user_sketch = sketch.to_bytes()
+    db.flush()
+
+
+def _window_segments(start: datetime, end: datetime, granularities=("day", "hour", "minute")) -> List[Tuple[str, datetime, datetime]]:
+    """Cover [start, end) with the fewest buckets: whole days, then hours, then minutes at the edges"""
+    granularity, finer = granularities[0], granularities[1:]
+    if not finer:
+        return [(granularity, start, end)] if start < end else []
+    lo, hi = _bucket_ceil(start, granularity), bucket_start(end, granularity)
+    if lo >= hi:
+        return _window_segments(start, end, finer)
+    return _window_segments(start, lo, finer) + [(granularity, lo, hi)] + _window_segments(hi, end, finer)
+
+
+def query_prompt_stats(db: Session, start: datetime, end: datetime) -> Dict[str, Any]:
+    """Requests, approximate unique users and model usage in [start, end) read from the rollups"""
+    start = bucket_start(start, "minute")
+    end = _bucket_ceil(end, "minute")
+    segments = _window_segments(start, end)
+    if not segments:
+        return {"start": start, "end": end, "requests": 0, "unique_users": 0, "model_usage": []}
+    
+    in_window = or_(*[
+        and_(
+            PromptStat.granularity == granularity,
+            PromptStat.bucket_start >= lo,
+            PromptStat.bucket_start < hi
+        )
+        for granularity, lo, hi in segments
+    ])
+    model_stats = db.query(
+        PromptStat.model_used,
+        func.sum(PromptStat.request_count)
+    ).filter(in_window).group_by(PromptStat.model_used).all()
+    
+    # Minute buckets carry no sketch, so edge minutes use the hour sketches that contain them
+    sketch_ranges = [
+        ("hour", bucket_start(lo, "hour"), hi) if granularity == "minute" else (granularity, lo, hi)
+        for granularity, lo, hi in segments
+    ]
+    users = HyperLogLog()
+    for (data,) in db.query(PromptStat.user_sketch).filter(or_(*[
+        and_(
+            PromptStat.granularity == granularity,
+            PromptStat.bucket_start >= lo,
+            PromptStat.bucket_start < hi,
+            PromptStat.user_sketch.isnot(None)
+        )
+        for granularity, lo, hi in sketch_ranges
+    ])):
+        users.merge(HyperLogLog.from_bytes(data))
+    
+    return {
+        "start": start,
+        "end": end,
+        "requests": sum(int(count) for _, count in model_stats),
+        "unique_users": users.count(),
+        "model_usage": [{"model": model or None, "count": int(count)} for model, count in model_stats],
+    }
+
+
+def query_prompt_totals(db: Session) -> Dict[str, Any]:
+    """All-time requests, approximate unique users and model usage"""
+    rows = db.query(
+        PromptStat.model_used, PromptStat.request_count, PromptStat.user_sketch
+    ).filter(PromptStat.granularity == "total").all()
+    users = HyperLogLog()
+    for _, _, data in rows:
+        if data:
+            users.merge(HyperLogLog.from_bytes(data))
+    return {
+        "requests": sum(count for _, count, _ in rows),
+        "unique_users": users.count(),
+        "model_usage": [{"model": model or None, "count": count} for model, count, _ in rows],
+    }
+
+
+async def backfill_prompt_stats(batch_size: int = 5000) -> int:
+    """One-off rebuild of prompt_stats from existing prompt_logs rows (run on an empty prompt_stats)"""
+    async with database_session() as db:
+        if db is None:
+            return 0
+        processed = await db.run_sync(_backfill_prompt_stats, batch_size)
+        await db.commit()
+        return processed
+
+
+def _backfill_prompt_stats(db: Session, batch_size: int) -> int:
+    processed = 0
+    batch: List[Dict[str, Any]] = []
+    # On SQLite, closed periods live in their own tables, which the current table alone would miss
+    for name in log_entry_tables(db.connection()):
+        entries = entry_table(name)
+        query = select(entries.c.timestamp, entries.c.user_ip, entries.c.model_used).execution_options(yield_per=batch_size)
+        for timestamp, user_ip, model_used in db.execute(query):
+            batch.append({"timestamp": timestamp, "user_ip": user_ip, "model_used": model_used})
+            if len(batch) >= batch_size:
+                update_prompt_stats(db, batch)
+                processed += len(batch)
+                batch = []
+    if batch:
+        update_prompt_stats(db, batch)
+        processed += len(batch)
+    return processed
+
+
+async def browse_logs(
+    limit: int,
+    after: Optional[Tuple[datetime, int]] = None,
+    descending: bool = True,
+    **filters: Any
+) -> List[Dict[str, Any]]:
+    """Up to limit log rows after a (timestamp, id) cursor; raises DatabaseUnavailable"""
+    async with database_session() as db:
+        if db is None:
+            raise DatabaseUnavailable()
+        names = await db.run_sync(
+            lambda sync_db: log_sources(sync_db.connection(), filters.get("start"), filters.get("end"), descending)
+        )
+        rows: List[Dict[str, Any]] = []
+        for name in names:
+            query = log_rows_query(name, after=after, descending=descending, **filters).limit(limit - len(rows))
+            rows.extend(log_row(result) for result in (await db.execute(query)).all())
+            if len(rows) >= limit:
+                break
+        return rows
+
+
+async def stream_logs(descending: bool = False, batch_size: int = 1000, **filters: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Every matching log row, fetched through a server-side cursor batch_size rows at a time"""
+    async with database_session() as db:
+        if db is None:
+            raise DatabaseUnavailable()
+        names = await db.run_sync(
+            lambda sync_db: log_sources(sync_db.connection(), filters.get("start"), filters.get("end"), descending)
+        )
+        for name in names:
+            query = log_rows_query(name, descending=descending, **filters).execution_options(yield_per=batch_size)
+            async for result in await db.stream(query):
+                yield log_row(result)
+
+
+async def search_logs(query: str, limit: int, offset: int = 0, **filters: Any) -> List[Dict[str, Any]]:
+    """Log rows whose prompt or answer matches query, best first, with highlighted snippets; raises DatabaseUnavailable"""
+    async with database_session() as db:
+        if db is None:
+            raise DatabaseUnavailable()
+        if not search_ready:
+            raise SearchUnavailable()
+        return await db.run_sync(_search_logs, query, limit, offset, filters)
+
+
+async def backfill_search_index(batch_size: int = 1000) -> int:
+    """Index stored texts the search index is missing (logged before it existed or while it was off), a batch per transaction"""
+    indexed = 0
+    after: Optional[int] = 0
+    try:
+        while after is not None:
+            async with database_session() as db:
+                if db is None or not search_ready:
+                    break
+                added, after = await db.run_sync(_backfill_search_index, after, batch_size)
+                await db.commit()
+            indexed += added
+    except Exception as e:
+        print(f"Warning: log search backfill stopped: {e}")
+    if indexed:
+        print(f"Indexed {indexed} stored texts for log search")
+    return indexed
+
+
+async def get_cached_response(cache_key: str) -> Optional[str]:
+    """Read an unexpired entry from the shared response cache table"""
+    try:
+        async with database_session() as db:
+            if db is None:
+                return None
+            now = datetime.utcnow()
+            entry = await db.get(ResponseCacheEntry, cache_key)
+            if entry is None:
+                return None
+            if entry.expires_at < now:
+                # Conditional on expiry, so an entry another worker just refreshed survives
+                await db.execute(delete(ResponseCacheEntry).where(
+                    ResponseCacheEntry.cache_key == cache_key, ResponseCacheEntry.expires_at < now
+                ))
+                await db.commit()
+                return None
+            return entry.value
+    except Exception:
+        return None
+
+
+async def store_cached_response(cache_key: str, value: str, ttl_seconds: int) -> bool:
+    """Insert or refresh an entry in the shared response cache table"""
+    try:
+        async with database_session() as db:
+            if db is None:
+                return False
+            now = datetime.utcnow()
+            await db.merge(ResponseCacheEntry(
+                cache_key=cache_key,
+                value=value,
+                created_at=now,
+                expires_at=now + timedelta(seconds=ttl_seconds)
+            ))
+            await db.commit()
+            return True
     except Exception:
-        db.rollback()
         return False
-    finally:
-        db.close() 
\ No newline at end of file
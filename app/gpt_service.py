@@ -1,13 +1,67 @@
-from typing import Optional, Tuple
-import random
+from typing import AsyncIterator, Awaitable, Callable, List, NamedTuple, Optional, Tuple, TypeVar
+import asyncio
 import time
-from openai import OpenAI
+from app.backends import MAX_COMPLETION_TOKENS, CallMetadata
+from app.cache import prompt_flights, refinement_cache, response_cache
 from app.config import settings
+from app.metrics import metrics
+from app.prompt_classifier import prompt_classifier
+from app.resilience import UpstreamError, UpstreamRateLimited, classify, resilience
+from app.router import model_router
+from app.scheduler import SchedulerBusy, estimate_tokens, upstream_scheduler
+from app.semantic_cache import semantic_cache
+
+T = TypeVar("T")
+
+
+class PipelineResult(NamedTuple):
+    """Outcome of one pass through the refine/generate pipeline"""
+    refined_prompt: str
+    final_answer: str
+    model_used: str
+    total_time_ms: float
+    refinement_time_ms: float
+    generation_time_ms: float
+    cache_hit: bool = False
+    refinement_cached: bool = False
+    refinement_saved_ms: float = 0.0
+    coalesced: bool = False
+    refinement_bypassed: bool = False
+    semantic_similarity: Optional[float] = None
+    refinement_model: Optional[str] = None
+    speculative_winner: Optional[str] = None
+    speculative_saved_ms: float = 0.0
+
+
+class Refinement(NamedTuple):
+    """A refined prompt and where it came from"""
+    refined_prompt: str
+    refinement_time_ms: float
+    cached: bool = False
+    saved_ms: float = 0.0
+    bypassed: bool = False
+    model: Optional[str] = None  # None when no model ran (skipped or bypassed)
+
+
+class ModelReply(NamedTuple):
+    """Text from the upstream and the model route that produced it"""
+    text: str
+    model: str
+
+
+class AnswerStream:
+    """A streamed answer; model names the route serving it once the stream has opened"""
+
+    def __init__(self):
+        self.model: Optional[str] = None
+        self.chunks: Optional[AsyncIterator[str]] = None
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.chunks.__aiter__()
 
 
 class GPTService:
     def __init__(self):
-        self._client = None
         self.prompt_refiner_template = """
 You are a technical assistant. Rewrite the user's vague or informal input into a precise, well-structured, and technically appropriate prompt for GPT to process. 
 
@@ -29,193 +83,210 @@ Response Style Requested: {style}
 Rewritten Prompt:
 """
 
-    @property
-    def client(self):
-        """Lazy initialization of OpenAI client"""
-        if settings.mock_mode:
-            return None  # Don't initialize client in mock mode
-        if self._client is None:
-            # Create an HTTP client with proxies disabled to avoid passing proxy args
-            import httpx
-            no_proxy_client = httpx.Client(proxies=None)
-            self._client = OpenAI(
-                api_key=settings.openai_api_key,
-                http_client=no_proxy_client
-            )
-        return self._client
-
-    def _get_style_description(self, style: str) -> str:
-        """Get description for the style to use in mock responses"""
-        style_descriptions = {
-            'concise': 'brief and to-the-point',
-            'detailed': 'comprehensive and thorough',
-            'casual': 'friendly and conversational',
-            'professional': 'formal and business-like',
-            'educational': 'informative with examples',
-            'balanced': 'well-rounded'
-        }
-        return style_descriptions.get(style, 'balanced')
+    async def warm_up(self):
+        """Open pooled upstream connections so the first requests skip the handshakes"""
+        await model_router.warm_up()
 
-    def _generate_mock_refinement(self, user_input: str, style: str = "balanced") -> str:
-        """Generate a realistic mock refinement"""
-        # Simulate processing time
-        time.sleep(0.1 + random.random() * 0.3)
-        
-        style_instructions = {
-            'concise': "Provide a brief, direct explanation",
-            'detailed': "Provide a comprehensive, detailed explanation with examples and context",
-            'casual': "Explain in a friendly, conversational way that's easy to understand",
-            'professional': "Provide a formal, structured explanation suitable for business contexts",
-            'educational': "Explain with clear examples, analogies, and step-by-step breakdowns for learning",
-            'balanced': "Provide a well-rounded explanation that balances detail with clarity"
-        }
-        
-        instruction = style_instructions.get(style, style_instructions['balanced'])
-        
-        refinements = [
-            f"{instruction} of {user_input}, including key concepts, practical applications, and relevant examples. Structure your response appropriately for the requested tone and ensure technical accuracy while maintaining accessibility.",
-            f"{instruction} about {user_input}. Cover the fundamental principles, current developments, and practical implications. Use appropriate language and depth for the requested style.",
-            f"{instruction} regarding {user_input}. Include background context, core mechanisms, and real-world applications. Ensure the explanation matches the requested tone and complexity level."
-        ]
-        return random.choice(refinements)
-
-    def _generate_mock_response(self, refined_prompt: str, style: str = "balanced") -> str:
-        """Generate a realistic mock final response"""
-        # Simulate processing time
-        time.sleep(0.2 + random.random() * 0.5)
-        
-        style_desc = self._get_style_description(style)
-        
-        if style == 'concise':
-            responses = [
-                f"Here's a concise overview:\n\n{refined_prompt[:80]}...\n\nKey points:\n• Core functionality and purpose\n• Main benefits and applications\n• Current status and adoption\n\nThis represents an important development in the field with practical applications across various industries.",
-                f"Brief summary:\n\n{refined_prompt[:70]}...\n\nEssentials:\n- Primary mechanisms\n- Key advantages\n- Common use cases\n\nSignificant impact on modern technology and business practices."
-            ]
-        elif style == 'detailed':
-            responses = [
-                f"Comprehensive Analysis:\n\n{refined_prompt[:100]}...\n\nDetailed Overview:\nThis topic encompasses multiple interconnected systems and methodologies that have evolved significantly over recent years. The fundamental architecture involves sophisticated algorithms and data processing techniques that enable advanced functionality.\n\nCore Components:\n1. Primary processing mechanisms and their optimization strategies\n2. Integration frameworks and compatibility considerations\n3. Performance metrics and scalability factors\n4. Security protocols and data protection measures\n\nPractical Applications:\nThe technology finds extensive use across various sectors including healthcare, finance, manufacturing, and telecommunications. Each implementation requires careful consideration of specific requirements and constraints.\n\nFuture Developments:\nOngoing research focuses on improving efficiency, reducing costs, and expanding capabilities. Emerging trends suggest significant potential for innovation and market growth.\n\nConclusion:\nThis represents a transformative technology with far-reaching implications for how we approach complex problem-solving in the digital age.",
-                f"In-Depth Examination:\n\n{refined_prompt[:120]}...\n\nFoundational Principles:\nThe underlying concepts are rooted in established scientific and engineering principles, enhanced by modern computational capabilities and innovative design approaches.\n\nTechnical Architecture:\n• Advanced processing algorithms with optimized performance characteristics\n• Robust data management systems ensuring reliability and scalability\n• Comprehensive security frameworks protecting against various threat vectors\n• User interface designs prioritizing accessibility and functionality\n\nImplementation Considerations:\nSuccessful deployment requires careful planning, stakeholder engagement, and phased rollout strategies. Organizations must consider factors such as existing infrastructure, staff training requirements, and change management processes.\n\nMarket Impact and Adoption:\nIndustry analysis reveals growing adoption rates across multiple sectors, driven by demonstrated ROI and competitive advantages. Early adopters report significant improvements in operational efficiency and customer satisfaction.\n\nLong-term Outlook:\nExperts predict continued evolution and refinement, with emerging technologies likely to enhance capabilities further. Investment in research and development remains strong, indicating sustained innovation potential."
-            ]
-        elif style == 'casual':
-            responses = [
-                f"Hey! So you're asking about this topic - let me break it down for you in simple terms:\n\n{refined_prompt[:90]}...\n\nBasically, think of it like this: it's a pretty cool system that helps solve real problems in a smart way. The main idea is to make things work better and faster than traditional methods.\n\nWhat makes it interesting:\n• It's actually not as complicated as it sounds\n• People are using it for all sorts of practical stuff\n• The results are pretty impressive when done right\n\nThe bottom line? It's one of those technologies that's quietly making a big difference in how we do things, and it's only getting better. Pretty neat stuff if you ask me!",
-                f"Great question! This is actually a really fascinating area:\n\n{refined_prompt[:85]}...\n\nSo here's the deal - imagine you have a problem that's been bugging people for ages, and suddenly someone comes up with a clever way to tackle it. That's essentially what we're looking at here.\n\nWhy it's cool:\n- It takes complex stuff and makes it manageable\n- Real people are seeing real benefits\n- It's not just theoretical - it actually works\n\nThe fun part is watching how different industries are picking this up and running with it. Everyone's finding their own creative ways to use it, which is pretty awesome to see!"
-            ]
-        elif style == 'professional':
-            responses = [
-                f"Executive Summary:\n\n{refined_prompt[:100]}...\n\nStrategic Overview:\nThis technology represents a significant advancement in operational capabilities, offering measurable improvements in efficiency, cost-effectiveness, and competitive positioning. Organizations implementing these solutions report substantial returns on investment and enhanced market differentiation.\n\nBusiness Impact:\n• Streamlined operational processes with reduced overhead costs\n• Enhanced data-driven decision-making capabilities\n• Improved customer satisfaction and retention metrics\n• Strengthened competitive advantage in target markets\n\nImplementation Framework:\nSuccessful deployment requires structured project management, stakeholder alignment, and phased rollout strategies. Key considerations include resource allocation, timeline management, and risk mitigation protocols.\n\nRecommendations:\nOrganizations should conduct thorough feasibility assessments, develop comprehensive implementation roadmaps, and establish clear success metrics. Executive sponsorship and cross-functional collaboration are essential for optimal outcomes.",
-                f"Business Analysis:\n\n{refined_prompt[:110]}...\n\nMarket Position:\nCurrent market dynamics indicate strong growth potential and increasing enterprise adoption. Leading organizations are leveraging these capabilities to drive innovation and operational excellence.\n\nValue Proposition:\n- Quantifiable improvements in key performance indicators\n- Reduced operational complexity and associated costs\n- Enhanced scalability and future-readiness\n- Strengthened regulatory compliance and risk management\n\nStrategic Considerations:\nDecision-makers should evaluate alignment with organizational objectives, resource requirements, and implementation timelines. Due diligence should include vendor assessment, total cost of ownership analysis, and change management planning."
-            ]
-        elif style == 'educational':
-            responses = [
-                f"Learning Guide:\n\n{refined_prompt[:95]}...\n\nLet's explore this step by step to build a solid understanding:\n\n📚 Fundamental Concepts:\nThink of this like learning to drive a car - you need to understand the basic components before you can operate the whole system effectively. The core principles involve [key concept 1], [key concept 2], and [key concept 3].\n\n🔍 How It Works (Simple Analogy):\nImagine you're organizing a large library. Traditional methods might involve manually cataloging each book, but this approach is like having an intelligent system that automatically understands, categorizes, and retrieves information based on what you need.\n\n💡 Real-World Examples:\n• Example 1: How it's used in everyday applications you might recognize\n• Example 2: Industry-specific implementations and their benefits\n• Example 3: Emerging use cases and future possibilities\n\n🎯 Key Takeaways:\n- Start with understanding the basic principles\n- See how these principles apply in practice\n- Recognize the broader implications and potential\n\n📖 Next Steps for Learning:\nTo deepen your understanding, consider exploring [related topic 1], [related topic 2], and hands-on examples in your area of interest.",
-                f"Educational Overview:\n\n{refined_prompt[:105]}...\n\n🎓 Learning Objectives:\nBy the end of this explanation, you'll understand the what, why, and how of this topic, plus be able to identify practical applications.\n\n📋 Background Context:\nThis field emerged from the need to solve specific challenges that traditional approaches couldn't handle effectively. Think of it as evolution in problem-solving - each generation builds on previous knowledge to create better solutions.\n\n🔧 Core Mechanisms (Simplified):\nBreaking it down into digestible parts:\n1. Input Processing: How information enters the system\n2. Analysis Phase: What happens to that information\n3. Output Generation: How results are produced and delivered\n\n🌟 Practical Applications:\nTo make this concrete, here are some scenarios you might encounter:\n• Scenario A: [Specific example with clear benefits]\n• Scenario B: [Different context showing versatility]\n• Scenario C: [Future possibility to spark imagination]\n\n✅ Self-Check Questions:\n- Can you explain the main concept in your own words?\n- What problems does this solve?\n- How might you use this in your field or interests?\n\n🚀 Further Exploration:\nReady to dive deeper? Look into [advanced topic 1] and [advanced topic 2] for more specialized knowledge."
-            ]
-        else:  # balanced
-            responses = [
-                f"Balanced Overview:\n\n{refined_prompt[:100]}...\n\nThis topic represents an important development that balances innovation with practical application. The core concept involves sophisticated yet accessible approaches to solving real-world challenges.\n\nKey Aspects:\n• Technical foundation built on proven principles\n• Practical applications across multiple domains\n• Ongoing development and refinement\n• Growing adoption and market acceptance\n\nPractical Implications:\nOrganizations and individuals are finding value through improved efficiency, enhanced capabilities, and new opportunities for innovation. The technology strikes a good balance between complexity and usability.\n\nLooking Forward:\nContinued evolution is expected, with improvements in performance, accessibility, and integration capabilities. This represents a mature yet dynamic field with solid foundations and promising future developments.",
-                f"Comprehensive Summary:\n\n{refined_prompt[:90]}...\n\nThis area combines theoretical understanding with practical implementation, offering both immediate benefits and long-term potential. The approach is methodical yet flexible, allowing for adaptation to various needs and contexts.\n\nCore Elements:\n- Established methodologies with proven track records\n- Innovative applications addressing current challenges\n- Scalable solutions suitable for different organizational sizes\n- Integration capabilities with existing systems and processes\n\nCurrent Status:\nThe field has reached a level of maturity that enables reliable implementation while maintaining room for continued innovation. Users report positive outcomes across various metrics including efficiency, cost-effectiveness, and user satisfaction.\n\nFuture Outlook:\nExpected developments include enhanced capabilities, broader accessibility, and deeper integration with emerging technologies. The trajectory suggests sustained growth and continued relevance in addressing evolving needs."
-            ]
-        
-        return random.choice(responses)
-
-    def call_gpt(self, prompt: str, model: Optional[str] = None) -> str:
-        """Make a call to GPT with the given prompt"""
-        if settings.mock_mode:
-            # Determine if this is a refinement call or final response call
-            if "Rewrite the user's vague or informal input" in prompt:
-                # Extract user input and style from the refinement template
-                try:
-                    user_input = prompt.split('User Input:\n"')[1].split('"\n\nResponse Style Requested:')[0]
-                    style = prompt.split('Response Style Requested: ')[1].split('\n\nRewritten Prompt:')[0]
-                    return self._generate_mock_refinement(user_input, style)
-                except:
-                    # Fallback for old format
-                    user_input = prompt.split('User Input:\n"')[1].split('"\n\nRewritten Prompt:')[0]
-                    return self._generate_mock_refinement(user_input)
-            else:
-                # This could be a final response call or a direct prompt call
-                style = "balanced"  # default
-                
-                # Check if this is a direct prompt with style guidance
-                if prompt.startswith("Provide a brief, direct answer."):
-                    style = "concise"
-                    # Extract the actual user input after the guidance
-                    user_input = prompt.split("\n\n", 1)[1] if "\n\n" in prompt else prompt
-                    return self._generate_mock_response(user_input, style)
-                elif prompt.startswith("Provide a comprehensive, detailed answer"):
-                    style = "detailed"
-                    user_input = prompt.split("\n\n", 1)[1] if "\n\n" in prompt else prompt
-                    return self._generate_mock_response(user_input, style)
-                elif prompt.startswith("Answer in a friendly, conversational tone"):
-                    style = "casual"
-                    user_input = prompt.split("\n\n", 1)[1] if "\n\n" in prompt else prompt
-                    return self._generate_mock_response(user_input, style)
-                elif prompt.startswith("Provide a formal, business-appropriate answer"):
-                    style = "professional"
-                    user_input = prompt.split("\n\n", 1)[1] if "\n\n" in prompt else prompt
-                    return self._generate_mock_response(user_input, style)
-                elif prompt.startswith("Provide an informative answer"):
-                    style = "educational"
-                    user_input = prompt.split("\n\n", 1)[1] if "\n\n" in prompt else prompt
-                    return self._generate_mock_response(user_input, style)
-                elif prompt.startswith("Provide a well-rounded, balanced answer"):
-                    style = "balanced"
-                    user_input = prompt.split("\n\n", 1)[1] if "\n\n" in prompt else prompt
-                    return self._generate_mock_response(user_input, style)
-                else:
-                    # Try to extract style from prompt content for refined prompts
-                    if "concise" in prompt.lower():
-                        style = "concise"
-                    elif "detailed" in prompt.lower() or "comprehensive" in prompt.lower():
-                        style = "detailed"
-                    elif "casual" in prompt.lower() or "friendly" in prompt.lower():
-                        style = "casual"
-                    elif "professional" in prompt.lower() or "formal" in prompt.lower():
-                        style = "professional"
-                    elif "educational" in prompt.lower() or "learning" in prompt.lower():
-                        style = "educational"
-                    
-                    return self._generate_mock_response(prompt, style)
-        
+    async def close(self):
+        """Close the pooled upstream HTTP clients"""
+        await model_router.close()
+
+    def _fallback(
+        self,
+        model: str,
+        mock: Callable[[], Awaitable[T]],
+        attempt: Callable[[str], Awaitable[T]],
+        hedge: bool = True
+    ) -> Optional[Callable[[], Awaitable[T]]]:
+        """What to run instead of model while its circuit breaker is open (UPSTREAM_FALLBACK)"""
+        fallback = settings.upstream_fallback
+        if fallback == "mock":
+            return mock
+        if fallback and fallback != model:
+            return lambda: resilience.call(fallback, attempt, hedge=hedge)
+        return None
+
+    async def call_gpt(
+        self,
+        prompt: str,
+        meta: CallMetadata,
+        model: Optional[str] = None,
+        priority: str = "interactive"
+    ) -> ModelReply:
+        """
+        Make a call to GPT with the given prompt, with scheduling, retries and circuit breaking
+        model names a route; by default the model router picks one for the stage and style.
+        """
+        if model is None:
+            model = model_router.choose(meta.stage, meta.style)
+        estimate = estimate_tokens(prompt, MAX_COMPLETION_TOKENS)
+        attempt = lambda attempt_model: self._attempt_gpt(prompt, meta, attempt_model, estimate, priority)
+
+        async def mock() -> ModelReply:
+            completion = await model_router.mock.complete(prompt, model, meta)
+            return ModelReply(completion.text, "mock")
+
+        try:
+            reply = await resilience.call(model, attempt, fallback=self._fallback(model, mock, attempt))
+        except UpstreamRateLimited:
+            # Still rate limited after retrying: report the queue instead of failing
+            raise SchedulerBusy(upstream_scheduler.queue_depth, upstream_scheduler.eta(estimate))
+        metrics.model_calls.inc(stage=meta.stage, model=reply.model)
+        return reply
+
+    async def _attempt_gpt(self, prompt: str, meta: CallMetadata, model: str, estimate: int, priority: str) -> ModelReply:
+        """One upstream attempt, once the scheduler admits it"""
+        await upstream_scheduler.acquire(estimate, priority)
+        route = model_router.route(model)
+        start = time.time()
+        try:
+            completion = await model_router.backend_for(route).complete(prompt, route.model, meta)
+        except Exception as e:
+            raise self._failed(model, meta, e) from e
+        model_router.observe(model, meta.stage, meta.style, (time.time() - start) * 1000, completion.total_tokens, ok=True)
+        if completion.total_tokens is not None:
+            upstream_scheduler.settle(estimate, completion.total_tokens)
+        return ModelReply(completion.text, model)
+
+    def _failed(self, model: str, meta: CallMetadata, error: Exception) -> UpstreamError:
+        """Classify a failed attempt and count it against the route"""
+        model_router.observe(model, meta.stage, meta.style, 0.0, None, ok=False)
+        error = classify(error)
+        if isinstance(error, UpstreamRateLimited):
+            # Hold back every caller until the upstream's Retry-After has passed
+            upstream_scheduler.pause(error.retry_after)
+        return error
+
+    def stream_gpt(
+        self,
+        prompt: str,
+        meta: CallMetadata,
+        model: Optional[str] = None,
+        priority: str = "interactive"
+    ) -> AnswerStream:
+        """Stream a GPT answer for the given prompt as it is generated"""
+        stream = AnswerStream()
+        stream.chunks = self._stream_chunks(prompt, meta, model, priority, stream)
+        return stream
+
+    async def _stream_chunks(
+        self,
+        prompt: str,
+        meta: CallMetadata,
+        model: Optional[str],
+        priority: str,
+        stream: AnswerStream
+    ) -> AsyncIterator[str]:
         if model is None:
-            model = settings.default_model
-        # Make real GPT API call using client (with proxies disabled)
+            model = model_router.choose(meta.stage, meta.style)
+        estimate = estimate_tokens(prompt, MAX_COMPLETION_TOKENS)
+        attempt = lambda attempt_model: self._open_stream(prompt, meta, attempt_model, estimate, priority)
+
+        async def mock_stream() -> Tuple[AsyncIterator[str], str]:
+            # The fallback skipped the scheduler, so there is nothing to settle
+            return await model_router.mock.open_stream(prompt, model, meta, lambda tokens: None), "mock"
+
         try:
-            client = self.client
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=2000
+            # Retries cover opening the stream; hedging is off so no second stream is left open
+            chunks, stream.model = await resilience.call(
+                model, attempt, fallback=self._fallback(model, mock_stream, attempt, hedge=False), hedge=False
             )
-            return response.choices[0].message.content.strip()
+        except UpstreamRateLimited:
+            raise SchedulerBusy(upstream_scheduler.queue_depth, upstream_scheduler.eta(estimate))
+        metrics.model_calls.inc(stage=meta.stage, model=stream.model)
+        async for chunk in chunks:
+            yield chunk
+
+    async def _open_stream(
+        self, prompt: str, meta: CallMetadata, model: str, estimate: int, priority: str
+    ) -> Tuple[AsyncIterator[str], str]:
+        """Start one streaming attempt; returns once the upstream has accepted the request"""
+        await upstream_scheduler.acquire(estimate, priority)
+        route = model_router.route(model)
+        usage: List[int] = []
+
+        def on_usage(tokens: int):
+            usage.append(tokens)
+            upstream_scheduler.settle(estimate, tokens)
+
+        start = time.time()
+        try:
+            chunks = await model_router.backend_for(route).open_stream(prompt, route.model, meta, on_usage)
         except Exception as e:
-            raise Exception(f"GPT API call failed: {str(e)}")
+            raise self._failed(model, meta, e) from e
+        return self._read_stream(chunks, model, meta, start, usage), model
 
-    def refine_prompt(self, raw_input: str, style: str = "balanced") -> Tuple[str, float]:
-        """Refine the user's raw input into a better prompt"""
+    async def _read_stream(
+        self, chunks: AsyncIterator[str], model: str, meta: CallMetadata, start: float, usage: List[int]
+    ) -> AsyncIterator[str]:
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            raise self._failed(model, meta, e) from e
+        tokens = usage[-1] if usage else None
+        model_router.observe(model, meta.stage, meta.style, (time.time() - start) * 1000, tokens, ok=True)
+
+    async def refine_prompt(
+        self,
+        raw_input: str,
+        style: str = "balanced",
+        priority: str = "interactive"
+    ) -> Tuple[str, float, str]:
+        """Refine the user's raw input into a better prompt; returns (refined, time_ms, model)"""
         start_time = time.time()
         refinement_prompt = self.prompt_refiner_template.format(
             user_input=raw_input, 
             style=style
         )
-        refined = self.call_gpt(refinement_prompt, model=settings.refinement_model)
+        meta = CallMetadata("refinement", style, raw_input)
+        reply = await self.call_gpt(refinement_prompt, meta, priority=priority)
         end_time = time.time()
-        return refined, (end_time - start_time) * 1000
+        return reply.text, (end_time - start_time) * 1000, reply.model
+
+    async def refine_prompt_cached(
+        self,
+        raw_input: str,
+        style: str = "balanced",
+        use_cache: bool = True,
+        priority: str = "interactive"
+    ) -> Refinement:
+        """
+        Refine the prompt, reusing a cached refinement for repeat inputs
+        Inputs the local classifier finds well specified skip the refinement call and
+        get the style-guided direct prompt instead.
+        """
+        if use_cache:
+            cached = refinement_cache.get(raw_input, style)
+            if cached is not None:
+                refined, original_time, model = cached
+                metrics.cache_hits.inc(cache="refinement")
+                return Refinement(refined, 0.0, cached=True, saved_ms=original_time, model=model)
+        if prompt_classifier.should_bypass(raw_input):
+            saved_ms = metrics.stage_quantile("refinement", 0.5) or 0.0
+            prompt_classifier.record_saved(saved_ms)
+            metrics.refinement_bypassed.inc()
+            return Refinement(self._build_direct_prompt(raw_input, style), 0.0, saved_ms=saved_ms, bypassed=True)
+        refined, refinement_time, model = await self.refine_prompt(raw_input, style, priority)
+        metrics.observe_stage("refinement", refinement_time, model, style)
+        refinement_cache.set(raw_input, style, refined, refinement_time, model)
+        return Refinement(refined, refinement_time, model=model)
 
-    def generate_final_answer(self, refined_prompt: str) -> Tuple[str, float]:
-        """Generate the final answer using the refined prompt"""
+    async def generate_final_answer(
+        self,
+        refined_prompt: str,
+        style: str = "balanced",
+        priority: str = "interactive"
+    ) -> Tuple[str, float, str]:
+        """Generate the final answer using the refined prompt; returns (answer, time_ms, model)"""
         start_time = time.time()
-        answer = self.call_gpt(refined_prompt, model=settings.default_model)
+        meta = CallMetadata("generation", style)
+        reply = await self.call_gpt(refined_prompt, meta, priority=priority)
         end_time = time.time()
-        return answer, (end_time - start_time) * 1000
+        return reply.text, (end_time - start_time) * 1000, reply.model
 
-    def generate_direct_answer(self, user_input: str, style: str = "balanced") -> Tuple[str, float]:
-        """Generate answer directly from user input without refinement"""
-        start_time = time.time()
-        
-        # Add style guidance to the direct prompt
+    def _build_direct_prompt(self, user_input: str, style: str = "balanced") -> str:
+        """Prefix the raw user input with guidance for the requested style"""
         style_guidance = {
             'concise': "Provide a brief, direct answer.",
             'detailed': "Provide a comprehensive, detailed answer with examples.",
@@ -226,33 +297,251 @@ Rewritten Prompt:
         }
         
         guidance = style_guidance.get(style, style_guidance['balanced'])
-        styled_prompt = f"{guidance}\n\n{user_input}"
-        
-        answer = self.call_gpt(styled_prompt, model=settings.default_model)
+        return f"{guidance}\n\n{user_input}"
+
+    async def generate_direct_answer(
+        self,
+        user_input: str,
+        style: str = "balanced",
+        priority: str = "interactive"
+    ) -> Tuple[str, float, str]:
+        """Generate answer directly from user input without refinement; returns (answer, time_ms, model)"""
+        start_time = time.time()
+        styled_prompt = self._build_direct_prompt(user_input, style)
+        meta = CallMetadata("direct", style, user_input)
+        reply = await self.call_gpt(styled_prompt, meta, priority=priority)
         end_time = time.time()
-        return answer, (end_time - start_time) * 1000
+        return reply.text, (end_time - start_time) * 1000, reply.model
+
+    def stream_final_answer(self, refined_prompt: str, style: str = "balanced") -> AnswerStream:
+        """Stream the final answer for the refined prompt token by token"""
+        return self.stream_gpt(refined_prompt, CallMetadata("generation", style))
+
+    def stream_direct_answer(self, user_input: str, style: str = "balanced") -> AnswerStream:
+        """Stream an answer directly from user input without refinement"""
+        styled_prompt = self._build_direct_prompt(user_input, style)
+        return self.stream_gpt(styled_prompt, CallMetadata("direct", style, user_input))
 
-    def process_user_input(self, raw_input: str, style: str = "balanced", skip_refinement: bool = False) -> Tuple[str, str, str, float, float, float]:
+    async def process_user_input(
+        self,
+        raw_input: str,
+        style: str = "balanced",
+        skip_refinement: bool = False,
+        use_cache: bool = True,
+        priority: str = "interactive"
+    ) -> PipelineResult:
         """
         Complete processing pipeline: refine prompt and generate answer, or process directly
-        Returns: (refined_prompt, final_answer, model_used, total_time_ms, refinement_time_ms, generation_time_ms)
+        Answers and refinements are served from cache when possible; use_cache=False
+        skips the lookups but still refreshes the cached entries. priority picks the
+        upstream scheduler queue (interactive, batch or debug).
         """
         total_start = time.time()
         
+        cache_key = response_cache.key_for(raw_input, style, skip_refinement)
+        if use_cache:
+            cached = await self.cached_result(raw_input, style, skip_refinement, cache_key)
+            if cached is not None:
+                return cached
+        else:
+            response_cache.record_bypass()
+        
+        if settings.coalesce_requests:
+            # Identical prompts already in flight share a single upstream call
+            result, shared = await prompt_flights.do(
+                cache_key,
+                lambda: self._run_pipeline(raw_input, style, skip_refinement, use_cache, cache_key, priority)
+            )
+        else:
+            result = await self._run_pipeline(raw_input, style, skip_refinement, use_cache, cache_key, priority)
+            shared = False
+        
+        total_time = (time.time() - total_start) * 1000
+        if shared:
+            metrics.coalesced.inc()
+        metrics.observe_stage("total", total_time, result.model_used, style)
+        return result._replace(total_time_ms=total_time, coalesced=shared)
+
+    async def cached_result(
+        self,
+        raw_input: str,
+        style: str,
+        skip_refinement: bool,
+        cache_key: str
+    ) -> Optional[PipelineResult]:
+        """The answer from the exact or semantic response cache, if either has one (hit metrics recorded)"""
+        total_start = time.time()
+        cached = await response_cache.get(cache_key)
+        similarity = None
+        tier = "response"
+        if cached is None:
+            match = await semantic_cache.get(raw_input, style, skip_refinement)
+            if match is None:
+                return None
+            # A near-duplicate of an earlier input; reuse its answer
+            cached, similarity = match
+            tier = "semantic"
+        total_time = (time.time() - total_start) * 1000
+        metrics.cache_hits.inc(cache=tier)
+        metrics.observe_stage("total", total_time, cached["model_used"], style)
+        return PipelineResult(
+            cached["refined_prompt"], cached["final_answer"], cached["model_used"],
+            total_time, 0.0, 0.0, cache_hit=True, semantic_similarity=similarity,
+            refinement_model=cached.get("refinement_model")
+        )
+
+    async def _run_pipeline(
+        self,
+        raw_input: str,
+        style: str,
+        skip_refinement: bool,
+        use_cache: bool,
+        cache_key: str,
+        priority: str = "interactive"
+    ) -> PipelineResult:
+        """Run the upstream refine/generate calls and store the answer in the response cache"""
+        total_start = time.time()
+        
+        if not skip_refinement and settings.speculative_mode and not (
+            (use_cache and refinement_cache.contains(raw_input, style)) or prompt_classifier.would_bypass(raw_input)
+        ):
+            # A cached or bypassed refinement already makes the refined path one hop, so only race otherwise
+            return await self._run_speculative(raw_input, style, use_cache, cache_key, priority)
+        
+        refinement = Refinement(raw_input, 0.0)
         if skip_refinement:
             # Process directly without refinement
-            final_answer, generation_time = self.generate_direct_answer(raw_input, style)
+            final_answer, generation_time, model = await self.generate_direct_answer(raw_input, style, priority)
             refined_prompt = raw_input  # Use original input as "refined" prompt for logging
             refinement_time = 0.0  # No refinement time
         else:
-            # Use the normal two-stage process
-            refined_prompt, refinement_time = self.refine_prompt(raw_input, style)
-            final_answer, generation_time = self.generate_final_answer(refined_prompt)
+            # Use the normal two-stage process; a cached refinement skips the first hop
+            refinement = await self.refine_prompt_cached(raw_input, style, use_cache=use_cache, priority=priority)
+            refined_prompt, refinement_time = refinement.refined_prompt, refinement.refinement_time_ms
+            final_answer, generation_time, model = await self.generate_final_answer(refined_prompt, style, priority)
+        metrics.observe_stage("generation", generation_time, model, style)
+        
+        await self.cache_answer(
+            cache_key, raw_input, style, skip_refinement, refined_prompt, final_answer, model, refinement.model
+        )
         
         total_end = time.time()
         total_time = (total_end - total_start) * 1000
         
-        return refined_prompt, final_answer, settings.default_model, total_time, refinement_time, generation_time
+        return PipelineResult(
+            refined_prompt, final_answer, model,
+            total_time, refinement_time, generation_time,
+            refinement_cached=refinement.cached,
+            refinement_saved_ms=refinement.saved_ms,
+            refinement_bypassed=refinement.bypassed,
+            refinement_model=refinement.model
+        )
+
+    async def cache_answer(
+        self,
+        cache_key: str,
+        raw_input: str,
+        style: str,
+        skip_refinement: bool,
+        refined_prompt: str,
+        final_answer: str,
+        model_used: str,
+        refinement_model: Optional[str]
+    ):
+        """Store a fresh answer in the exact and semantic response caches"""
+        value = {
+            "refined_prompt": refined_prompt,
+            "final_answer": final_answer,
+            "model_used": model_used,
+            "refinement_model": refinement_model
+        }
+        await response_cache.set(cache_key, value)
+        await semantic_cache.set(raw_input, style, skip_refinement, value)
+
+    def _speculative_preference(self, raw_input: str) -> str:
+        """Which path the speculative policy favours: direct, refined, or slo (decide by deadline)"""
+        if settings.speculative_policy == "length":
+            return "direct" if len(raw_input) <= settings.speculative_max_direct_chars else "refined"
+        return "slo"
+
+    async def _run_speculative(
+        self,
+        raw_input: str,
+        style: str,
+        use_cache: bool,
+        cache_key: str,
+        priority: str
+    ) -> PipelineResult:
+        """Run the direct and refined paths concurrently; keep the one the policy picks, cancel the other"""
+        total_start = time.time()
+
+        async def refined_path() -> Tuple[Refinement, str, float, str]:
+            refinement = await self.refine_prompt_cached(raw_input, style, use_cache=use_cache, priority=priority)
+            answer, generation_time, model = await self.generate_final_answer(refinement.refined_prompt, style, priority)
+            return refinement, answer, generation_time, model
+
+        paths = {
+            "direct": asyncio.ensure_future(self.generate_direct_answer(raw_input, style, priority)),
+            "refined": asyncio.ensure_future(refined_path()),
+        }
+        try:
+            preference = self._speculative_preference(raw_input)
+            if preference == "slo":
+                # The refined answer wins if it lands within the SLO; after that, take the direct one
+                remaining = settings.speculative_slo_ms / 1000.0 - (time.time() - total_start)
+                done, _ = await asyncio.wait({paths["refined"]}, timeout=max(0.0, remaining))
+                preference = "refined" if done and paths["refined"].exception() is None else "direct"
+            winner = preference
+            await asyncio.wait({paths[winner]})
+            if paths[winner].exception() is not None:
+                # The preferred path failed; fall back to the other one
+                winner = "refined" if winner == "direct" else "direct"
+                await asyncio.wait({paths[winner]})
+                if paths[winner].exception() is not None:
+                    raise paths[preference].exception()
+        finally:
+            for task in paths.values():
+                if task.done() and not task.cancelled():
+                    task.exception()  # Mark a losing path's failure as retrieved
+                else:
+                    task.cancel()
+
+        saved_ms = 0.0
+        if winner == "direct":
+            final_answer, generation_time, model = paths["direct"].result()
+            refinement = Refinement(raw_input, 0.0)
+            refined_prompt = raw_input  # Use original input as "refined" prompt for logging
+        else:
+            refinement, final_answer, generation_time, model = paths["refined"].result()
+            refined_prompt = refinement.refined_prompt
+        total_time = (time.time() - total_start) * 1000
+        if winner == "direct":
+            # Estimate what the sequential path would have cost from recent median stage latencies
+            typical_refinement = metrics.stage_quantile("refinement", 0.5)
+            typical_generation = metrics.stage_quantile("generation", 0.5)
+            if typical_refinement is not None and typical_generation is not None:
+                saved_ms = max(0.0, typical_refinement + typical_generation - total_time)
+        metrics.speculative_wins.inc(path=winner)
+        metrics.observe_stage("generation", generation_time, model, style)
+
+        # A direct answer is what skip_refinement=True returns, so it must not answer refined lookups
+        skip_refinement = winner == "direct"
+        if skip_refinement:
+            cache_key = response_cache.key_for(raw_input, style, True)
+        await self.cache_answer(
+            cache_key, raw_input, style, skip_refinement, refined_prompt, final_answer, model, refinement.model
+        )
+
+        return PipelineResult(
+            refined_prompt, final_answer, model,
+            total_time, refinement.refinement_time_ms, generation_time,
+            refinement_cached=refinement.cached,
+            refinement_saved_ms=refinement.saved_ms,
+            refinement_bypassed=refinement.bypassed,
+            refinement_model=refinement.model,
+            speculative_winner=winner,
+            speculative_saved_ms=saved_ms
+        )
 
 
 # Global instance
@@ -0,0 +1,319 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import asyncio
+import ipaddress
+import json
+import uuid
+import httpx
+from sqlalchemy import create_engine, inspect, select, text, update, or_, and_, Column, Integer, String, Text, DateTime, Index
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app.gpt_service import gpt_service
+from app.log_writer import log_prompt_interaction
+from app.scheduler import SchedulerBusy
+
+# Jobs live in their own database (SQLite by default) so no broker is needed
+JobBase = declarative_base()
+
+
+class PromptJob(JobBase):
+    __tablename__ = "prompt_jobs"
+    __table_args__ = (Index("idx_prompt_jobs_status_created", "status", "created_at"),)
+
+    id = Column(String(32), primary_key=True)
+    status = Column(String(16), nullable=False, default="queued")  # queued, running, succeeded, failed
+    request = Column(Text, nullable=False)  # UserPrompt as JSON
+    result = Column(Text, nullable=True)  # PromptResponse as JSON
+    error = Column(Text, nullable=True)
+    callback_url = Column(String(2048), nullable=True)
+    user_ip = Column(String(45), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    not_before = Column(DateTime, nullable=True)  # A failed job is retried after this (backoff)
+
+
+async def check_callback_url(url: str) -> Optional[str]:
+    """
+    Raise ValueError unless url is http(s) on an allowed host or one resolving only to public addresses
+    Returns the checked address to connect to (None for allowlisted hosts, which are trusted by name).
+    """
+    parsed = httpx.URL(url)
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise ValueError("callback_url must be an http(s) URL")
+    if settings.job_callback_allowed_hosts:
+        if parsed.host.lower() not in {host.lower() for host in settings.job_callback_allowed_hosts}:
+            raise ValueError(f"callback_url host {parsed.host} is not in JOB_CALLBACK_ALLOWED_HOSTS")
+        return None
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(parsed.host, port)
+    except OSError:
+        raise ValueError(f"callback_url host {parsed.host} does not resolve")
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        # Loopback, private, link-local (cloud metadata), shared and reserved ranges are all non-global
+        if not address.is_global:
+            raise ValueError(f"callback_url host {parsed.host} resolves to non-public address {address}")
+    return str(addresses[0][4][0])
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff before the next attempt of a job that has failed attempts times"""
+    seconds = settings.job_retry_base_seconds * (2 ** max(0, attempts - 1))
+    return timedelta(seconds=min(settings.job_retry_max_seconds, seconds))
+
+
+class JobQueue:
+    """Persistent prompt job queue drained by a pool of in-process workers"""
+
+    def __init__(self):
+        self._engine = None
+        self._sessions = None
+        self._workers: List["asyncio.Task[None]"] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def _connect(self):
+        if self._engine is None:
+            self._engine = create_engine(settings.job_queue_url)
+            self._sessions = sessionmaker(autocommit=False, autoflush=False, bind=self._engine)
+            JobBase.metadata.create_all(bind=self._engine)
+            self._add_missing_columns()
+
+    def _add_missing_columns(self):
+        """Columns added after a queue database was created (create_all only creates tables)"""
+        with self._engine.begin() as connection:
+            existing = {column["name"] for column in inspect(connection).get_columns(PromptJob.__tablename__)}
+            for column in PromptJob.__table__.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=connection.dialect)
+                    connection.execute(text(f"ALTER TABLE {PromptJob.__tablename__} ADD COLUMN {column.name} {column_type}"))
+
+    async def start(self):
+        """Open the queue database and start the worker pool"""
+        await run_in_threadpool(self._connect)
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(settings.job_workers)]
+
+    async def stop(self):
+        """Stop the workers; a job interrupted mid-run is picked up again once its lease expires"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def enqueue(self, prompt: Dict[str, Any], user_ip: Optional[str] = None, callback_url: Optional[str] = None) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        job = await run_in_threadpool(self._insert, job_id, prompt, user_ip, callback_url)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await run_in_threadpool(self._load, job_id)
+
+    def _insert(self, job_id: str, prompt: Dict[str, Any], user_ip: Optional[str], callback_url: Optional[str]) -> Dict[str, Any]:
+        self._connect()
+        with self._sessions() as db:
+            job = PromptJob(
+                id=job_id,
+                status="queued",
+                request=json.dumps(prompt),
+                callback_url=callback_url,
+                user_ip=user_ip,
+                created_at=datetime.utcnow()
+            )
+            db.add(job)
+            db.commit()
+            return self._to_dict(job)
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._connect()
+        with self._sessions() as db:
+            job = db.get(PromptJob, job_id)
+            return self._to_dict(job) if job is not None else None
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest runnable job (queued and due, or running with an expired lease)"""
+        now = datetime.utcnow()
+        runnable = or_(
+            and_(PromptJob.status == "queued", or_(PromptJob.not_before.is_(None), PromptJob.not_before <= now)),
+            # A lease expires when its worker died; a job that keeps killing workers stops at job_max_attempts
+            and_(
+                PromptJob.status == "running", PromptJob.lease_expires_at < now,
+                PromptJob.attempts < settings.job_max_attempts
+            )
+        )
+        with self._sessions() as db:
+            for job_id in db.scalars(
+                select(PromptJob.id).where(runnable).order_by(PromptJob.created_at).limit(5)
+            ).all():
+                # Conditional update: only one worker (in any process) wins the claim
+                claimed = db.execute(
+                    update(PromptJob)
+                    .where(PromptJob.id == job_id, runnable)
+                    .values(
+                        status="running",
+                        started_at=now,
+                        attempts=PromptJob.attempts + 1,
+                        lease_expires_at=now + timedelta(seconds=settings.job_lease_seconds)
+                    )
+                )
+                db.commit()
+                if claimed.rowcount == 1:
+                    return self._to_dict(db.get(PromptJob, job_id))
+        return None
+
+    def _fail_abandoned(self) -> List[str]:
+        """Fail jobs whose last allowed attempt lost its worker; returns the ids this call failed"""
+        now = datetime.utcnow()
+        abandoned = and_(
+            PromptJob.status == "running", PromptJob.lease_expires_at < now,
+            PromptJob.attempts >= settings.job_max_attempts
+        )
+        failed = []
+        with self._sessions() as db:
+            for job_id in db.scalars(select(PromptJob.id).where(abandoned).limit(100)).all():
+                # Conditional, so with several workers only one fails (and notifies) each job
+                result = db.execute(
+                    update(PromptJob)
+                    .where(PromptJob.id == job_id, abandoned)
+                    .values(
+                        status="failed",
+                        error=f"Worker stopped during the last allowed attempt ({settings.job_max_attempts})",
+                        finished_at=now,
+                        lease_expires_at=None
+                    )
+                )
+                db.commit()
+                if result.rowcount == 1:
+                    failed.append(job_id)
+        return failed
+
+    def _finish(
+        self, job_id: str, result: Optional[Dict[str, Any]], error: Optional[str], retry: bool = False, delay: timedelta = timedelta()
+    ):
+        with self._sessions() as db:
+            values: Dict[str, Any] = {"lease_expires_at": None}
+            if retry:
+                values["status"] = "queued"
+                values["error"] = error
+                values["not_before"] = datetime.utcnow() + delay
+                if error is None:
+                    # Requeued without running (upstream busy); don't count the attempt
+                    values["attempts"] = PromptJob.attempts - 1
+            else:
+                values["status"] = "succeeded" if error is None else "failed"
+                values["result"] = json.dumps(result) if result is not None else None
+                values["error"] = error
+                values["finished_at"] = datetime.utcnow()
+            db.execute(update(PromptJob).where(PromptJob.id == job_id).values(**values))
+            db.commit()
+
+    async def _worker(self):
+        while True:
+            try:
+                for job_id in await run_in_threadpool(self._fail_abandoned):
+                    await self._notify(job_id)
+                job = await run_in_threadpool(self._claim)
+            except Exception as e:
+                print(f"Warning: Could not claim job: {e}")
+                job = None
+            if job is None:
+                # Wake on a local enqueue, or poll for jobs enqueued by other processes
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.job_poll_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Dict[str, Any]):
+        prompt = job["request"]
+        try:
+            result = await gpt_service.process_user_input(
+                prompt["text"],
+                prompt.get("style") or "balanced",
+                prompt.get("skip_refinement") or False,
+                use_cache=prompt.get("cache") is not False,
+                priority="batch"
+            )
+        except SchedulerBusy as e:
+            # Upstream is saturated: put the job back and give the budget time to refill
+            await run_in_threadpool(self._finish, job["job_id"], None, None, True)
+            await asyncio.sleep(e.eta_seconds)
+            return
+        except Exception as e:
+            retry = job["attempts"] < settings.job_max_attempts
+            await run_in_threadpool(
+                self._finish, job["job_id"], None, f"Processing failed: {str(e)}", retry, retry_delay(job["attempts"])
+            )
+            if not retry:
+                await self._notify(job["job_id"])
+            return
+
+        await log_prompt_interaction(
+            raw_input=prompt["text"],
+            refined_prompt=result.refined_prompt,
+            final_output=result.final_answer,
+            user_ip=job["user_ip"],
+            model_used=result.model_used,
+            refinement_model=result.refinement_model
+        )
+        await run_in_threadpool(self._finish, job["job_id"], {
+            "response": result.final_answer,
+            "processing_time_ms": result.total_time_ms,
+            "model_used": result.model_used
+        }, None)
+        await self._notify(job["job_id"])
+
+    async def _notify(self, job_id: str):
+        """POST the finished job to its callback URL, if any (best effort)"""
+        job = await self.get(job_id)
+        if job is None or not job["callback_url"]:
+            return
+        payload = {key: value for key, value in job.items() if key not in ("request", "callback_url", "user_ip")}
+        try:
+            # Checked again at send time: the host may resolve elsewhere now than when the job was queued
+            address = await check_callback_url(job["callback_url"])
+            url = httpx.URL(job["callback_url"])
+            headers = {"Content-Type": "application/json"}
+            extensions = {}
+            if address is not None:
+                # Connect to the address just checked; letting httpx resolve the name again would let
+                # a rebinding DNS server swap in a private address after the check
+                headers["Host"] = url.netloc.decode("ascii")
+                if url.scheme == "https":
+                    extensions["sni_hostname"] = url.host  # Also what the certificate is verified against
+                url = url.copy_with(host=address)
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                await client.post(url, content=json.dumps(payload, default=str), headers=headers, extensions=extensions)
+        except Exception as e:
+            print(f"Warning: Job callback to {job['callback_url']} failed: {e}")
+
+    @staticmethod
+    def _to_dict(job: PromptJob) -> Dict[str, Any]:
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "request": json.loads(job.request),
+            "result": json.loads(job.result) if job.result else None,
+            "error": job.error,
+            "callback_url": job.callback_url,
+            "user_ip": job.user_ip,
+            "attempts": job.attempts,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+
+# Global instance
+job_queue = JobQueue()
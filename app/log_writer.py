@@ -0,0 +1,155 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+from app.config import settings
+from app.database import write_prompt_logs
+
+
+def _json_default(value: Any) -> str:
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+class JsonlLogSink:
+    """Buffered append-only JSONL file used when no database is configured"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def write(self, rows: List[Dict[str, Any]]) -> bool:
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", buffering=64 * 1024, encoding="utf-8")
+            for row in rows:
+                self._file.write(json.dumps(row, default=_json_default) + "\n")
+            self._file.flush()  # One write syscall per batch
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class PromptLogWriter:
+    """Write-behind logger: requests enqueue rows, a background task bulk-inserts them"""
+
+    def __init__(self):
+        self.sink = JsonlLogSink(settings.log_file_path)
+        self._queue: Optional["asyncio.Queue[Dict[str, Any]]"] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.batches = 0
+        self.backpressure_waits = 0
+
+    def start(self):
+        """Start the background flush task on the running event loop"""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=settings.log_queue_max_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued and stop the background task"""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._queue = None
+        self.sink.close()
+
+    async def submit(self, row: Dict[str, Any]):
+        """Queue a row for writing; waits for room when the queue is full"""
+        self.start()
+        if self._queue.full():
+            self.backpressure_waits += 1
+        await self._queue.put(row)
+
+    async def submit_many(self, rows: List[Dict[str, Any]]):
+        """Queue several rows; they are flushed together in the next bulk insert"""
+        for row in rows:
+            await self.submit(row)
+
+    async def _run(self):
+        while True:
+            # Block for the first row, then gather a batch until it is full or the interval passes
+            batch = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + settings.log_flush_interval_seconds
+            while len(batch) < settings.log_batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        self.batches += 1
+        # Fall back to the file sink if the database is unavailable or the insert fails
+        if await write_prompt_logs(batch) or self.sink.write(batch):
+            self.rows_written += len(batch)
+        else:
+            self.rows_failed += len(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "batches": self.batches,
+            "backpressure_waits": self.backpressure_waits,
+        }
+
+
+async def log_prompt_interaction(
+    raw_input: str,
+    refined_prompt: str,
+    final_output: str,
+    user_ip: Optional[str] = None,
+    model_used: Optional[str] = None,
+    refinement_model: Optional[str] = None
+):
+    """Queue a prompt interaction for logging without touching the database on the request path"""
+    await log_writer.submit(make_log_row(raw_input, refined_prompt, final_output, user_ip, model_used, refinement_model))
+
+
+async def log_prompt_interactions(rows: List[Dict[str, Any]]):
+    """Queue several interactions (built with make_log_row) for one bulk insert"""
+    await log_writer.submit_many(rows)
+
+
+def make_log_row(
+    raw_input: str,
+    refined_prompt: str,
+    final_output: str,
+    user_ip: Optional[str] = None,
+    model_used: Optional[str] = None,
+    refinement_model: Optional[str] = None
+) -> Dict[str, Any]:
+    return {
+        "timestamp": datetime.utcnow(),
+        "raw_input": raw_input,
+        "refined_prompt": refined_prompt,
+        "final_output": final_output,
+        "user_ip": user_ip,
+        "model_used": model_used,
+        "refinement_model": refinement_model,
+    }
+
+
+# Global instance
+log_writer = PromptLogWriter()
@@ -1,14 +1,39 @@
-from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi import FastAPI, HTTPException, Query, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from slowapi.errors import RateLimitExceeded
 from slowapi import _rate_limit_exceeded_handler
-from datetime import datetime, timedelta
-from sqlalchemy import func
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import csv
+import io
+import json
+import math
 import time
 
-from app.models import UserPrompt, PromptResponse, DebugPromptResponse, HealthResponse
-from app.gpt_service import gpt_service
-from app.database import log_prompt_interaction, get_db, PromptLog
+from app.models import (
+    UserPrompt, PromptResponse, DebugPromptResponse, HealthResponse,
+    BatchPromptRequest, BatchItemResult, BatchPromptResponse,
+    JobRequest, JobStatusResponse, LogEntry, LogPage, LogSearchPage
+)
+from app.gpt_service import PipelineResult, gpt_service
+from app.cache import FlightAbandoned, prompt_flights, refinement_cache, response_cache
+from app.database import (
+    DatabaseUnavailable, SearchUnavailable, backfill_search_index, browse_logs, close_database, database_session,
+    database_stats, init_database, query_prompt_stats, query_prompt_totals, search_logs, stream_logs
+)
+from app.jobs import check_callback_url, job_queue
+from app.log_writer import log_prompt_interaction, log_prompt_interactions, log_writer, make_log_row
+from app.metrics import metrics
+from app.prompt_classifier import prompt_classifier
+from app.resilience import CircuitOpen, resilience
+from app.retention import find_archive, iter_archive, load_manifest, log_retention
+from app.router import model_router
+from app.scheduler import SchedulerBusy, upstream_scheduler
+from app.semantic_cache import semantic_cache
 from app.auth import verify_token, get_client_ip
 from app.rate_limiter import limiter, rate_limit_string
 from app.config import settings
@@ -16,18 +41,75 @@ from app.config import settings
 # Track startup time for uptime calculation
 startup_time = time.time()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup and shutdown hooks"""
+    # Open the database pool and create the schema before any request needs them
+    await init_database()
+    # Index texts logged before search was enabled without holding up startup
+    search_backfill = asyncio.create_task(backfill_search_index())
+    await log_retention.start()
+    log_writer.start()
+    await gpt_service.warm_up()
+    await prompt_classifier.warm_up()
+    await semantic_cache.restore()
+    await job_queue.start()
+    yield
+    # Stop job workers, flush queued log rows, snapshot the semantic cache and release pooled connections
+    await job_queue.stop()
+    await log_writer.stop()
+    await semantic_cache.persist()
+    await gpt_service.close()
+    await log_retention.stop()
+    search_backfill.cancel()
+    await asyncio.gather(search_backfill, return_exceptions=True)
+    await close_database()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="Answer Architect API",
     description="An AI system that refines user prompts before generating responses",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Add rate limiter to app
 app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    """Count rate-limit rejections before returning slowapi's 429 response"""
+    metrics.rate_limited.inc(endpoint=request.url.path)
+    return _rate_limit_exceeded_handler(request, exc)
+
+
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
+
+
+def scheduler_busy_handler(request: Request, exc: SchedulerBusy):
+    """Tell the client how long the upstream queue is instead of failing the request"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "queue_depth": exc.queue_depth, "eta_seconds": round(exc.eta_seconds, 2)},
+        headers={"Retry-After": str(max(1, math.ceil(exc.eta_seconds)))}
+    )
+
+
+app.add_exception_handler(SchedulerBusy, scheduler_busy_handler)
+
+
+def circuit_open_handler(request: Request, exc: CircuitOpen):
+    """Fail fast while the upstream model is unhealthy"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Processing failed: {str(exc)}"},
+        headers={"Retry-After": str(max(1, math.ceil(settings.circuit_breaker_cooldown_seconds)))}
+    )
+
+
+app.add_exception_handler(CircuitOpen, circuit_open_handler)
 
 # Add CORS middleware
 app.add_middleware(
@@ -60,37 +142,459 @@ async def handle_prompt(
     """
     Main endpoint: Accept raw user input, refine it, and return the final answer
     """
+    metrics.requests.inc(endpoint="/prompt")
     try:
         # Get client IP for logging
         client_ip = get_client_ip(request)
         
         # Process the user input through GPT refinement pipeline with style
-        refined_prompt, final_answer, model_used, total_time, refinement_time, generation_time = gpt_service.process_user_input(
+        result = await gpt_service.process_user_input(
             input_data.text, 
             input_data.style or "balanced",
-            input_data.skip_refinement or False
+            input_data.skip_refinement or False,
+            use_cache=input_data.cache is not False
         )
         
         # Log the interaction
-        log_prompt_interaction(
+        await log_prompt_interaction(
             raw_input=input_data.text,
-            refined_prompt=refined_prompt,
-            final_output=final_answer,
+            refined_prompt=result.refined_prompt,
+            final_output=result.final_answer,
             user_ip=client_ip,
-            model_used=model_used
+            model_used=result.model_used,
+            refinement_model=result.refinement_model
         )
         
         # Return only the final answer to the user
         return PromptResponse(
-            response=final_answer,
-            processing_time_ms=total_time,
-            model_used=model_used
+            response=result.final_answer,
+            processing_time_ms=result.total_time_ms,
+            model_used=result.model_used
         )
         
+    except (SchedulerBusy, CircuitOpen):
+        metrics.errors.inc(endpoint="/prompt")
+        raise
     except Exception as e:
+        metrics.errors.inc(endpoint="/prompt")
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
 
+def format_sse(event: str, data: dict) -> str:
+    """Format a single Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/prompt/stream")
+@limiter.limit(rate_limit_string)
+async def handle_prompt_stream(
+    request: Request,
+    input_data: UserPrompt,
+    token: str = Depends(verify_token)
+):
+    """
+    Streaming endpoint: Refine the prompt, then stream the final answer as Server-Sent Events
+
+    Events: "refinement" once the refined prompt is ready, "token" for each chunk
+    of the answer, then "done" with the PromptResponse metadata (or "error").
+    """
+    metrics.requests.inc(endpoint="/prompt/stream")
+    client_ip = get_client_ip(request)
+    style = input_data.style or "balanced"
+    skip_refinement = input_data.skip_refinement or False
+
+    async def event_stream():
+        total_start = time.time()
+        use_cache = input_data.cache is not False
+        cache_key = response_cache.key_for(input_data.text, style, skip_refinement)
+        flight = None
+        try:
+            # The same tiers as /prompt: exact and semantic cache, then an identical request in flight
+            shared = None
+            if use_cache:
+                shared = await gpt_service.cached_result(input_data.text, style, skip_refinement, cache_key)
+            else:
+                response_cache.record_bypass()
+            if shared is None and settings.coalesce_requests:
+                in_flight = prompt_flights.follow(cache_key)
+                if in_flight is None:
+                    # Lead: identical requests arriving meanwhile wait for this stream's answer
+                    flight = prompt_flights.lead(cache_key)
+                else:
+                    try:
+                        result = await asyncio.shield(in_flight)
+                        shared = result._replace(total_time_ms=(time.time() - total_start) * 1000, coalesced=True)
+                        metrics.coalesced.inc()
+                        metrics.observe_stage("total", shared.total_time_ms, shared.model_used, style)
+                    except FlightAbandoned:
+                        flight = prompt_flights.lead(cache_key)
+            if shared is not None:
+                # Replay the cached or shared answer as a single token
+                yield format_sse("refinement", {
+                    "refinement_time_ms": 0.0,
+                    "skipped": skip_refinement,
+                    "cached": shared.cache_hit,
+                    "coalesced": shared.coalesced,
+                    "semantic_similarity": shared.semantic_similarity
+                })
+                yield format_sse("token", {"text": shared.final_answer})
+                await log_prompt_interaction(
+                    raw_input=input_data.text,
+                    refined_prompt=shared.refined_prompt,
+                    final_output=shared.final_answer,
+                    user_ip=client_ip,
+                    model_used=shared.model_used,
+                    refinement_model=shared.refinement_model
+                )
+                yield format_sse("done", PromptResponse(
+                    response=shared.final_answer,
+                    processing_time_ms=(time.time() - total_start) * 1000,
+                    model_used=shared.model_used
+                ).model_dump())
+                return
+
+            refinement = None
+            if skip_refinement:
+                refined_prompt, refinement_time = input_data.text, 0.0
+                tokens = gpt_service.stream_direct_answer(input_data.text, style)
+            else:
+                refinement = await gpt_service.refine_prompt_cached(
+                    input_data.text, style, use_cache=input_data.cache is not False
+                )
+                refined_prompt, refinement_time = refinement.refined_prompt, refinement.refinement_time_ms
+                tokens = gpt_service.stream_final_answer(refined_prompt, style)
+            yield format_sse("refinement", {
+                "refinement_time_ms": refinement_time,
+                "skipped": skip_refinement,
+                "cached": False,
+                "refinement_cached": refinement.cached if refinement else False,
+                "refinement_bypassed": refinement.bypassed if refinement else False,
+                "refinement_saved_ms": refinement.saved_ms if refinement else 0.0
+            })
+
+            chunks = []
+            generation_start = time.time()
+            async for chunk in tokens:
+                chunks.append(chunk)
+                yield format_sse("token", {"text": chunk})
+            final_answer = "".join(chunks)
+            total_time = (time.time() - total_start) * 1000
+            refinement_model = refinement.model if refinement else None
+            generation_time = (time.time() - generation_start) * 1000
+            metrics.observe_stage("generation", generation_time, tokens.model, style)
+            metrics.observe_stage("total", total_time, tokens.model, style)
+            await gpt_service.cache_answer(
+                cache_key, input_data.text, style, skip_refinement, refined_prompt, final_answer, tokens.model, refinement_model
+            )
+            if flight is not None:
+                flight.set_result(PipelineResult(
+                    refined_prompt, final_answer, tokens.model, total_time, refinement_time, generation_time,
+                    refinement_cached=refinement.cached if refinement else False,
+                    refinement_saved_ms=refinement.saved_ms if refinement else 0.0,
+                    refinement_bypassed=refinement.bypassed if refinement else False,
+                    refinement_model=refinement_model
+                ))
+
+            await log_prompt_interaction(
+                raw_input=input_data.text,
+                refined_prompt=refined_prompt,
+                final_output=final_answer,
+                user_ip=client_ip,
+                model_used=tokens.model,
+                refinement_model=refinement_model
+            )
+
+            yield format_sse("done", PromptResponse(
+                response=final_answer,
+                processing_time_ms=total_time,
+                model_used=tokens.model
+            ).model_dump())
+        except SchedulerBusy as e:
+            metrics.errors.inc(endpoint="/prompt/stream")
+            yield format_sse("error", {"detail": str(e), "queue_depth": e.queue_depth, "eta_seconds": round(e.eta_seconds, 2)})
+        except Exception as e:
+            metrics.errors.inc(endpoint="/prompt/stream")
+            yield format_sse("error", {"detail": f"Processing failed: {str(e)}"})
+        finally:
+            if flight is not None and not flight.done():
+                # Failed or the client went away: waiters make the call themselves rather than share an error
+                flight.set_exception(FlightAbandoned())
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable nginx response buffering
+        }
+    )
+
+
+@app.post("/prompt/batch", response_model=BatchPromptResponse)
+@limiter.limit("5/minute")  # Each batch can carry many prompts
+async def handle_prompt_batch(
+    request: Request,
+    batch: BatchPromptRequest,
+    token: str = Depends(verify_token)
+):
+    """
+    Batch endpoint: Process many prompts with bounded upstream concurrency
+
+    Failures are reported per item. With stream=true, results are sent as NDJSON
+    lines in completion order; otherwise they are returned in request order.
+    """
+    metrics.requests.inc(endpoint="/prompt/batch")
+    client_ip = get_client_ip(request)
+    concurrency = min(batch.max_concurrency or settings.batch_max_concurrency, settings.batch_max_concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    log_rows: List[dict] = []
+    batch_start = time.time()
+
+    async def run_item(index: int, item: UserPrompt) -> BatchItemResult:
+        async with semaphore:
+            try:
+                result = await gpt_service.process_user_input(
+                    item.text,
+                    item.style or "balanced",
+                    item.skip_refinement or False,
+                    use_cache=item.cache is not False,
+                    priority="batch"
+                )
+            except Exception as e:
+                metrics.errors.inc(endpoint="/prompt/batch")
+                return BatchItemResult(index=index, error=f"Processing failed: {str(e)}")
+        log_rows.append(make_log_row(
+            item.text, result.refined_prompt, result.final_answer, client_ip, result.model_used,
+            result.refinement_model
+        ))
+        return BatchItemResult(index=index, result=PromptResponse(
+            response=result.final_answer,
+            processing_time_ms=result.total_time_ms,
+            model_used=result.model_used
+        ))
+
+    if batch.stream:
+        async def ndjson_stream():
+            tasks = [asyncio.ensure_future(run_item(i, item)) for i, item in enumerate(batch.items)]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    item_result = await next_done
+                    yield item_result.model_dump_json() + "\n"
+            finally:
+                # Stop outstanding upstream calls if the client goes away
+                for task in tasks:
+                    task.cancel()
+                await log_prompt_interactions(log_rows)
+
+        return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+    results = await asyncio.gather(*[run_item(i, item) for i, item in enumerate(batch.items)])
+    await log_prompt_interactions(log_rows)
+    failed = sum(1 for item_result in results if item_result.error is not None)
+    return BatchPromptResponse(
+        results=results,
+        succeeded=len(results) - failed,
+        failed=failed,
+        processing_time_ms=(time.time() - batch_start) * 1000
+    )
+
+
+@app.post("/jobs", response_model=JobStatusResponse, status_code=202)
+@limiter.limit(rate_limit_string)
+async def create_job(
+    request: Request,
+    job_request: JobRequest,
+    token: str = Depends(verify_token)
+):
+    """
+    Queue a prompt for background processing
+
+    Poll GET /jobs/{job_id} for the result, or pass callback_url to have the
+    finished job POSTed back. Queued jobs survive restarts.
+    """
+    metrics.requests.inc(endpoint="/jobs")
+    callback_url = str(job_request.callback_url) if job_request.callback_url else None
+    if callback_url:
+        try:
+            await check_callback_url(callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        prompt = job_request.model_dump(include={"text", "style", "skip_refinement", "cache"})
+        job = await job_queue.enqueue(prompt, get_client_ip(request), callback_url)
+        return JobStatusResponse(**job)
+    except Exception as e:
+        metrics.errors.inc(endpoint="/jobs")
+        raise HTTPException(status_code=500, detail=f"Could not queue job: {str(e)}")
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str, token: str = Depends(verify_token)):
+    """Status of a queued job, with its result once it has finished"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatusResponse(**job)
+
+
+@app.get("/logs", response_model=LogPage)
+async def list_logs(
+    cursor: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    order: str = Query(default="desc", pattern="^(asc|desc)$"),
+    model: Optional[str] = None,
+    user_ip: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    token: str = Depends(verify_token)
+):
+    """
+    Browse logged interactions, newest first (order=asc for oldest first)
+    Pages continue from a (timestamp, id) cursor instead of an offset, so page 10,000 costs the same as page 1.
+    """
+    after = decode_log_cursor(cursor) if cursor else None
+    try:
+        rows = await browse_logs(
+            limit + 1, after, order == "desc",
+            model=model, user_ip=user_ip, start=to_utc_naive(start), end=to_utc_naive(end)
+        )
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    next_cursor = encode_log_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return LogPage(items=rows[:limit], next_cursor=next_cursor)
+
+
+@app.get("/logs/search", response_model=LogSearchPage)
+async def search_log_entries(
+    q: str = Query(min_length=1, max_length=500),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0, le=10000),
+    model: Optional[str] = None,
+    user_ip: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    token: str = Depends(verify_token)
+):
+    """
+    Full-text search over logged prompts (raw_input) and answers (final_output), best match first
+    q takes web search syntax: words must all match, "quoted text" is a phrase, OR gives alternatives
+    and -word excludes. Each hit carries highlighted extracts of the fields that matched.
+    """
+    if not settings.log_search_enabled:
+        raise HTTPException(status_code=404, detail="Log search is disabled")
+    try:
+        hits = await search_logs(
+            q, limit + 1, offset,
+            model=model, user_ip=user_ip, start=to_utc_naive(start), end=to_utc_naive(end)
+        )
+    except SearchUnavailable:
+        raise HTTPException(status_code=503, detail="Search index unavailable")
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    next_offset = offset + limit if len(hits) > limit else None
+    return LogSearchPage(items=hits[:limit], next_offset=next_offset)
+
+
+@app.get("/logs/export")
+async def export_logs(
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    model: Optional[str] = None,
+    user_ip: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    token: str = Depends(verify_token)
+):
+    """
+    Stream every matching logged interaction as NDJSON or CSV, oldest first
+    Rows come from a server-side cursor and go out in chunks, so memory use stays flat for any export size.
+    """
+    rows = stream_logs(model=model, user_ip=user_ip, start=to_utc_naive(start), end=to_utc_naive(end))
+    # Fetch the first row now so an unavailable database is a 503 rather than an empty download
+    try:
+        first: Optional[Dict[str, Any]] = await rows.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except DatabaseUnavailable:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_chunks(first, rows, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="prompt_logs.{format}"'}
+    )
+
+
+async def export_chunks(
+    first: Optional[Dict[str, Any]], rows: AsyncIterator[Dict[str, Any]], format: str, chunk_rows: int = 500
+) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(LogEntry.model_fields))
+    if format == "csv":
+        writer.writeheader()
+    if first is None:
+        yield buffer.getvalue()
+        return
+
+    async def all_rows():
+        yield first
+        async for row in rows:
+            yield row
+
+    pending = 0
+    async for row in all_rows():
+        if format == "csv":
+            writer.writerow({**row, "timestamp": row["timestamp"].isoformat()})
+        else:
+            buffer.write(LogEntry(**row).model_dump_json() + "\n")
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def encode_log_cursor(row: Dict[str, Any]) -> str:
+    raw = f"{row['timestamp'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_log_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        timestamp, entry_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(timestamp), int(entry_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.get("/logs/archive")
+async def list_log_archives(token: str = Depends(verify_token)):
+    """Log periods moved out of the database by the retention job (LOG_RETENTION_DAYS)"""
+    return {"archives": load_manifest()}
+
+
+@app.get("/logs/archive/{period}")
+async def read_log_archive(
+    period: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    model: Optional[str] = None,
+    user_ip: Optional[str] = None,
+    limit: Optional[int] = Query(default=None, ge=1),
+    token: str = Depends(verify_token)
+):
+    """
+    Stream an archived period as NDJSON
+    The archive is decompressed and filtered line by line, so memory use does not grow with its size.
+    """
+    entry = find_archive(period)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Archived period not found")
+    lines = iter_archive(entry, to_utc_naive(start), to_utc_naive(end), model, user_ip, limit)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
 @app.post("/prompt/debug", response_model=DebugPromptResponse)
 @limiter.limit("5/minute")  # More restrictive rate limit for debug endpoint
 async def handle_prompt_debug(
@@ -102,94 +606,138 @@ async def handle_prompt_debug(
     Debug endpoint: Returns raw input, refined prompt, and final answer
     For development and admin use only
     """
+    metrics.requests.inc(endpoint="/prompt/debug")
     try:
         # Get client IP for logging
         client_ip = get_client_ip(request)
         
         # Process the user input through GPT refinement pipeline with style
-        refined_prompt, final_answer, model_used, total_time, refinement_time, generation_time = gpt_service.process_user_input(
+        result = await gpt_service.process_user_input(
             input_data.text, 
             input_data.style or "balanced",
-            input_data.skip_refinement or False
+            input_data.skip_refinement or False,
+            use_cache=input_data.cache is not False,
+            priority="debug"
         )
         
         # Log the interaction
-        log_prompt_interaction(
+        await log_prompt_interaction(
             raw_input=input_data.text,
-            refined_prompt=refined_prompt,
-            final_output=final_answer,
+            refined_prompt=result.refined_prompt,
+            final_output=result.final_answer,
             user_ip=client_ip,
-            model_used=model_used
+            model_used=result.model_used,
+            refinement_model=result.refinement_model
         )
         
         # Return detailed response for debugging
         return DebugPromptResponse(
             raw_input=input_data.text,
-            refined_prompt=refined_prompt,
-            final_response=final_answer,
-            model_used=model_used,
-            processing_time_ms=total_time,
-            refinement_time_ms=refinement_time,
-            generation_time_ms=generation_time
+            refined_prompt=result.refined_prompt,
+            final_response=result.final_answer,
+            model_used=result.model_used,
+            refinement_model=result.refinement_model,
+            processing_time_ms=result.total_time_ms,
+            refinement_time_ms=result.refinement_time_ms,
+            generation_time_ms=result.generation_time_ms,
+            cache_hit=result.cache_hit,
+            semantic_similarity=result.semantic_similarity,
+            refinement_cached=result.refinement_cached,
+            refinement_saved_ms=result.refinement_saved_ms if result.refinement_cached or result.refinement_bypassed else None,
+            coalesced=result.coalesced,
+            refinement_bypassed=result.refinement_bypassed,
+            speculative_winner=result.speculative_winner,
+            speculative_saved_ms=result.speculative_saved_ms if result.speculative_winner else None
         )
         
+    except (SchedulerBusy, CircuitOpen):
+        metrics.errors.inc(endpoint="/prompt/debug")
+        raise
     except Exception as e:
+        metrics.errors.inc(endpoint="/prompt/debug")
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
 
+def to_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """Normalize a query datetime to naive UTC, matching stored timestamps"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
 @app.get("/analytics/stats")
-async def get_analytics_stats(token: str = Depends(verify_token)):
-    """Get basic analytics stats"""
-    db = get_db()
-    
+async def get_analytics_stats(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    token: str = Depends(verify_token)
+):
+    """
+    Get analytics stats from the pre-aggregated prompt_stats rollups
+    Optional start/end select a custom window (defaults to the last 24 hours).
+    """
     # Basic stats that work without database
-    basic_stats = {
+    stats = {
         "total_requests": 0,
         "requests_24h": 0,
         "unique_users": 0,
         "model_usage": [{"model": settings.default_model, "count": 0}],
         "mock_mode": settings.mock_mode,
         "uptime_seconds": time.time() - startup_time,
-        "database_available": db is not None
+        "database_available": False,
+        "database": database_stats(),
+        "log_retention": log_retention.stats(),
+        "cache": response_cache.stats(),
+        "refinement_cache": refinement_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "refinement_bypass": prompt_classifier.stats(),
+        "coalescing": prompt_flights.stats(),
+        "log_writer": log_writer.stats(),
+        "upstream_scheduler": upstream_scheduler.stats(),
+        "upstream": resilience.stats(),
+        "model_router": model_router.stats()
     }
     
-    if db is None:
-        # Return basic stats when database is not available
-        return basic_stats
-    
     try:
-        # Total requests
-        total_requests = db.query(PromptLog).count()
-        
-        # Requests in last 24 hours
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        recent_requests = db.query(PromptLog).filter(PromptLog.timestamp >= yesterday).count()
+        async with database_session() as db:
+            if db is None:
+                # Return basic stats when database is not available
+                return stats
+            stats["database_available"] = True
+            
+            now = datetime.utcnow()
+            totals = await db.run_sync(query_prompt_totals)
+            last_24h = await db.run_sync(query_prompt_stats, now - timedelta(days=1), now)
+            
+            window_end = to_utc_naive(end) or now
+            window_start = to_utc_naive(start) or window_end - timedelta(days=1)
+            window = last_24h
+            if start is not None or end is not None:
+                window = await db.run_sync(query_prompt_stats, window_start, window_end)
         
-        # Most common models
-        model_stats = db.query(
-            PromptLog.model_used, 
-            func.count(PromptLog.model_used).label('count')
-        ).group_by(PromptLog.model_used).all()
-        
-        # Unique IPs
-        unique_ips = db.query(PromptLog.user_ip).distinct().count()
-        
-        return {
-            "total_requests": total_requests,
-            "requests_24h": recent_requests,
-            "unique_users": unique_ips,
-            "model_usage": [{"model": stat[0], "count": stat[1]} for stat in model_stats] if model_stats else [{"model": settings.default_model, "count": total_requests}],
-            "mock_mode": settings.mock_mode,
-            "uptime_seconds": time.time() - startup_time,
-            "database_available": True
-        }
+        stats.update({
+            "total_requests": totals["requests"],
+            "requests_24h": last_24h["requests"],
+            "unique_users": totals["unique_users"],
+            "model_usage": totals["model_usage"] or [{"model": settings.default_model, "count": 0}],
+            "window": window
+        })
+        return stats
     except Exception as e:
         # Return basic stats if database query fails
-        basic_stats["error"] = f"Database query failed: {str(e)}"
-        return basic_stats
-    finally:
-        if db:
-            db.close()
+        stats["error"] = f"Database query failed: {str(e)}"
+        return stats
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/summary")
+async def get_metrics_summary(token: str = Depends(verify_token)):
+    """In-process p50/p95/p99 latencies and counters for the dashboard"""
+    return metrics.summary()
 
 
 @app.get("/")
@@ -201,8 +749,12 @@ async def root():
         "endpoints": {
             "health": "/health",
             "prompt": "/prompt", 
+            "stream": "/prompt/stream",
+            "batch": "/prompt/batch",
+            "jobs": "/jobs",
             "debug": "/prompt/debug",
-            "analytics": "/analytics/stats"
+            "analytics": "/analytics/stats",
+            "metrics": "/metrics"
         },
         "authentication": "Bearer token required",
         "model": settings.model_name,
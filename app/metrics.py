@@ -0,0 +1,230 @@
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Recording happens on the event loop thread, so plain dict/list updates are
+# enough; no locks on the hot path.
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS_SECONDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+HANDSHAKE_BUCKETS_SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Style is free text on the request, so unknown values share one label to bound cardinality
+KNOWN_STYLES = {"concise", "detailed", "casual", "professional", "educational", "balanced"}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Point-in-time value with optional labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram with optional labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS_SECONDS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # Per label set: [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class LatencyWindow:
+    """Rolling window of recent latencies for in-process percentiles"""
+
+    def __init__(self, size: int = 1000):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, value_ms: float):
+        self._samples.append(value_ms)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> Dict[str, Any]:
+        if not self._samples:
+            return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+        ordered = sorted(self._samples)
+        n = len(ordered)
+        return {
+            "count": n,
+            "p50_ms": ordered[min(n - 1, int(0.50 * n))],
+            "p95_ms": ordered[min(n - 1, int(0.95 * n))],
+            "p99_ms": ordered[min(n - 1, int(0.99 * n))],
+        }
+
+
+class Metrics:
+    """Process-wide metrics exposed at /metrics and /metrics/summary"""
+
+    def __init__(self):
+        self.stage_latency = Histogram(
+            "answer_architect_stage_duration_seconds",
+            "Latency of each pipeline stage (refinement, generation, total)",
+            ("stage", "model", "style"),
+        )
+        self.requests = Counter("answer_architect_requests_total", "Prompt requests handled", ("endpoint",))
+        self.errors = Counter("answer_architect_errors_total", "Prompt requests that failed", ("endpoint",))
+        self.rate_limited = Counter("answer_architect_rate_limited_total", "Requests rejected by the rate limiter", ("endpoint",))
+        self.cache_hits = Counter("answer_architect_cache_hits_total", "Cache hits by cache", ("cache",))
+        self.coalesced = Counter("answer_architect_coalesced_total", "Requests served by an identical in-flight call")
+        self.upstream_errors = Counter("answer_architect_upstream_errors_total", "Failed upstream attempts by error kind", ("kind", "model"))
+        self.upstream_retries = Counter("answer_architect_upstream_retries_total", "Upstream attempts retried", ("model",))
+        self.upstream_hedges = Counter("answer_architect_upstream_hedges_total", "Hedged second attempts started", ("model",))
+        self.refinement_bypassed = Counter("answer_architect_refinement_bypassed_total", "Refinements skipped by the local prompt classifier")
+        self.speculative_wins = Counter("answer_architect_speculative_wins_total", "Speculative races by winning path", ("path",))
+        self.upstream_fallbacks = Counter("answer_architect_upstream_fallbacks_total", "Calls diverted by an open circuit breaker", ("model",))
+        self.upstream_connections = Gauge(
+            "answer_architect_upstream_connections", "Pooled upstream connections by state (active, idle)", ("upstream", "state")
+        )
+        self.upstream_in_flight = Gauge("answer_architect_upstream_in_flight", "Upstream requests waiting on or holding a connection", ("upstream",))
+        self.upstream_connects = Counter("answer_architect_upstream_connects_total", "New upstream connections opened", ("upstream",))
+        self.upstream_handshake = Histogram(
+            "answer_architect_upstream_handshake_seconds",
+            "Time to open an upstream connection by phase (tcp, tls)",
+            ("upstream", "phase"),
+            buckets=HANDSHAKE_BUCKETS_SECONDS,
+        )
+        self.model_calls = Counter("answer_architect_model_calls_total", "Upstream calls by stage and the model route that served them", ("stage", "model"))
+        self.db_up = Gauge("answer_architect_db_up", "1 while the database is reachable, 0 while it is backing off")
+        self.db_pool_connections = Gauge(
+            "answer_architect_db_pool_connections", "Pooled database connections by state (in_use, idle, overflow)", ("state",)
+        )
+        self.db_pool_saturation = Gauge("answer_architect_db_pool_saturation", "Share of POOL_SIZE + MAX_OVERFLOW connections checked out")
+        self.db_pool_timeouts = Counter("answer_architect_db_pool_timeouts_total", "Database calls that gave up waiting for a pooled connection")
+        self.log_blobs = Counter("answer_architect_log_blobs_total", "Distinct texts per logged batch by whether they were already stored", ("result",))
+        self.log_search_documents = Counter("answer_architect_log_search_documents_total", "Distinct texts added to the full-text log search index")
+        self.db_skipped = Counter("answer_architect_db_skipped_total", "Database calls skipped while the database was backing off")
+        self._windows: Dict[str, LatencyWindow] = {}
+
+    def observe_stage(self, stage: str, elapsed_ms: float, model: str, style: str):
+        """Record one stage latency in the histogram and the rolling percentile window"""
+        style = style if style in KNOWN_STYLES else "other"
+        self.stage_latency.observe(elapsed_ms / 1000.0, stage=stage, model=model, style=style)
+        window = self._windows.get(stage)
+        if window is None:
+            window = self._windows[stage] = LatencyWindow()
+        window.add(elapsed_ms)
+
+    def stage_quantile(self, stage: str, q: float) -> Optional[float]:
+        window = self._windows.get(stage)
+        return window.quantile(q) if window is not None else None
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines: List[str] = []
+        for metric in (
+            self.stage_latency, self.requests, self.errors, self.rate_limited, self.cache_hits, self.coalesced,
+            self.upstream_errors, self.upstream_retries, self.upstream_hedges, self.upstream_fallbacks,
+            self.speculative_wins, self.refinement_bypassed, self.model_calls,
+            self.upstream_connections, self.upstream_in_flight, self.upstream_connects, self.upstream_handshake,
+            self.db_up, self.db_pool_connections, self.db_pool_saturation, self.db_pool_timeouts, self.db_skipped, self.log_blobs,
+            self.log_search_documents
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Any]:
+        """Percentiles and counters for the dashboard"""
+        return {
+            "latency": {stage: window.summary() for stage, window in self._windows.items()},
+            "requests": self.requests.total(),
+            "errors": self.errors.total(),
+            "rate_limited": self.rate_limited.total(),
+            "cache_hits": self.cache_hits.total(),
+            "coalesced": self.coalesced.total(),
+            "upstream_errors": self.upstream_errors.total(),
+            "upstream_retries": self.upstream_retries.total(),
+            "upstream_hedges": self.upstream_hedges.total(),
+            "upstream_fallbacks": self.upstream_fallbacks.total(),
+            "upstream_connects": self.upstream_connects.total(),
+            "db_pool_timeouts": self.db_pool_timeouts.total(),
+        }
+
+
+# Global instance
+metrics = Metrics()
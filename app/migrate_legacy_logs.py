@@ -0,0 +1,37 @@
+"""
+Move a pre-dedup prompt_logs table into prompt_log_entries, keeping its ids
+
+Run once while the app is stopped: python -m app.migrate_legacy_logs
+The old table is kept as prompt_logs_legacy; drop it once the prompt_logs view checks out.
+On PostgreSQL, migrations/001_prompt_blobs.sql does the same in one SQL pass and is much faster.
+"""
+import sys
+from sqlalchemy import create_engine
+from app.config import settings
+from app.database import (
+    add_missing_columns, create_tables, enable_foreign_keys, has_legacy_prompt_logs, migrate_legacy_prompt_logs
+)
+
+
+def main() -> int:
+    if not settings.database_url:
+        print("DATABASE_URL is not set")
+        return 1
+    engine = create_engine(settings.database_url)
+    enable_foreign_keys(engine)
+    try:
+        with engine.begin() as connection:
+            if not has_legacy_prompt_logs(connection):
+                print("No pre-dedup prompt_logs table found; nothing to do")
+                return 0
+            create_tables(connection)
+            add_missing_columns(connection)
+            copied = migrate_legacy_prompt_logs(connection)
+    finally:
+        engine.dispose()
+    print(f"Moved {copied} prompt_logs rows into prompt_log_entries; the old table is now prompt_logs_legacy")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,13 @@
-from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from pydantic import BaseModel, Field, ConfigDict, HttpUrl
+from datetime import datetime
+from typing import Dict, List, Optional
 
 
 class UserPrompt(BaseModel):
     text: str = Field(..., min_length=1, max_length=5000, description="The user's raw input prompt")
     style: Optional[str] = Field(default="balanced", description="Response style preference")
     skip_refinement: Optional[bool] = Field(default=False, description="Skip prompt refinement and use prompt directly")
+    cache: Optional[bool] = Field(default=True, description="Serve a cached answer when available; set false to force a fresh answer")
 
 
 class PromptResponse(BaseModel):
@@ -22,9 +24,85 @@ class DebugPromptResponse(BaseModel):
     refined_prompt: str
     final_response: str
     model_used: str
+    refinement_model: Optional[str] = Field(default=None, description="Model that refined the prompt, when one ran")
     processing_time_ms: Optional[float] = None
     refinement_time_ms: Optional[float] = None
     generation_time_ms: Optional[float] = None
+    cache_hit: bool = False
+    refinement_cached: bool = False
+    refinement_saved_ms: Optional[float] = None
+    coalesced: bool = False
+    semantic_similarity: Optional[float] = Field(default=None, description="Similarity of the cached input when served from the semantic cache")
+    refinement_bypassed: bool = Field(default=False, description="Refinement skipped because the input was already well specified")
+    speculative_winner: Optional[str] = Field(default=None, description="direct or refined when speculative mode raced both paths")
+    speculative_saved_ms: Optional[float] = None
+
+
+class BatchPromptRequest(BaseModel):
+    items: List[UserPrompt] = Field(..., min_length=1, max_length=1000, description="Prompts to process")
+    max_concurrency: Optional[int] = Field(default=None, ge=1, description="Upstream concurrency for this batch (capped by the server limit)")
+    stream: Optional[bool] = Field(default=False, description="Stream results as NDJSON in completion order")
+
+
+class BatchItemResult(BaseModel):
+    index: int = Field(..., description="Position of the item in the request")
+    result: Optional[PromptResponse] = None
+    error: Optional[str] = None
+
+
+class BatchPromptResponse(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+    processing_time_ms: Optional[float] = None
+
+
+class JobRequest(UserPrompt):
+    callback_url: Optional[HttpUrl] = Field(
+        default=None, description="http(s) URL on a public host (or JOB_CALLBACK_ALLOWED_HOSTS) to POST the finished job to"
+    )
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., description="queued, running, succeeded or failed")
+    result: Optional[PromptResponse] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class LogEntry(BaseModel):
+    """One logged interaction"""
+    model_config = ConfigDict(protected_namespaces=())
+    
+    id: int
+    timestamp: datetime
+    raw_input: str
+    refined_prompt: str
+    final_output: str
+    user_ip: Optional[str] = None
+    model_used: Optional[str] = None
+    refinement_model: Optional[str] = None
+
+
+class LogPage(BaseModel):
+    items: List[LogEntry]
+    next_cursor: Optional[str] = Field(default=None, description="Pass as cursor for the next page; null on the last page")
+
+
+class LogSearchHit(LogEntry):
+    score: float = Field(description="Relevance, higher is better (only comparable within one search)")
+    highlights: Dict[str, str] = Field(
+        default_factory=dict, description="Extracts of the matching raw_input and final_output with matches in <mark> tags"
+    )
+
+
+class LogSearchPage(BaseModel):
+    items: List[LogSearchHit]
+    next_offset: Optional[int] = Field(default=None, description="Pass as offset for the next page; null on the last page")
 
 
 class HealthResponse(BaseModel):
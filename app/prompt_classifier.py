@@ -0,0 +1,306 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import math
+import random
+import re
+import zlib
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+
+# Labelled seed inputs for the lexical model: 1 = already well specified, 0 = needs rewriting
+TRAINING_EXAMPLES: List[Tuple[str, int]] = [
+    ("Write a Python function that takes a list of integers and returns the second largest value, handling duplicates and lists with fewer than two elements.", 1),
+    ("Explain the difference between TCP and UDP, including connection setup, reliability guarantees, and typical use cases such as video streaming and DNS.", 1),
+    ("Compare PostgreSQL and MongoDB for a write-heavy analytics workload with 10k inserts per second; cover indexing, consistency and operational cost.", 1),
+    ("Summarize the causes of the 2008 financial crisis in five bullet points for a high school economics class.", 1),
+    ("How do I configure nginx as a reverse proxy for a FastAPI app running on port 8000 with gzip and a 60 second read timeout?", 1),
+    ("List the steps to rotate an AWS IAM access key without downtime for a service that reads credentials from environment variables.", 1),
+    ("Describe how a B-tree index speeds up range queries, with a small example of a lookup on a table of 1 million rows.", 1),
+    ("Give me three dinner recipes under 30 minutes that are vegetarian, high in protein, and use no more than eight ingredients each.", 1),
+    ("Translate the following sentence into formal Spanish and explain any grammar choices: 'We will send the invoice next week.'", 1),
+    ("What are the trade-offs between optimistic and pessimistic locking in a relational database, and when should each be used?", 1),
+    ("Write a SQL query that returns the top 5 customers by total order value in 2023 from tables customers(id, name) and orders(customer_id, amount, created_at).", 1),
+    ("Create a 4-week beginner running plan that builds up to a continuous 5 km run, with three sessions per week and rest days.", 1),
+    ("Explain gradient descent to a first-year computer science student, using a simple example with one variable and a learning rate of 0.1.", 1),
+    ("Design a REST API for a todo app with endpoints for creating, listing, updating and deleting tasks; include request and response JSON examples.", 1),
+    ("Why does my React useEffect hook run twice in development mode with StrictMode enabled, and how can I avoid duplicate API calls?", 1),
+    ("Outline a 10-minute presentation on renewable energy storage for a non-technical audience, with one slide per main point.", 1),
+    ("Debug this Python error: TypeError: 'NoneType' object is not subscriptable when calling data['items'] after requests.get(url).json().", 1),
+    ("Provide a bash one-liner that finds all .log files larger than 100MB under /var/log and deletes the ones older than 7 days.", 1),
+    ("Compare the time complexity of quicksort, mergesort and heapsort in the best, average and worst cases, and note which are stable.", 1),
+    ("Draft a polite email to a client explaining that the project delivery will slip by two weeks due to a vendor delay, offering a revised timeline.", 1),
+    ("What is the capital of Australia and why was it chosen over Sydney and Melbourne?", 1),
+    ("Describe the lifecycle of a Kubernetes pod from scheduling to termination, including the role of readiness and liveness probes.", 1),
+    ("Who wrote Pride and Prejudice, and in what year was it first published?", 1),
+    ("What is the boiling point of water at sea level in degrees Celsius and Fahrenheit?", 1),
+    ("Convert this JavaScript snippet to TypeScript with strict types:\nfunction add(a, b) { return a + b; }", 1),
+    ("Suggest five names for a coffee shop in Lisbon that targets remote workers, each with a one-sentence rationale.", 1),
+    ("help me", 0),
+    ("python", 0),
+    ("tell me about ai", 0),
+    ("stuff about databases", 0),
+    ("explain ml", 0),
+    ("something for dinner", 0),
+    ("fix my code", 0),
+    ("write something", 0),
+    ("how does it work", 0),
+    ("idk what to do with my career", 0),
+    ("ideas", 0),
+    ("machine learning", 0),
+    ("help with essay", 0),
+    ("what is api", 0),
+    ("email", 0),
+    ("make it better", 0),
+    ("i need help with sql stuff", 0),
+    ("thoughts on crypto", 0),
+    ("quick question", 0),
+    ("any tips", 0),
+    ("code", 0),
+    ("explain", 0),
+    ("what should i learn", 0),
+    ("how to get rich", 0),
+    ("rust vs go", 0),
+    ("need a plan", 0),
+    ("summarize this", 0),
+    ("history", 0),
+    ("can you help me with my homework", 0),
+    ("write a function", 0),
+    ("help me write a python function", 0),
+    ("tell me some things about space and stuff", 0),
+    ("explain the history of computers", 0),
+    ("tell me about the internet", 0),
+    ("write an essay about climate change", 0),
+    ("what is the meaning of life", 0),
+    ("give me a workout", 0),
+    # Short open questions: a question mark alone does not make an input specific
+    ("who won?", 0),
+    ("what is the best language?", 0),
+    ("how do I lose weight?", 0),
+    ("can you help?", 0),
+    ("what time is it?", 0),
+    ("where should I go?", 0),
+    ("is python good?", 0),
+    ("how does it compare?", 0),
+    ("what is the answer?", 0),
+    ("which one should I pick?", 0),
+    ("how can I improve?", 0),
+    ("what are your thoughts on this?", 0),
+    ("who is the best?", 0),
+    ("how do computers work?", 0),
+    ("what should I eat?", 0),
+]
+
+# Never trained on, but used while choosing the training examples and the threshold (and some were added
+# after they failed), so scores on it are optimistic
+VALIDATION_EXAMPLES: List[Tuple[str, int]] = [
+    ("Write a Go function that parses an RFC 3339 timestamp string and returns the Unix epoch in milliseconds, with error handling.", 1),
+    ("Explain how HTTPS certificate validation works, from the server sending its chain to the browser checking revocation.", 1),
+    ("What is the difference between a process and a thread in Linux, in terms of memory sharing and scheduling?", 1),
+    ("List five common causes of memory leaks in long-running Node.js services and how to detect each with heap snapshots.", 1),
+    ("Summarize the plot of Hamlet in under 150 words for a reader who has not seen the play.", 1),
+    ("How many bones are in the adult human body, and which is the longest?", 1),
+    ("Write a haiku about autumn rain in Kyoto that mentions a temple bell.", 1),
+    ("Compare Redis and Memcached as a session store for a Django app with 50k daily users, including persistence and eviction.", 1),
+    ("Give a step by step guide to setting up SSH key authentication on Ubuntu 22.04 and disabling password logins.", 1),
+    ("Describe the water cycle for a 10-year-old in four short paragraphs, one per stage.", 1),
+    ("What year did the Berlin Wall fall, and what events led directly to its opening?", 1),
+    ("Create a weekly meal plan for a family of four on a $100 budget, with a shopping list grouped by store section.", 1),
+    ("Refactor this Python loop into a list comprehension and explain the change: result = []\nfor x in items:\n    if x > 0:\n        result.append(x * 2)", 1),
+    ("Draft a 200-word cover letter for a junior data analyst role that highlights SQL and Tableau experience.", 1),
+    ("Who is the president?", 0),
+    ("Explain quantum entanglement", 0),
+    ("what is love?", 0),
+    ("why?", 0),
+    ("how do I get better?", 0),
+    ("can you write code?", 0),
+    ("is it good?", 0),
+    ("what about the other one?", 0),
+    ("which is best?", 0),
+    ("tell me a story", 0),
+    ("explain blockchain", 0),
+    ("write a poem", 0),
+    ("any ideas for my project?", 0),
+    ("how does the stock market work?", 0),
+    ("what's the weather like?", 0),
+    ("summarize the article", 0),
+    ("give me advice", 0),
+    ("should I learn java?", 0),
+    ("what do you think?", 0),
+    ("describe france", 0),
+]
+
+# Never trained on or tuned against: the honest estimate of how often a bypass at the threshold skips
+# an input that needed refining. Do not change features, training data or the threshold to fit it.
+HELD_OUT_EXAMPLES: List[Tuple[str, int]] = [
+    ("Write a Java method that checks whether a string is a valid IPv4 address without using regular expressions.", 1),
+    ("Explain the CAP theorem with one concrete example each of a CP and an AP database.", 1),
+    ("What are the main differences between Python lists and tuples in mutability, memory use and typical usage?", 1),
+    ("Give me a 3-day itinerary for Rome for a couple who like food and ancient history, on a mid-range budget.", 1),
+    ("Summarize the key points of the GDPR right to erasure for a small e-commerce company in six bullet points.", 1),
+    ("How do I undo the last git commit but keep the changes staged?", 1),
+    ("Write a limerick about a cat who learns to code in JavaScript.", 1),
+    ("Describe the difference between mitosis and meiosis for a high school biology test, including the number of daughter cells.", 1),
+    ("What causes the seasons on Earth, and why is it summer in Australia when it is winter in Canada?", 1),
+    ("Create a Dockerfile for a Flask app that installs requirements.txt, runs as a non-root user and exposes port 5000.", 1),
+    ("List the pros and cons of leasing versus buying a car for someone who drives 20,000 km a year.", 1),
+    ("Translate 'Where is the nearest train station?' into German, French and Italian.", 1),
+    ("Explain what a p-value of 0.03 means in an A/B test of two checkout page designs.", 1),
+    ("Write a regular expression that matches UK postcodes and explain each part of it.", 1),
+    ("Compare Kafka and RabbitMQ for an order-processing system that must not lose messages, covering delivery guarantees and ordering.", 1),
+    ("Who painted the ceiling of the Sistine Chapel, and how long did the work take?", 1),
+    ("Suggest a name and tagline for a mobile app that helps students split rent and utility bills with roommates.", 1),
+    ("How should I store passwords in a PostgreSQL users table, and which hashing algorithm and parameters should I use?", 1),
+    ("Outline a one-hour workshop that teaches Excel pivot tables to finance interns, with timings for each section.", 1),
+    ("Write a unit test in pytest for a function slugify(title) that lowercases text and replaces spaces with hyphens.", 1),
+    ("what's good?", 0),
+    ("teach me guitar", 0),
+    ("how do I start?", 0),
+    ("explain recursion", 0),
+    ("write me a song", 0),
+    ("help with my resume", 0),
+    ("is this right?", 0),
+    ("best laptop?", 0),
+    ("what happened?", 0),
+    ("make a website", 0),
+    ("tell me about dogs", 0),
+    ("how to invest", 0),
+    ("what do I do now?", 0),
+    ("explain the economy", 0),
+    ("give me some ideas", 0),
+    ("can you check this?", 0),
+    ("why is it slow?", 0),
+    ("write a story about a dragon", 0),
+    ("what is the best way?", 0),
+    ("how does AI work?", 0),
+]
+
+QUESTION_WORDS = {"what", "how", "why", "when", "which", "who", "where", "can", "could", "should", "is", "are", "does", "do"}
+IMPERATIVE_VERBS = {
+    "explain", "write", "list", "compare", "describe", "summarize", "create", "generate", "give",
+    "provide", "implement", "design", "analyze", "translate", "convert", "draft", "outline", "debug", "suggest"
+}
+STOPWORDS = {"a", "an", "the", "of", "to", "in", "on", "for", "and", "or", "me", "my", "i", "it", "is", "with", "about"}
+VAGUE_WORDS = {"something", "stuff", "things", "idk", "anything", "whatever", "etc", "some", "help", "tips", "ideas"}
+CONSTRAINT_PATTERN = re.compile(
+    r"\b(\d+|step by step|with examples?|for a|using|include|including|format|bullet|under|at least|no more than|between)\b"
+)
+TECHNICAL_PATTERN = re.compile(r"`|\w+\(\)?|\.\w{1,4}\b|\b\w+_\w+\b|\b[a-z]+[A-Z]\w*\b|[{}\[\]=<>]")
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+HASH_BUCKETS = 512
+
+
+class PromptClassifier:
+    """
+    Local estimate of whether an input is specific enough to skip the refinement call
+
+    Combines a few structural features with hashed unigram/bigram weights, scored by a
+    logistic regression trained on TRAINING_EXAMPLES at startup (or on first use if bypass is enabled later).
+    """
+
+    def __init__(self, examples: Sequence[Tuple[str, int]] = TRAINING_EXAMPLES):
+        self._examples = examples
+        self._weights: Optional[Dict[int, float]] = None
+        self._bias = 0.0
+        self.checked = 0
+        self.bypassed = 0
+        self.saved_ms = 0.0
+
+    def features(self, text: str) -> Dict[int, float]:
+        """Sparse feature vector: dense heuristics in the first slots, hashed n-grams after them"""
+        lowered = text.strip().lower()
+        tokens = TOKEN_PATTERN.findall(lowered)
+        first = tokens[0] if tokens else ""
+        dense = [
+            min(1.0, math.log1p(len(tokens)) / math.log(60)),
+            1.0 if "?" in text else 0.0,
+            1.0 if first in QUESTION_WORDS else 0.0,
+            1.0 if first in IMPERATIVE_VERBS else 0.0,
+            1.0 if "\n" in text or re.search(r"^\s*([-*•]|\d+[.)])\s", text, re.MULTILINE) else 0.0,
+            min(1.0, len(CONSTRAINT_PATTERN.findall(lowered)) / 3),
+            min(1.0, len(TECHNICAL_PATTERN.findall(text)) / 3),
+            min(1.0, sum(token in VAGUE_WORDS for token in tokens) / 2),
+            1.0 if len(tokens) < 4 else 0.0,
+            min(1.0, (len(re.findall(r"[.!?;:,]", text)) + 1) / 4),
+        ]
+        vector = {index: value for index, value in enumerate(dense) if value}
+        content = [token for token in tokens if token not in STOPWORDS]
+        grams = content + [f"{a} {b}" for a, b in zip(content, content[1:])]
+        for gram in grams:
+            index = len(dense) + zlib.crc32(gram.encode("utf-8")) % HASH_BUCKETS
+            vector[index] = vector.get(index, 0.0) + 1.0 / math.sqrt(len(grams))
+        return vector
+
+    def train(self, examples: Sequence[Tuple[str, int]], epochs: int = 200, learning_rate: float = 0.5, l2: float = 1e-3):
+        """Fit the logistic regression with plain SGD (deterministic order)"""
+        data = [(self.features(text), label) for text, label in examples]
+        order = list(range(len(data)))
+        rng = random.Random(0)
+        weights: Dict[int, float] = {}
+        bias = 0.0
+        for _ in range(epochs):
+            rng.shuffle(order)
+            for i in order:
+                vector, label = data[i]
+                error = self._sigmoid(bias + sum(weights.get(k, 0.0) * v for k, v in vector.items())) - label
+                bias -= learning_rate * error
+                for k, v in vector.items():
+                    weights[k] = weights.get(k, 0.0) * (1 - learning_rate * l2) - learning_rate * error * v
+        self._weights, self._bias = weights, bias
+
+    @staticmethod
+    def _sigmoid(z: float) -> float:
+        return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+
+    async def warm_up(self):
+        """Train in a worker thread at startup, so the first request does not stall the event loop on it"""
+        if settings.refinement_bypass_enabled and self._weights is None:
+            await run_in_threadpool(self.train, self._examples)
+
+    def score(self, text: str) -> float:
+        """Probability that the input is already well specified"""
+        if self._weights is None:
+            self.train(self._examples)
+        vector = self.features(text)
+        return self._sigmoid(self._bias + sum(self._weights.get(k, 0.0) * v for k, v in vector.items()))
+
+    def evaluate(self, examples: Sequence[Tuple[str, int]] = HELD_OUT_EXAMPLES, threshold: Optional[float] = None) -> Dict[str, float]:
+        """Precision and recall of bypassing at threshold (REFINEMENT_BYPASS_THRESHOLD by default) on labelled inputs"""
+        threshold = settings.refinement_bypass_threshold if threshold is None else threshold
+        bypassed = [label for text, label in examples if self.score(text) >= threshold]
+        positives = sum(label for _, label in examples)
+        return {
+            "threshold": threshold,
+            "precision": sum(bypassed) / len(bypassed) if bypassed else 1.0,
+            "recall": sum(bypassed) / positives if positives else 0.0,
+        }
+
+    def would_bypass(self, text: str) -> bool:
+        """Whether refinement can be skipped for this input under the configured threshold"""
+        return settings.refinement_bypass_enabled and self.score(text) >= settings.refinement_bypass_threshold
+
+    def should_bypass(self, text: str) -> bool:
+        """would_bypass, counted in the bypass stats"""
+        if not settings.refinement_bypass_enabled:
+            return False
+        self.checked += 1
+        bypass = self.would_bypass(text)
+        if bypass:
+            self.bypassed += 1
+        return bypass
+
+    def record_saved(self, saved_ms: float):
+        self.saved_ms += saved_ms
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "enabled": settings.refinement_bypass_enabled,
+            "threshold": settings.refinement_bypass_threshold,
+            "checked": self.checked,
+            "bypassed": self.bypassed,
+            "bypass_rate": self.bypassed / self.checked if self.checked else 0.0,
+            "time_saved_ms": self.saved_ms,
+        }
+
+
+# Global instance
+prompt_classifier = PromptClassifier()
@@ -0,0 +1,172 @@
+from typing import Any, Dict, Tuple
+import threading
+import time
+from limits.storage import Storage, storage_from_string
+from sqlalchemy import create_engine, case, Column, Float, Integer, String
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.declarative import declarative_base
+
+# Importing this module registers the storage schemes with `limits`, so they can
+# be selected through RATE_LIMIT_STORAGE_URI like the built-in memory:// and redis://
+
+CounterBase = declarative_base()
+
+
+class RateLimitCounter(CounterBase):
+    """Fixed-window hit counter shared by every worker"""
+    __tablename__ = "rate_limit_counters"
+
+    key = Column(String(255), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    expires_at = Column(Float, nullable=False)  # Unix time the window ends
+
+
+class SQLStorage(Storage):
+    """Rate limit counters in a SQL table, e.g. sql+sqlite:///limits.db or sql+postgresql://..."""
+
+    STORAGE_SCHEME = ["sql+sqlite", "sql+postgresql", "sql+postgresql+psycopg2"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options: Any):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions)
+        self.engine = create_engine(uri[len("sql+"):], **options)
+        CounterBase.metadata.create_all(bind=self.engine)
+        self._insert = postgresql_insert if self.engine.dialect.name == "postgresql" else sqlite_insert
+
+    @property
+    def base_exceptions(self):
+        return SQLAlchemyError
+
+    def incr_with_expiry(self, key: str, expiry: float, amount: int = 1) -> Tuple[int, float]:
+        """Add to a counter, starting a new window if it expired, in one atomic statement"""
+        now = time.time()
+        table = RateLimitCounter.__table__
+        expired = table.c.expires_at <= now
+        statement = self._insert(table).values(
+            key=key, count=amount, expires_at=now + expiry
+        ).on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={
+                "count": case((expired, amount), else_=table.c.count + amount),
+                "expires_at": case((expired, now + expiry), else_=table.c.expires_at),
+            }
+        ).returning(table.c.count, table.c.expires_at)
+        with self.engine.begin() as connection:
+            count, expires_at = connection.execute(statement).one()
+        return count, expires_at
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        return self.incr_with_expiry(key, expiry, amount)[0]
+
+    def _row(self, key: str):
+        table = RateLimitCounter.__table__
+        with self.engine.connect() as connection:
+            return connection.execute(
+                table.select().where(table.c.key == key, table.c.expires_at > time.time())
+            ).one_or_none()
+
+    def get(self, key: str) -> int:
+        row = self._row(key)
+        return row.count if row is not None else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self._row(key)
+        return row.expires_at if row is not None else time.time()
+
+    def check(self) -> bool:
+        try:
+            with self.engine.connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+            return True
+        except SQLAlchemyError:
+            return False
+
+    def reset(self) -> int:
+        with self.engine.begin() as connection:
+            return connection.execute(RateLimitCounter.__table__.delete()).rowcount
+
+    def clear(self, key: str) -> None:
+        table = RateLimitCounter.__table__
+        with self.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.key == key))
+
+
+class LocalSyncStorage(Storage):
+    """
+    Local fast path in front of a shared storage, e.g. local+redis://host:6379
+
+    Hits are counted in process and pushed to the shared counter every
+    sync_interval seconds or sync_batch hits, so most checks never leave the
+    process. Each worker can admit up to sync_batch - 1 unsynced hits per key
+    beyond the shared limit.
+    """
+
+    STORAGE_SCHEME = [
+        "local+memory", "local+redis", "local+rediss",
+        "local+sql+sqlite", "local+sql+postgresql", "local+sql+postgresql+psycopg2"
+    ]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, sync_interval: float = 1.0, sync_batch: int = 5, **options: Any):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions)
+        self.shared = storage_from_string(uri[len("local+"):], **options)
+        self.sync_interval = float(sync_interval)
+        self.sync_batch = int(sync_batch)
+        self._lock = threading.Lock()
+        # key -> [shared count, unsynced local hits, window expiry, last sync time]
+        self._windows: Dict[str, list] = {}
+
+    @property
+    def base_exceptions(self):
+        return self.shared.base_exceptions
+
+    def _sync(self, key: str, expiry: float, amount: int) -> Tuple[int, float]:
+        if isinstance(self.shared, SQLStorage):
+            return self.shared.incr_with_expiry(key, expiry, amount)
+        count = self.shared.incr(key, expiry, amount)
+        return count, (time.time() + expiry if count == amount else self.shared.get_expiry(key))
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        now = time.time()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or window[2] <= now:
+                # New window: always consult the shared counter first
+                count, expires_at = self._sync(key, expiry, amount)
+                if len(self._windows) >= 10000:
+                    self._windows = {k: w for k, w in self._windows.items() if w[2] > now}
+                self._windows[key] = [count, 0, expires_at, now]
+                return count
+            window[1] += amount
+            if window[1] >= self.sync_batch or now - window[3] >= self.sync_interval:
+                window[0], window[2] = self._sync(key, expiry, window[1])
+                window[1] = 0
+                window[3] = now
+            return window[0] + window[1]
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and window[2] > time.time():
+                return window[0] + window[1]
+        return self.shared.get(key)
+
+    def get_expiry(self, key: str) -> float:
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and window[2] > time.time():
+                return window[2]
+        return self.shared.get_expiry(key)
+
+    def check(self) -> bool:
+        return self.shared.check()
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+        return self.shared.reset()
+
+    def clear(self, key: str) -> None:
+        with self._lock:
+            self._windows.pop(key, None)
+        self.shared.clear(key)
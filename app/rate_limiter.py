@@ -3,6 +3,7 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from fastapi import Request
 from app.config import settings
+import app.rate_limit_storage  # noqa: F401 - registers the sql+ and local+ storage schemes
 
 
 def get_client_ip(request: Request):
@@ -13,8 +14,26 @@ def get_client_ip(request: Request):
     return get_remote_address(request)
 
 
-# Create limiter instance
-limiter = Limiter(key_func=get_client_ip)
+# Create limiter instance; a shared storage makes the limit global across workers
+storage_uri = settings.rate_limit_storage_uri
+storage_options = {}
+shared_storage = not storage_uri.startswith("memory://")
+# slowapi calls the storage synchronously on the event loop, so a shared one gets the local fast path:
+# a round trip per key per window and per sync instead of one per request
+if shared_storage and settings.rate_limit_sync_interval_seconds > 0:
+    storage_uri = f"local+{storage_uri}"
+    storage_options = {
+        "sync_interval": settings.rate_limit_sync_interval_seconds,
+        "sync_batch": settings.rate_limit_sync_batch
+    }
+
+limiter = Limiter(
+    key_func=get_client_ip,
+    storage_uri=storage_uri,
+    storage_options=storage_options,
+    # Keep serving with per-process limits if a shared storage goes down
+    in_memory_fallback_enabled=shared_storage
+)
 
 # Rate limit string based on settings
 rate_limit_string = f"{settings.rate_limit_per_minute}/minute" 
\ No newline at end of file
@@ -0,0 +1,271 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+import asyncio
+import random
+import time
+import openai
+from app.config import settings
+from app.metrics import LatencyWindow, metrics
+from app.scheduler import SchedulerBusy
+
+T = TypeVar("T")
+
+# Token for calls admitted while the circuit is closed; a half-open probe gets a token of its own
+ADMITTED = object()
+
+
+class UpstreamError(Exception):
+    """An upstream call failure, classified by whether it is worth retrying"""
+    kind = "error"
+    retryable = False
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(f"GPT API call failed: {message}")
+        self.status_code = status_code
+
+
+class UpstreamTimeout(UpstreamError):
+    kind = "timeout"
+    retryable = True
+
+
+class UpstreamUnavailable(UpstreamError):
+    """Connection failures and 5xx responses"""
+    kind = "unavailable"
+    retryable = True
+
+
+class UpstreamRateLimited(UpstreamError):
+    kind = "rate_limited"
+    retryable = True
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message, 429)
+        self.retry_after = retry_after
+
+
+class UpstreamRejected(UpstreamError):
+    """4xx responses (bad request, auth, unknown model); retrying will not help"""
+    kind = "rejected"
+
+
+class CircuitOpen(UpstreamError):
+    kind = "circuit_open"
+
+    def __init__(self, model: str):
+        super().__init__(f"circuit open for model {model}")
+
+
+def _retry_after_seconds(error: openai.APIStatusError) -> float:
+    """Upstream-suggested wait from a 429 response, defaulting to one second"""
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return 1.0
+
+
+def classify(error: Exception) -> UpstreamError:
+    """Map an OpenAI client exception onto the UpstreamError hierarchy"""
+    if isinstance(error, UpstreamError):
+        return error
+    if isinstance(error, openai.APITimeoutError):
+        return UpstreamTimeout(str(error))
+    if isinstance(error, openai.APIConnectionError):
+        return UpstreamUnavailable(str(error))
+    if isinstance(error, openai.RateLimitError):
+        return UpstreamRateLimited(str(error), _retry_after_seconds(error))
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code >= 500 or error.status_code in (408, 409):
+            return UpstreamUnavailable(str(error), error.status_code)
+        return UpstreamRejected(str(error), error.status_code)
+    return UpstreamError(str(error))
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry number (0-based)"""
+    ceiling = min(settings.upstream_retry_max_delay_seconds, settings.upstream_retry_base_delay_seconds * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; lets one probe through once the cooldown passes"""
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe: Optional[object] = None
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> Optional[object]:
+        """A token if the call may go ahead, else None; hand it to release() when the call ends"""
+        state = self.state
+        if state == "closed":
+            return ADMITTED
+        if state == "half_open" and self._probe is None:
+            self._probe = object()
+            return self._probe
+        return None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe = None
+
+    def release(self, token: Optional[object]):
+        """End a call; if it was the probe and gave no verdict (cancelled, or our own budget ran out), the next call can probe"""
+        if token is not None and token is self._probe:
+            self._probe = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self._probe = None
+
+
+class Resilience:
+    """Retries, hedging and per-model circuit breakers around upstream calls"""
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyWindow] = {}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            breaker = self.breakers[model] = CircuitBreaker(
+                settings.circuit_breaker_failure_threshold,
+                settings.circuit_breaker_cooldown_seconds
+            )
+        return breaker
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds to wait before hedging: the model's p95 call latency, once there are enough samples"""
+        window = self._latency.get(model)
+        if not settings.upstream_hedge_enabled or window is None or len(window) < settings.upstream_hedge_min_samples:
+            return None
+        return max(settings.upstream_hedge_min_delay_seconds, window.quantile(0.95) / 1000.0)
+
+    async def call(
+        self,
+        model: str,
+        attempt: Callable[[str], Awaitable[T]],
+        fallback: Optional[Callable[[], Awaitable[T]]] = None,
+        hedge: bool = True
+    ) -> T:
+        """
+        Run attempt(model) with retries and hedging behind the model's circuit breaker
+        When the breaker is open the call fails fast with CircuitOpen, or runs fallback if given.
+        """
+        breaker = self.breaker(model)
+        token = breaker.allow()
+        if token is None:
+            return await self._fail_fast(model, fallback)
+
+        try:
+            for retry in range(settings.upstream_max_attempts):
+                try:
+                    result = await (self._hedged(model, attempt) if hedge else self._timed(model, attempt))
+                    breaker.record_success()
+                    return result
+                except SchedulerBusy:
+                    # Our own budget is exhausted; that says nothing about upstream health
+                    raise
+                except Exception as e:
+                    error = classify(e)
+                    metrics.upstream_errors.inc(kind=error.kind, model=model)
+                    if isinstance(error, UpstreamRejected):
+                        # The upstream answered, so it is healthy even if this request was bad
+                        breaker.record_success()
+                    else:
+                        breaker.record_failure()
+                    if not error.retryable or retry + 1 >= settings.upstream_max_attempts:
+                        raise error from e
+                    token = breaker.allow()
+                    if token is None:
+                        return await self._fail_fast(model, fallback)
+                metrics.upstream_retries.inc(model=model)
+                # Rate-limited retries wait in the upstream scheduler, which is paused for Retry-After
+                if not isinstance(error, UpstreamRateLimited):
+                    await asyncio.sleep(backoff_delay(retry))
+        finally:
+            # A half-open probe that was cancelled (speculative or hedge loser, client gone) or hit
+            # SchedulerBusy has no verdict; without this the circuit would stay shut for good. Other calls
+            # ending meanwhile must not free the probe slot, or a second probe would get through
+            breaker.release(token)
+
+    async def _fail_fast(self, model: str, fallback: Optional[Callable[[], Awaitable[T]]]) -> T:
+        if fallback is None:
+            metrics.upstream_errors.inc(kind=CircuitOpen.kind, model=model)
+            raise CircuitOpen(model)
+        metrics.upstream_fallbacks.inc(model=model)
+        return await fallback()
+
+    async def _timed(self, model: str, attempt: Callable[[str], Awaitable[T]]) -> T:
+        start = time.time()
+        result = await attempt(model)
+        window = self._latency.get(model)
+        if window is None:
+            window = self._latency[model] = LatencyWindow()
+        window.add((time.time() - start) * 1000)
+        return result
+
+    async def _hedged(self, model: str, attempt: Callable[[str], Awaitable[T]]) -> T:
+        """Start a second attempt if the first is slower than the hedge delay; first success wins"""
+        delay = self.hedge_delay(model)
+        if delay is None:
+            return await self._timed(model, attempt)
+
+        tasks = {asyncio.ensure_future(self._timed(model, attempt))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                metrics.upstream_hedges.inc(model=model)
+                hedge = asyncio.ensure_future(self._timed(model, attempt))
+                tasks.add(hedge)
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Cancel the slower attempt (or both, if the caller was cancelled)
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit_breakers": {
+                model: {"state": breaker.state, "failures": breaker.failures, "times_opened": breaker.times_opened}
+                for model, breaker in self.breakers.items()
+            },
+            "hedge_delay_ms": {
+                model: round(delay * 1000, 1)
+                for model in self._latency
+                if (delay := self.hedge_delay(model)) is not None
+            },
+        }
+
+
+# Global instance
+resilience = Resilience()
@@ -0,0 +1,244 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+from sqlalchemy import create_engine, text
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app.database import (
+    PARTITION_PREFIX, PromptLogEntry, delete_expired_cache_entries, delete_orphan_blobs, enable_foreign_keys,
+    ensure_partitions, is_partitioned, log_row, log_rows_query, partition_tables, refresh_prompt_logs_view, rotate_periods
+)
+
+MANIFEST_NAME = "manifest.json"
+RETENTION_LOCK_ID = 7305151  # pg_advisory_lock key so one worker at a time archives
+
+
+def manifest_path() -> str:
+    return os.path.join(settings.log_archive_dir, MANIFEST_NAME)
+
+
+def load_manifest() -> List[Dict[str, Any]]:
+    """Archived periods, oldest first"""
+    try:
+        with open(manifest_path(), encoding="utf-8") as f:
+            return json.load(f)["archives"]
+    except FileNotFoundError:
+        return []
+
+
+def _save_manifest(archives: List[Dict[str, Any]]):
+    path = manifest_path()
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"archives": sorted(archives, key=lambda entry: entry["start"])}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def find_archive(period: str) -> Optional[Dict[str, Any]]:
+    return next((entry for entry in load_manifest() if entry["period"] == period), None)
+
+
+def iter_archive(
+    entry: Dict[str, Any],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    model: Optional[str] = None,
+    user_ip: Optional[str] = None,
+    limit: Optional[int] = None
+) -> Iterator[str]:
+    """NDJSON lines of an archived period matching the filters, decompressed one line at a time"""
+    matched = 0
+    with gzip.open(os.path.join(settings.log_archive_dir, entry["file"]), "rt", encoding="utf-8") as lines:
+        for line in lines:
+            row = json.loads(line)
+            timestamp = datetime.fromisoformat(row["timestamp"])
+            if end is not None and timestamp >= end:
+                return  # Archives are written in timestamp order
+            if start is not None and timestamp < start:
+                continue
+            if model is not None and row["model_used"] != model:
+                continue
+            if user_ip is not None and row["user_ip"] != user_ip:
+                continue
+            yield line
+            matched += 1
+            if limit is not None and matched >= limit:
+                return
+
+
+def export_period(connection, name: str, start: datetime, end: datetime, batch_size: int = 1000) -> Dict[str, Any]:
+    """Stream one period table into LOG_ARCHIVE_DIR as JSONL.gz in (timestamp, id) order"""
+    period = name[len(PARTITION_PREFIX):]
+    file_name = f"prompt_logs_p{period}.jsonl.gz"
+    path = os.path.join(settings.log_archive_dir, file_name)
+    rows = 0
+    after: Optional[Tuple[datetime, int]] = None
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as out:
+        while True:
+            query = log_rows_query(name, after=after, descending=False).limit(batch_size)
+            batch = [log_row(result) for result in connection.execute(query)]
+            if not batch:
+                break
+            for row in batch:
+                out.write(json.dumps({**row, "timestamp": row["timestamp"].isoformat()}) + "\n")
+            rows += len(batch)
+            after = (batch[-1]["timestamp"], batch[-1]["id"])
+    os.replace(path + ".tmp", path)
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {
+        "period": period,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "file": file_name,
+        "rows": rows,
+        "bytes": os.path.getsize(path),
+        "sha256": digest.hexdigest(),
+        "archived_at": datetime.utcnow().isoformat(),
+    }
+
+
+class LogRetention:
+    """
+    Keeps prompt_log_entries split into periods and archives the expired ones
+    Each run also deletes shared response cache rows past their TTL.
+    Every LOG_RETENTION_INTERVAL_SECONDS upcoming PostgreSQL partitions are created (SQLite moves
+    closed periods into their own tables). Periods that ended more than LOG_RETENTION_DAYS ago are
+    detached, written to LOG_ARCHIVE_DIR as JSONL.gz, recorded in manifest.json and dropped.
+    """
+
+    def __init__(self):
+        self._engine = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.runs = 0
+        self.periods_archived = 0
+        self.rows_archived = 0
+        self.blobs_deleted = 0
+        self.cache_entries_deleted = 0
+        self.last_run: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self._warned_unpartitioned = False
+
+    def _connect(self):
+        if self._engine is None:
+            # Bulk export runs on a worker thread with its own small sync pool, like the job queue
+            self._engine = create_engine(settings.database_url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+            enable_foreign_keys(self._engine)
+
+    async def start(self):
+        if settings.database_url and settings.log_retention_interval_seconds > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._engine is not None:
+            self._engine.dispose()
+            self._engine = None
+
+    async def _loop(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(settings.log_retention_interval_seconds)
+
+    async def run_once(self) -> List[Dict[str, Any]]:
+        """Maintain partitions and archive expired periods; returns the new manifest entries"""
+        try:
+            archived = await run_in_threadpool(self._run, datetime.utcnow())
+            self.last_error = None
+            return archived
+        except Exception as e:
+            self.last_error = str(e).splitlines()[0] if str(e) else type(e).__name__
+            print(f"Warning: log retention failed: {self.last_error}")
+            return []
+        finally:
+            self.runs += 1
+            self.last_run = datetime.utcnow()
+
+    def _run(self, now: datetime) -> List[Dict[str, Any]]:
+        self._connect()
+        with self._engine.connect() as connection:
+            postgres = connection.dialect.name == "postgresql"
+            self.cache_entries_deleted += delete_expired_cache_entries(connection, now)
+            connection.commit()
+            if not is_partitioned(connection):
+                if not self._warned_unpartitioned:
+                    print("Warning: prompt_log_entries is not partitioned; run migrations/002_partition_prompt_log_entries.sql")
+                    self._warned_unpartitioned = True
+                return []
+            if postgres and not connection.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": RETENTION_LOCK_ID}).scalar():
+                return []  # Another worker is on it
+            try:
+                if postgres:
+                    ensure_partitions(connection, now, now)
+                elif rotate_periods(connection, now):
+                    refresh_prompt_logs_view(connection)
+                connection.commit()
+                if settings.log_retention_days <= 0:
+                    return []
+                return self._archive_expired(connection, now - timedelta(days=settings.log_retention_days))
+            finally:
+                connection.rollback()
+                if postgres:
+                    connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": RETENTION_LOCK_ID})
+                    connection.commit()
+
+    def _archive_expired(self, connection, cutoff: datetime) -> List[Dict[str, Any]]:
+        os.makedirs(settings.log_archive_dir, exist_ok=True)
+        archives = load_manifest()
+        archived = []
+        expired = sorted(
+            ((start, end, name) for name, (start, end) in partition_tables(connection).items() if end <= cutoff)
+        )
+        for start, end, name in expired:
+            if connection.dialect.name == "postgresql" and self._attached(connection, name):
+                # Detached rows vanish from queries at once; the export below reads the standalone table
+                connection.execute(text(f"ALTER TABLE {PromptLogEntry.__tablename__} DETACH PARTITION {name}"))
+            connection.commit()
+            entry = export_period(connection, name, start, end)
+            connection.rollback()
+            archives = [existing for existing in archives if existing["period"] != entry["period"]] + [entry]
+            _save_manifest(archives)
+            connection.execute(text(f"DROP TABLE {name}"))
+            if connection.dialect.name != "postgresql":
+                refresh_prompt_logs_view(connection)
+            connection.commit()
+            archived.append(entry)
+            self.periods_archived += 1
+            self.rows_archived += entry["rows"]
+            print(f"Archived {entry['rows']} log entries of {entry['period']} to {entry['file']}")
+        if archived:
+            self.blobs_deleted += delete_orphan_blobs(connection)
+            connection.commit()
+        return archived
+
+    @staticmethod
+    def _attached(connection, name: str) -> bool:
+        return connection.execute(text(
+            "SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE c.relname = :name"
+        ), {"name": name}).first() is not None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retention_days": settings.log_retention_days,
+            "partition_period": settings.log_partition_period,
+            "runs": self.runs,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_error": self.last_error,
+            "periods_archived": self.periods_archived,
+            "rows_archived": self.rows_archived,
+            "blobs_deleted": self.blobs_deleted,
+            "cache_entries_deleted": self.cache_entries_deleted,
+        }
+
+
+# Global instance
+log_retention = LogRetention()
@@ -0,0 +1,236 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import random
+from app.backends import MockBackend, ModelBackend, OpenAIBackend
+from app.config import settings
+from app.resilience import resilience
+
+STAGES = ("refinement", "generation", "direct")
+
+
+class ModelRoute(NamedTuple):
+    """One model on one backend that stages can be routed to"""
+    name: str  # What logs, metrics and circuit breakers call it
+    model: str  # Model name sent to the backend
+    backend: str = "openai"  # openai, local (any OpenAI-compatible server) or mock
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    stages: Tuple[str, ...] = STAGES
+    cost_per_1k_tokens: float = 0.0  # USD, prompt and completion tokens blended
+
+
+class RouteStats:
+    """Rolling latency, error rate and token use of one route (exponentially weighted)"""
+
+    def __init__(self):
+        self.latency_ms: Dict[Tuple[str, str], float] = {}  # (stage, style) -> mean
+        self.tokens: Dict[Tuple[str, str], float] = {}
+        self.samples: Dict[str, int] = {}  # stage -> calls, failed ones included
+        self.error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.selected = 0
+
+    def latency_for(self, stage: str, style: str) -> Optional[float]:
+        latency = self.latency_ms.get((stage, style))
+        if latency is not None:
+            return latency
+        # No calls in this style yet: the slowest style seen on the stage
+        seen = [value for (seen_stage, _), value in self.latency_ms.items() if seen_stage == stage]
+        return max(seen) if seen else None
+
+    def tokens_for(self, stage: str, style: str) -> float:
+        tokens = self.tokens.get((stage, style))
+        if tokens is not None:
+            return tokens
+        seen = [value for (seen_stage, _), value in self.tokens.items() if seen_stage == stage]
+        return max(seen) if seen else 0.0
+
+
+def _ewma(previous: Optional[float], value: float, alpha: float) -> float:
+    return value if previous is None else previous + alpha * (value - previous)
+
+
+class ModelRouter:
+    """
+    Picks the route for each upstream call from its recent latency, error rate and cost
+    A route's score is its expected latency for the stage and style, stretched by its
+    error rate (failed calls are retried), plus its expected cost for that style's token
+    use converted to milliseconds at MODEL_ROUTER_MS_PER_CENT. The lowest score wins.
+    """
+
+    def __init__(self):
+        self._routes: Optional[Dict[str, ModelRoute]] = None
+        self._backends: Dict[Tuple[str, Optional[str], Optional[str]], ModelBackend] = {}
+        self.mock = MockBackend()
+        self._stats: Dict[str, RouteStats] = {}
+        self._rng = random.Random()
+
+    @property
+    def routes(self) -> Dict[str, ModelRoute]:
+        if self._routes is None:
+            self._routes = self._load_routes()
+        return self._routes
+
+    def _load_routes(self) -> Dict[str, ModelRoute]:
+        """MODEL_ROUTES, or REFINEMENT_MODEL for refinement and DEFAULT_MODEL for answers"""
+        routes: Dict[str, ModelRoute] = {}
+        for spec in settings.model_routes:
+            model = spec.get("model") or spec["name"]
+            route = ModelRoute(
+                name=spec.get("name") or model,
+                model=model,
+                backend=spec.get("backend", "openai"),
+                base_url=spec.get("base_url"),
+                api_key=spec.get("api_key"),
+                stages=tuple(spec.get("stages") or STAGES),
+                cost_per_1k_tokens=float(spec.get("cost_per_1k_tokens", 0.0)),
+            )
+            if route.backend not in ("openai", "local", "mock"):
+                raise ValueError(f"Unknown backend {route.backend!r} for model route {route.name!r}")
+            routes[route.name] = route
+        if routes:
+            return routes
+
+        if settings.refinement_model == settings.default_model:
+            return {settings.default_model: ModelRoute(settings.default_model, settings.default_model)}
+        return {
+            settings.refinement_model: ModelRoute(
+                settings.refinement_model, settings.refinement_model, stages=("refinement",)
+            ),
+            settings.default_model: ModelRoute(
+                settings.default_model, settings.default_model, stages=("generation", "direct")
+            ),
+        }
+
+    def route(self, name: str) -> ModelRoute:
+        """The named route; unregistered names (e.g. UPSTREAM_FALLBACK) are OpenAI models"""
+        route = self.routes.get(name)
+        return route if route is not None else ModelRoute(name, name)
+
+    def backend_for(self, route: ModelRoute) -> ModelBackend:
+        if settings.mock_mode or route.backend == "mock":
+            return self.mock
+        key = (route.backend, route.base_url, route.api_key)
+        backend = self._backends.get(key)
+        if backend is None:
+            # Routes to the same server share one connection pool
+            api_key = route.api_key or ("local" if route.backend == "local" else None)
+            backend = self._backends[key] = OpenAIBackend(route.base_url, api_key)
+        return backend
+
+    def candidates(self, stage: str) -> List[ModelRoute]:
+        return [route for route in self.routes.values() if stage in route.stages]
+
+    def choose(self, stage: str, style: str) -> str:
+        """Name of the route to send this stage to"""
+        candidates = self.candidates(stage)
+        if not candidates:
+            raise ValueError(f"No model route serves the {stage} stage")
+        if len(candidates) > 1:
+            # Skip routes whose circuit is open or half-open (one probe at a time) while any other is available
+            healthy = [route for route in candidates if resilience.breaker(route.name).state == "closed"]
+            candidates = healthy or candidates
+        if len(candidates) > 1:
+            # Routes still warming up on this stage are tried before scores are trusted
+            warming = [
+                route for route in candidates
+                if self.route_stats(route.name).samples.get(stage, 0) < settings.model_router_min_samples
+            ]
+            if warming:
+                candidates = warming
+            elif self._rng.random() < settings.model_router_explore_ratio:
+                candidates = [self._rng.choice(candidates)]
+        best = min(candidates, key=lambda route: self.score(route, stage, style))
+        self.route_stats(best.name).selected += 1
+        return best.name
+
+    def score(self, route: ModelRoute, stage: str, style: str) -> float:
+        """Expected cost of sending the stage to the route, in milliseconds"""
+        stats = self.route_stats(route.name)
+        latency = stats.latency_for(stage, style)
+        if latency is None:
+            # Untried routes look free so they get tried; one that has only failed looks as slow as it gets
+            latency = self._worst_latency(stage, style) if stats.error_rate > 0 else 0.0
+        # Each failure costs a retry, so expected time grows with 1 / success rate
+        latency /= max(0.1, 1.0 - stats.error_rate)
+        cents = stats.tokens_for(stage, style) / 1000.0 * route.cost_per_1k_tokens * 100
+        return latency + cents * settings.model_router_ms_per_cent
+
+    def _worst_latency(self, stage: str, style: str) -> float:
+        """Slowest latency any route has shown on the stage, else its read timeout"""
+        seen = [
+            latency for name in self.routes
+            if (latency := self.route_stats(name).latency_for(stage, style)) is not None
+        ]
+        if seen:
+            return max(seen)
+        timeout = settings.upstream_refinement_timeout_seconds if stage == "refinement" else settings.upstream_generation_timeout_seconds
+        return timeout * 1000
+
+    def route_stats(self, name: str) -> RouteStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = RouteStats()
+        return stats
+
+    def observe(self, name: str, stage: str, style: str, latency_ms: float, tokens: Optional[int], ok: bool):
+        """Record the outcome of one call to a route"""
+        stats = self.route_stats(name)
+        alpha = settings.model_router_smoothing
+        stats.calls += 1
+        # Failures count toward warm-up too, or a route that always fails would stay first in line
+        stats.samples[stage] = stats.samples.get(stage, 0) + 1
+        stats.error_rate = _ewma(stats.error_rate, 0.0 if ok else 1.0, alpha)
+        if not ok:
+            stats.failures += 1
+            return
+        key = (stage, style)
+        stats.latency_ms[key] = _ewma(stats.latency_ms.get(key), latency_ms, alpha)
+        if tokens is not None:
+            stats.tokens[key] = _ewma(stats.tokens.get(key), float(tokens), alpha)
+
+    async def warm_up(self):
+        """Open UPSTREAM_WARMUP_CONNECTIONS pooled connections to every upstream server"""
+        if settings.mock_mode or settings.upstream_warmup_connections <= 0:
+            return
+        backends = {id(backend): backend for backend in map(self.backend_for, self.routes.values())}
+        await asyncio.gather(*(
+            backend.warm_up(settings.upstream_warmup_connections)
+            for backend in backends.values()
+            if isinstance(backend, OpenAIBackend)
+        ))
+
+    async def close(self):
+        for backend in self._backends.values():
+            await backend.close()
+        self._backends.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        routes = {}
+        for name, route in self.routes.items():
+            stats = self.route_stats(name)
+            routes[name] = {
+                "model": route.model,
+                "backend": "mock" if settings.mock_mode else route.backend,
+                "stages": list(route.stages),
+                "cost_per_1k_tokens": route.cost_per_1k_tokens,
+                "selected": stats.selected,
+                "calls": stats.calls,
+                "failures": stats.failures,
+                "error_rate": round(stats.error_rate, 4),
+                "latency_ms": {
+                    stage: {style: round(value, 1) for (seen_stage, style), value in stats.latency_ms.items() if seen_stage == stage}
+                    for stage in route.stages
+                },
+            }
+        pools = {
+            backend.base_url or "openai": backend.pool_stats()
+            for backend in self._backends.values()
+            if isinstance(backend, OpenAIBackend)
+        }
+        return {"routes": routes, "connection_pools": pools}
+
+
+# Global instance
+model_router = ModelRouter()
@@ -0,0 +1,195 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import time
+from app.config import settings
+
+# Lower value is served first; interactive traffic preempts batch and debug work
+PRIORITIES = {"interactive": 0, "batch": 1, "debug": 2}
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """Rough upstream token cost of a call: ~4 characters per prompt token plus the completion budget"""
+    return len(prompt) // 4 + max_tokens
+
+
+class SchedulerBusy(Exception):
+    """Raised when a call cannot be admitted within the configured wait"""
+
+    def __init__(self, queue_depth: int, eta_seconds: float):
+        super().__init__(f"Upstream capacity exhausted; {queue_depth} calls queued, retry in ~{eta_seconds:.1f}s")
+        self.queue_depth = queue_depth
+        self.eta_seconds = eta_seconds
+
+
+class TokenBucket:
+    """Budget that refills continuously up to one minute's allowance"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken (amounts above capacity wait for a full bucket)"""
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing / self.rate)
+
+
+class UpstreamScheduler:
+    """Admits upstream calls against tokens-per-minute and requests-per-minute budgets"""
+
+    def __init__(self, tokens_per_minute: int = 0, requests_per_minute: int = 0,
+                 max_queue_depth: int = 1000, max_wait_seconds: float = 30.0):
+        # A budget of 0 means unlimited
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.max_queue_depth = max_queue_depth
+        self.max_wait_seconds = max_wait_seconds
+        self._waiters: List[Tuple[int, int, int, "asyncio.Future[None]"]] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.upstream_rate_limited = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _refill(self) -> float:
+        now = time.monotonic()
+        for bucket in (self.tokens, self.requests):
+            if bucket is not None:
+                bucket.refill(now)
+        return now
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        wait = max(0.0, self._paused_until - now)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        return wait
+
+    def _take(self, tokens: int):
+        if self.tokens is not None:
+            self.tokens.available -= min(tokens, self.tokens.capacity)
+        if self.requests is not None:
+            self.requests.available -= 1
+        self.admitted += 1
+
+    def eta(self, tokens: int = 0) -> float:
+        """Estimated seconds before a new call of this size would be admitted, behind everything queued"""
+        now = self._refill()
+        queued_tokens = sum(waiter[2] for waiter in self._waiters) + tokens
+        wait = max(0.0, self._paused_until - now)
+        if self.tokens is not None:
+            wait = max(wait, (queued_tokens - self.tokens.available) / self.tokens.rate)
+        if self.requests is not None:
+            wait = max(wait, (len(self._waiters) + 1 - self.requests.available) / self.requests.rate)
+        return max(0.0, wait)
+
+    async def acquire(self, tokens: int, priority: str = "interactive"):
+        """Wait for budget for one call, or raise SchedulerBusy if the wait would be too long"""
+        rank = PRIORITIES.get(priority, PRIORITIES["interactive"])
+        now = self._refill()
+        # Go straight through only if nobody of the same or higher priority is waiting
+        if self._wait_time(tokens, now) == 0 and not any(waiter[0] <= rank for waiter in self._waiters):
+            self._take(tokens)
+            return
+
+        eta = self.eta(tokens)
+        if len(self._waiters) >= self.max_queue_depth or eta > self.max_wait_seconds:
+            self.rejected += 1
+            raise SchedulerBusy(len(self._waiters), eta)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (rank, next(self._sequence), tokens, future)
+        heapq.heappush(self._waiters, waiter)
+        self.queued += 1
+        self._schedule()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Admitted just as we gave up; hand the budget back
+                self.settle(tokens, 0)
+            else:
+                future.cancel()
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._schedule()
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise SchedulerBusy(len(self._waiters), self.eta(tokens))
+            raise
+
+    def _schedule(self):
+        """Admit waiters in priority order, then sleep until the head of the queue fits"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = self._refill()
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            wait = self._wait_time(tokens, now)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._schedule)
+                return
+            heapq.heappop(self._waiters)
+            self._take(tokens)
+            future.set_result(None)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Return the unused part of a token estimate once the real usage is known"""
+        if self.tokens is not None and actual_tokens < estimated_tokens:
+            self.tokens.available = min(self.tokens.capacity, self.tokens.available + estimated_tokens - actual_tokens)
+            if self._waiters:
+                self._schedule()
+
+    def pause(self, seconds: float):
+        """Stop admitting calls for a while after the upstream rate limits us"""
+        self.upstream_rate_limited += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if self._waiters:
+            self._schedule()
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._refill()
+        depth = {name: 0 for name in PRIORITIES}
+        names = {rank: name for name, rank in PRIORITIES.items()}
+        for rank, _, _, future in self._waiters:
+            if not future.done():
+                depth[names[rank]] += 1
+        return {
+            "queue_depth": depth,
+            "eta_seconds": round(self.eta(), 2) if self._waiters else 0.0,
+            "tokens_available": int(self.tokens.available) if self.tokens is not None else None,
+            "requests_available": int(self.requests.available) if self.requests is not None else None,
+            "paused_seconds": round(max(0.0, self._paused_until - now), 2),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "upstream_rate_limited": self.upstream_rate_limited,
+        }
+
+
+# Global instance
+upstream_scheduler = UpstreamScheduler(
+    tokens_per_minute=settings.upstream_tokens_per_minute,
+    requests_per_minute=settings.upstream_requests_per_minute,
+    max_queue_depth=settings.upstream_max_queue_depth,
+    max_wait_seconds=settings.upstream_max_wait_seconds
+)
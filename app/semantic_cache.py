@@ -0,0 +1,454 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+import asyncio
+import json
+import math
+import os
+import re
+import time
+import zlib
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from app.cache import make_cache_key, model_config_key, normalize_text
+from app.config import settings
+from app.metrics import LatencyWindow
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # Optional: the hashed n-gram vectorizer needs nothing beyond NumPy
+    SentenceTransformer = None
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+# IDF weights are refreshed each time the entry count doubles past this
+IDF_MIN_ENTRIES = 64
+# Below this many entries a brute-force scan is already sub-millisecond
+IVF_MIN_ENTRIES = 2048
+IVF_MAX_LISTS = 1024
+KMEANS_ITERATIONS = 6
+# Word bigrams count this many times, so swapping two words ("celsius to fahrenheit") drops below thresholds
+BIGRAM_WEIGHT = 2
+
+
+class HashingVectorizer:
+    """Term frequencies of word unigrams, word bigrams and character 3-grams, hashed into a fixed number of buckets"""
+    weighted = True  # Rows are re-weighted by IDF at search time
+    slow = False
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.name = f"hashing-bigram-{dim}"  # Snapshots of unigram-only vectors are not loaded
+
+    def encode(self, text: str) -> np.ndarray:
+        counts: Dict[int, int] = {}
+        words = WORD_PATTERN.findall(normalize_text(text))
+        grams = [f"{first} {second}" for first, second in zip(words, words[1:])] * BIGRAM_WEIGHT
+        for word in words:
+            padded = f" {word} "
+            grams += [word] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+        for gram in grams:
+            index = zlib.crc32(gram.encode("utf-8")) % self.dim
+            counts[index] = counts.get(index, 0) + 1
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for index, count in counts.items():
+            vector[index] = 1.0 + math.log(count)  # Sublinear TF
+        return vector
+
+
+class SentenceEncoder:
+    """Dense embeddings from a local sentence-transformers model (CPU)"""
+    weighted = False
+    slow = True
+
+    def __init__(self, model_name: str):
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+
+    def encode(self, text: str) -> np.ndarray:
+        return self.model.encode(normalize_text(text), normalize_embeddings=True).astype(np.float32)
+
+
+class ClusterIndex(NamedTuple):
+    """Rows grouped by k-means cluster; cluster i owns rows[bounds[i]:bounds[i + 1]]"""
+    centroids: np.ndarray
+    rows: np.ndarray  # IDF-weighted, unit length
+    slots: np.ndarray
+    generations: np.ndarray  # Slot generation when packed, to skip rows changed since
+    bounds: np.ndarray
+
+
+def make_encoder():
+    if settings.semantic_cache_model and SentenceTransformer is not None:
+        return SentenceEncoder(settings.semantic_cache_model)
+    return HashingVectorizer(settings.semantic_cache_dim)
+
+
+class SemanticCache:
+    """
+    Answers for near-duplicate inputs, matched by cosine similarity
+
+    Rows live in a growable NumPy matrix (bounded by semantic_cache_max_entries, least
+    recently used evicted first). Once it holds IVF_MIN_ENTRIES rows they are clustered
+    with k-means and packed by cluster, so a lookup only scores the contiguous blocks of
+    the nprobe closest clusters plus rows added since. IDF weights and clusters are
+    retrained in a worker thread each time the row count doubles.
+    """
+
+    def __init__(self):
+        self._encoder = None
+        self.capacity = settings.semantic_cache_max_entries
+        self._size = 0  # Allocated rows in use or freed (high-water mark)
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._namespaces = np.zeros(0, dtype=np.int32)  # -1 marks a free slot
+        self._expires_at = np.zeros(0, dtype=np.float64)
+        self._last_used = np.zeros(0, dtype=np.float64)
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._generation = np.zeros(0, dtype=np.int64)  # Bumped on every write to a slot
+        self._entries: List[Optional[Dict[str, Any]]] = []
+        self._slot_keys: List[Optional[str]] = []
+        self._keys: Dict[str, int] = {}  # Exact input -> slot, so a repeat replaces its row
+        self._namespace_ids: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._df: Optional[np.ndarray] = None
+        self._idf: Optional[np.ndarray] = None
+        self._index: Optional[ClusterIndex] = None
+        self._tails: List[List[int]] = []  # Rows added per cluster since the index was packed
+        self._tail_count = 0
+        self._built_at = 0
+        self._building = False
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._dirty: Set[int] = set()
+        self._latency = LatencyWindow()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rebuilds = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.semantic_cache_enabled
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = make_encoder()
+            self._vectors = np.zeros((0, self._encoder.dim), dtype=np.float32)
+            self._df = np.zeros(self._encoder.dim, dtype=np.int64)
+            self._idf = np.ones(self._encoder.dim, dtype=np.float32)
+        return self._encoder
+
+    def threshold_for(self, style: str) -> float:
+        return settings.semantic_cache_style_thresholds.get(style, settings.semantic_cache_threshold)
+
+    def _namespace_key(self, style: str, skip_refinement: bool) -> str:
+        # Only answers produced the same way are interchangeable
+        return make_cache_key(style, skip_refinement, model_config_key())
+
+    async def _encode(self, text: str) -> np.ndarray:
+        if self.encoder.slow:
+            return await run_in_threadpool(self.encoder.encode, text)
+        return self.encoder.encode(text)
+
+    async def get(self, raw_input: str, style: str, skip_refinement: bool) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return (cached value, similarity) for the closest input above the style's threshold"""
+        if not self.enabled or not self._keys:
+            return None
+        namespace = self._namespace_ids.get(self._namespace_key(style, skip_refinement))
+        match = None
+        if namespace is not None:
+            vector = await self._encode(raw_input)
+            start = time.perf_counter()
+            match = self.search(vector, namespace)
+            self._latency.add((time.perf_counter() - start) * 1000)
+        if match is None or match[1] < self.threshold_for(style):
+            self.misses += 1
+            return None
+        slot, similarity = match
+        self._last_used[slot] = time.time()
+        self.hits += 1
+        return self._entries[slot], similarity
+
+    def search(self, vector: np.ndarray, namespace: int) -> Optional[Tuple[int, float]]:
+        """Closest live row in the namespace as (slot, cosine similarity)"""
+        weighted = vector * self._idf
+        query_norm = float(np.linalg.norm(weighted))
+        if query_norm == 0.0:
+            return None
+        query = weighted / query_norm
+        if self._index is None:
+            candidates = np.arange(self._size)
+            packed_slots, packed_scores = candidates[:0], np.zeros(0, dtype=np.float32)
+        else:
+            index = self._index
+            nprobe = min(settings.semantic_cache_nprobe, len(index.centroids))
+            probes = np.argpartition(-(index.centroids @ query), nprobe - 1)[:nprobe]
+            # Packed rows are already IDF-weighted and normalized, one contiguous block per cluster
+            blocks = [slice(index.bounds[p], index.bounds[p + 1]) for p in probes]
+            packed_slots = np.concatenate([index.slots[block] for block in blocks])
+            packed_scores = np.concatenate([index.rows[block] @ query for block in blocks])
+            # A slot rewritten since packing has a newer generation; its current row is in a tail
+            current = self._generation[packed_slots] == np.concatenate([index.generations[block] for block in blocks])
+            packed_slots, packed_scores = packed_slots[current], packed_scores[current]
+            candidates = np.array([slot for p in probes for slot in self._tails[p]], dtype=np.int64)
+            candidates = candidates[np.isin(self._assign[candidates], probes)]
+        now = time.time()
+        live = (self._namespaces[packed_slots] == namespace) & (self._expires_at[packed_slots] > now)
+        packed_slots, packed_scores = packed_slots[live], packed_scores[live]
+        candidates = candidates[(self._namespaces[candidates] == namespace) & (self._expires_at[candidates] > now)]
+        scores = (self._vectors[candidates] @ (weighted * self._idf)) / (self._norms[candidates] * query_norm)
+        slots = np.concatenate([packed_slots, candidates])
+        scores = np.concatenate([packed_scores, scores])
+        if len(slots) == 0:
+            return None
+        best = int(np.argmax(scores))
+        return int(slots[best]), float(scores[best])
+
+    async def set(self, raw_input: str, style: str, skip_refinement: bool, value: Dict[str, Any]):
+        """Index an answer under its input's embedding"""
+        if not self.enabled:
+            return
+        vector = await self._encode(raw_input)
+        if not vector.any():
+            return
+        namespace_key = self._namespace_key(style, skip_refinement)
+        namespace = self._namespace_ids.setdefault(namespace_key, len(self._namespace_ids))
+        key = make_cache_key(normalize_text(raw_input), namespace_key)
+        self.add(key, vector, namespace, value, time.time() + settings.response_cache_ttl_seconds)
+        if self._should_rebuild():
+            self._rebuild_task = asyncio.ensure_future(self.rebuild())
+
+    def add(self, key: str, vector: np.ndarray, namespace: int, value: Dict[str, Any], expires_at: float):
+        if key in self._keys:
+            self._release(self._keys[key])
+        slot = self._allocate()
+        self._vectors[slot] = vector
+        self._namespaces[slot] = namespace
+        self._expires_at[slot] = expires_at
+        self._last_used[slot] = time.time()
+        self._generation[slot] += 1
+        self._entries[slot] = value
+        self._slot_keys[slot] = key
+        self._keys[key] = slot
+        if self.encoder.weighted:
+            self._df += vector > 0
+        self._norms[slot] = np.linalg.norm(vector * self._idf)
+        self._assign[slot] = -1
+        if self._index is not None:
+            self._assign[slot] = int(np.argmax(self._index.centroids @ (vector * self._idf / self._norms[slot])))
+            self._tails[self._assign[slot]].append(slot)
+            self._tail_count += 1
+        if self._building:
+            self._dirty.add(slot)
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._size < self.capacity:
+            if self._size == len(self._vectors):
+                self._grow(min(self.capacity, max(1024, 2 * len(self._vectors))))
+            self._size += 1
+            return self._size - 1
+        # Full: evict an expired row if there is one, else the least recently used
+        expired = self._expires_at[:self._size] <= time.time()
+        slot = int(np.argmin(np.where(expired, -math.inf, self._last_used[:self._size])))
+        self._release(slot)
+        self.evictions += 1
+        return self._free.pop()
+
+    def _grow(self, rows: int):
+        def resized(array: np.ndarray, fill: float) -> np.ndarray:
+            grown = np.full((rows,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+
+        self._vectors = resized(self._vectors, 0.0)
+        self._norms = resized(self._norms, 1.0)
+        self._namespaces = resized(self._namespaces, -1)
+        self._expires_at = resized(self._expires_at, 0.0)
+        self._last_used = resized(self._last_used, math.inf)
+        self._assign = resized(self._assign, -1)
+        self._generation = resized(self._generation, 0)
+        self._entries.extend([None] * (rows - len(self._entries)))
+        self._slot_keys.extend([None] * (rows - len(self._slot_keys)))
+
+    def _release(self, slot: int):
+        if self.encoder.weighted:
+            self._df -= self._vectors[slot] > 0
+        self._vectors[slot] = 0.0
+        self._namespaces[slot] = -1
+        self._expires_at[slot] = 0.0
+        self._last_used[slot] = math.inf  # Never picked for eviction while free
+        self._assign[slot] = -1
+        self._generation[slot] += 1
+        self._entries[slot] = None
+        del self._keys[self._slot_keys[slot]]
+        self._slot_keys[slot] = None
+        self._free.append(slot)
+        if self._building:
+            self._dirty.add(slot)
+
+    def _should_rebuild(self) -> bool:
+        # The task only sets _building once it runs, so writes in the same event loop tick check the task too
+        if self._building or (self._rebuild_task is not None and not self._rebuild_task.done()):
+            return False
+        # Retrain when the cache has doubled, or when too many rows sit in the unpacked tails
+        return len(self._keys) >= max(IDF_MIN_ENTRIES, 2 * self._built_at) or self._tail_count > len(self._keys) // 4
+
+    async def rebuild(self):
+        """Refresh the IDF weights and retrain the clustering without blocking the event loop"""
+        try:
+            await self._rebuild()
+        except Exception as e:
+            print(f"Semantic cache: index rebuild failed: {e}")
+
+    async def _rebuild(self):
+        self._building = True
+        self._dirty = set()
+        try:
+            slots = np.flatnonzero(self._namespaces[:self._size] >= 0)
+            idf, norms, index, assign = await run_in_threadpool(
+                self._train, self._vectors, slots, self._generation[slots], self._df.copy(), len(self._keys)
+            )
+            self._idf = idf
+            self._norms[slots] = norms
+            self._index = index
+            self._assign[:] = -1
+            self._tails = [[] for _ in range(len(index.centroids))] if index is not None else []
+            self._tail_count = 0
+            if index is not None:
+                self._assign[slots] = assign
+            # Rows written while training ran are re-weighted against the new model and kept in the tails
+            for slot in self._dirty:
+                if self._namespaces[slot] < 0:
+                    self._assign[slot] = -1
+                    continue
+                weighted = self._vectors[slot] * idf
+                self._norms[slot] = np.linalg.norm(weighted)
+                if index is not None:
+                    self._assign[slot] = int(np.argmax(index.centroids @ (weighted / self._norms[slot])))
+                    self._tails[self._assign[slot]].append(slot)
+                    self._tail_count += 1
+            self._built_at = len(self._keys)
+            self.rebuilds += 1
+        finally:
+            self._building = False
+
+    def _train(
+        self, vectors: np.ndarray, slots: np.ndarray, generations: np.ndarray, df: np.ndarray, count: int
+    ) -> Tuple[np.ndarray, np.ndarray, Optional[ClusterIndex], Optional[np.ndarray]]:
+        if self.encoder.weighted:
+            idf = (np.log((1 + count) / (1 + df)) + 1).astype(np.float32)  # Smoothed IDF
+        else:
+            idf = np.ones(vectors.shape[1], dtype=np.float32)
+        rows = vectors[slots] * idf
+        norms = np.maximum(np.linalg.norm(rows, axis=1), 1e-12).astype(np.float32)
+        if len(rows) < IVF_MIN_ENTRIES:
+            return idf, norms, None, None
+        rows /= norms[:, None]
+
+        lists = min(IVF_MAX_LISTS, max(1, int(2 * math.sqrt(len(rows)))))
+        rng = np.random.default_rng(0)
+        sample = rows[rng.choice(len(rows), min(len(rows), lists * 16), replace=False)]
+        centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            # Spherical k-means: move each centroid to the normalized sum of its members
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, sample)
+            lengths = np.linalg.norm(sums, axis=1)
+            filled = lengths > 0  # An empty cluster keeps its previous centroid
+            centroids[filled] = sums[filled] / lengths[filled, None]
+        assign = np.concatenate([
+            np.argmax(rows[i:i + 8192] @ centroids.T, axis=1) for i in range(0, len(rows), 8192)
+        ]).astype(np.int32)
+
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(lists + 1))
+        index = ClusterIndex(centroids, rows[order], slots[order], generations[order], bounds)
+        return idf, norms, index, assign
+
+    def save(self, path: str):
+        """Write the live rows to a compressed .npz snapshot"""
+        slots = np.flatnonzero(self._namespaces[:self._size] >= 0)
+        namespaces = {namespace: key for key, namespace in self._namespace_ids.items()}
+        rows = {
+            "encoder": self.encoder.name,
+            "keys": [self._slot_keys[slot] for slot in slots],
+            "namespaces": [namespaces[namespace] for namespace in self._namespaces[slots].tolist()],
+            "entries": [self._entries[slot] for slot in slots],
+        }
+        np.savez_compressed(
+            path,
+            vectors=self._vectors[slots],
+            expires_at=self._expires_at[slots],
+            last_used=self._last_used[slots],
+            rows=np.array(json.dumps(rows)),
+        )
+
+    def load(self, path: str) -> int:
+        """Restore rows from a snapshot written by the same encoder; returns how many were kept"""
+        with np.load(path, allow_pickle=False) as snapshot:
+            rows = json.loads(str(snapshot["rows"]))
+            if rows["encoder"] != self.encoder.name:
+                return 0
+            vectors, expires_at, last_used = snapshot["vectors"], snapshot["expires_at"], snapshot["last_used"]
+        now = time.time()
+        loaded = 0
+        for i in np.argsort(-last_used).tolist():  # Newest first, so a smaller capacity keeps the most recent
+            if expires_at[i] <= now or loaded >= self.capacity:
+                continue
+            namespace = self._namespace_ids.setdefault(rows["namespaces"][i], len(self._namespace_ids))
+            self.add(rows["keys"][i], vectors[i], namespace, rows["entries"][i], float(expires_at[i]))
+            self._last_used[self._keys[rows["keys"][i]]] = last_used[i]
+            loaded += 1
+        return loaded
+
+    async def restore(self):
+        """Load the configured snapshot at startup"""
+        path = settings.semantic_cache_path
+        if not self.enabled or not path or not os.path.exists(path):
+            return
+        try:
+            loaded = await run_in_threadpool(self.load, path)
+            print(f"Semantic cache: restored {loaded} entries from {path}")
+        except Exception as e:
+            print(f"Semantic cache: could not restore {path}: {e}")
+            return
+        if len(self._keys) >= IDF_MIN_ENTRIES:
+            await self.rebuild()
+
+    async def persist(self):
+        """Save the configured snapshot at shutdown"""
+        if self._rebuild_task is not None:
+            self._rebuild_task.cancel()
+        path = settings.semantic_cache_path
+        if not self.enabled or not path or self._encoder is None:
+            return
+        try:
+            await run_in_threadpool(self.save, path)
+        except Exception as e:
+            print(f"Semantic cache: could not save {path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "encoder": self._encoder.name if self._encoder is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._keys),
+            "capacity": self.capacity,
+            "evictions": self.evictions,
+            "clusters": len(self._index.centroids) if self._index is not None else 0,
+            "rebuilds": self.rebuilds,
+            "search": self._latency.summary(),
+        }
+
+
+# Global instance
+semantic_cache = SemanticCache()
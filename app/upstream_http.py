@@ -0,0 +1,131 @@
+from typing import Any, Callable, Dict, Optional
+import time
+import httpx
+from app.config import settings
+from app.metrics import metrics
+
+try:
+    import h2  # noqa: F401 -- httpx needs it for HTTP/2 (pip install httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Handshake phases as httpcore names them in its trace events
+HANDSHAKE_PHASES = {"connection.connect_tcp": "tcp", "connection.start_tls": "tls"}
+
+
+def stage_timeout(stage: str) -> httpx.Timeout:
+    """Connect, pool and read timeouts for an upstream call made for the given pipeline stage"""
+    if stage == "refinement":
+        read = settings.upstream_refinement_timeout_seconds
+    else:
+        read = settings.upstream_generation_timeout_seconds
+    return httpx.Timeout(
+        read,
+        connect=settings.upstream_connect_timeout_seconds,
+        pool=settings.upstream_pool_timeout_seconds,
+    )
+
+
+def http2_enabled() -> bool:
+    if settings.upstream_http2 and not HTTP2_AVAILABLE:
+        print("Warning: UPSTREAM_HTTP2 needs the h2 package (pip install httpx[http2]); using HTTP/1.1")
+        return False
+    return settings.upstream_http2
+
+
+class TracedStream(httpx.AsyncByteStream):
+    """Response body that reports when its connection goes back to the pool"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    async def __aiter__(self):
+        async for part in self._stream:
+            yield part
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """
+    Pooled upstream transport that records handshakes and pool use
+    New connections show up in the connects counter and the tcp/tls handshake histogram;
+    every request updates the active/idle connection and in-flight gauges.
+    """
+
+    def __init__(self, upstream: str, **transport_kwargs: Any):
+        self.upstream = upstream
+        self.in_flight = 0
+        self._transport = httpx.AsyncHTTPTransport(**transport_kwargs)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started: Dict[str, float] = {}
+
+        async def trace(event: str, info: Dict[str, Any]):
+            name, _, state = event.rpartition(".")
+            phase = HANDSHAKE_PHASES.get(name)
+            if phase is None:
+                return
+            if state == "started":
+                started[phase] = time.perf_counter()
+            elif state == "complete" and phase in started:
+                elapsed = time.perf_counter() - started.pop(phase)
+                metrics.upstream_handshake.observe(elapsed, upstream=self.upstream, phase=phase)
+                if phase == "tcp":
+                    metrics.upstream_connects.inc(upstream=self.upstream)
+
+        request.extensions["trace"] = trace
+        self.in_flight += 1
+        self._update_gauges()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._release()
+            raise
+        # The connection stays busy until the body is read or closed
+        response.stream = TracedStream(response.stream, self._release)
+        return response
+
+    def _release(self):
+        self.in_flight -= 1
+        self._update_gauges()
+
+    def _update_gauges(self):
+        stats = self.pool_stats()
+        metrics.upstream_connections.set(stats["connections"] - stats["idle"], upstream=self.upstream, state="active")
+        metrics.upstream_connections.set(stats["idle"], upstream=self.upstream, state="idle")
+        metrics.upstream_in_flight.set(self.in_flight, upstream=self.upstream)
+
+    def pool_stats(self) -> Dict[str, int]:
+        pool = getattr(self._transport, "_pool", None)
+        connections = getattr(pool, "connections", [])
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {"connections": len(connections), "idle": idle, "in_flight": self.in_flight}
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def build_http_client(base_url: Optional[str], http2: bool = False) -> httpx.AsyncClient:
+    """One pooled, instrumented HTTP client for an upstream server"""
+    url = httpx.URL(base_url or "https://api.openai.com/v1")
+    upstream = url.host if url.port is None else f"{url.host}:{url.port}"
+    transport = TracingTransport(
+        upstream,
+        http2=http2,
+        verify=settings.upstream_ca_bundle or True,
+        limits=httpx.Limits(
+            max_connections=settings.upstream_max_connections,
+            max_keepalive_connections=settings.upstream_max_keepalive_connections,
+            keepalive_expiry=settings.upstream_keepalive_expiry_seconds,
+        ),
+    )
+    return httpx.AsyncClient(transport=transport, timeout=stage_timeout("generation"))
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Load test and benchmark for the Answer Architect API
+
+Replays a workload (a JSONL file, or a seeded synthetic mix of styles and
+skip_refinement) against the app, either in-process through ASGI (mock mode,
+rate limits off) or over HTTP against a running server, and reports
+throughput, per-stage latency percentiles and event-loop lag:
+
+    python benchmark.py --requests 200 --concurrency 20 --save-baseline bench_baseline.json
+    python benchmark.py --requests 200 --concurrency 20 --baseline bench_baseline.json
+    python benchmark.py --mode http --url http://localhost:8000 --workload requests.jsonl
+
+For reproducible in-process runs the mock upstream is seeded (MOCK_SEED) unless
+already configured. With --baseline the exit status is 1 when a metric regressed
+by more than --tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+STYLES = ["concise", "detailed", "casual", "professional", "educational", "balanced"]
+
+SYNTHETIC_TEMPLATES = [
+    "explain {topic}",
+    "What is {topic} and why does it matter?",
+    "help me understand {topic}",
+    "Compare {topic} with the most common alternative, including trade-offs and typical use cases.",
+    "give me 3 tips about {topic}",
+    "{topic}",
+    "Write a short summary of {topic} for a beginner, with one practical example.",
+]
+SYNTHETIC_TOPICS = [
+    "machine learning", "kubernetes", "quantum computing", "database indexing", "the french revolution",
+    "compound interest", "photosynthesis", "rust ownership", "http caching", "climate change",
+    "neural networks", "event loops", "vector databases", "supply chains", "the stock market",
+]
+
+STAGE_BUCKET = re.compile(r'answer_architect_stage_duration_seconds_bucket\{(?P<labels>[^}]*)\} (?P<value>\S+)')
+UPSTREAM_CONNECTS = re.compile(r'answer_architect_upstream_connects_total\{[^}]*\} (?P<value>\S+)')
+
+# Metric -> direction in which a change is a regression
+COMPARED_METRICS = {
+    "throughput_rps": "lower",
+    "error_rate": "higher",
+    "latency.client.p50_ms": "higher",
+    "latency.client.p95_ms": "higher",
+    "latency.client.p99_ms": "higher",
+    "latency.refinement.p95_ms": "higher",
+    "latency.generation.p95_ms": "higher",
+    "event_loop_lag.p99_ms": "higher",
+    "upstream_connects": "higher",
+}
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(values)
+    n = len(ordered)
+    return {
+        "count": n,
+        "p50_ms": round(ordered[min(n - 1, int(0.50 * n))], 2),
+        "p95_ms": round(ordered[min(n - 1, int(0.95 * n))], 2),
+        "p99_ms": round(ordered[min(n - 1, int(0.99 * n))], 2),
+        "max_ms": round(ordered[-1], 2),
+    }
+
+
+def load_workload(path: str, rng: random.Random, skip_ratio: float) -> List[Dict[str, Any]]:
+    """Prompts from a JSONL file; lines may carry text (or prompt, body, title), style and skip_refinement"""
+    items = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            text = row.get("text") or row.get("prompt") or row.get("body") or row.get("title")
+            if not text:
+                continue
+            items.append({
+                "text": text[:5000],
+                "style": row.get("style") or rng.choice(STYLES),
+                "skip_refinement": row.get("skip_refinement", rng.random() < skip_ratio),
+            })
+    if not items:
+        raise SystemExit(f"No prompts found in {path}")
+    return items
+
+
+def synthetic_workload(count: int, rng: random.Random, skip_ratio: float) -> List[Dict[str, Any]]:
+    return [
+        {
+            "text": rng.choice(SYNTHETIC_TEMPLATES).format(topic=rng.choice(SYNTHETIC_TOPICS)),
+            "style": rng.choice(STYLES),
+            "skip_refinement": rng.random() < skip_ratio,
+        }
+        for _ in range(count)
+    ]
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeper; lag means blocking work on the loop"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, (time.perf_counter() - start - self.interval) * 1000))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def stage_buckets(metrics_text: str) -> Dict[str, Dict[float, float]]:
+    """Cumulative stage histogram buckets from /metrics, summed over model and style"""
+    buckets: Dict[str, Dict[float, float]] = {}
+    for match in STAGE_BUCKET.finditer(metrics_text):
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group("labels")))
+        le = float("inf") if labels["le"] == "+Inf" else float(labels["le"])
+        stage = buckets.setdefault(labels["stage"], {})
+        stage[le] = stage.get(le, 0.0) + float(match.group("value"))
+    return buckets
+
+
+def upstream_connects(metrics_text: str) -> float:
+    """New upstream connections opened so far, over all upstream servers"""
+    return sum(float(match.group("value")) for match in UPSTREAM_CONNECTS.finditer(metrics_text))
+
+
+def histogram_percentiles(before: Dict[float, float], after: Dict[float, float]) -> Dict[str, Optional[float]]:
+    """Percentiles interpolated from the histogram buckets filled during the run"""
+    bounds = sorted(after)
+    counts = [after[b] - before.get(b, 0.0) for b in bounds]
+    total = counts[-1] if counts else 0
+    if not total:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    result: Dict[str, Optional[float]] = {"count": int(total)}
+    for name, q in (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+        rank = q * total
+        lower, seen = 0.0, 0.0
+        for bound, cumulative in zip(bounds, counts):
+            if cumulative >= rank:
+                upper = bound if bound != float("inf") else lower
+                fraction = (rank - seen) / (cumulative - seen) if cumulative > seen else 1.0
+                result[name] = round((lower + (upper - lower) * fraction) * 1000, 2)
+                break
+            lower, seen = bound, cumulative
+    result["max_ms"] = None
+    return result
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    workload: List[Dict[str, Any]],
+    endpoint: str,
+    concurrency: int,
+    use_cache: bool,
+    rate: Optional[float]
+) -> Tuple[List[Dict[str, Any]], float]:
+    """Send every workload item with at most `concurrency` in flight (and at most `rate` starts per second)"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(workload):
+        queue.put_nowait((index, item))
+    results: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+
+    async def worker():
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if rate:
+                # Open-loop pacing: request i starts no earlier than i / rate seconds in
+                delay = started + index / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            body = {**item, "cache": use_cache}
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json=body)
+                status = response.status_code
+                payload = response.json() if status == 200 else {}
+            except Exception as e:
+                status, payload = 0, {"error": str(e)}
+            results.append({
+                "status": status,
+                "client_ms": (time.perf_counter() - start) * 1000,
+                "total_ms": payload.get("processing_time_ms"),
+                "refinement_ms": payload.get("refinement_time_ms"),
+                "generation_ms": payload.get("generation_time_ms"),
+                "cache_hit": payload.get("cache_hit", False),
+                # No refinement call was made; keep these out of the refinement percentiles
+                "refinement_skipped": bool(
+                    item["skip_refinement"] or payload.get("refinement_cached") or payload.get("refinement_bypassed")
+                ),
+            })
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+def build_report(
+    results: List[Dict[str, Any]],
+    elapsed: float,
+    lag: List[float],
+    stages: Dict[str, Dict[str, Optional[float]]],
+    config: Dict[str, Any],
+    connects: float = 0.0
+) -> Dict[str, Any]:
+    ok = [r for r in results if r["status"] == 200]
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    latency = {"client": percentiles([r["client_ms"] for r in ok])}
+    for stage, key in (("total", "total_ms"), ("refinement", "refinement_ms"), ("generation", "generation_ms")):
+        values = [
+            r[key] for r in ok
+            if r[key] is not None and not (stage != "total" and r["cache_hit"])
+            and not (stage == "refinement" and r["refinement_skipped"])
+        ]
+        # Per-request timings come from the debug endpoint; otherwise use the server's histograms
+        latency[stage] = percentiles(values) if values else stages.get(stage, percentiles([]))
+    return {
+        "config": config,
+        "requests": len(results),
+        "succeeded": len(ok),
+        "statuses": statuses,
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "cache_hit_rate": round(sum(r["cache_hit"] for r in ok) / len(ok), 4) if ok else 0.0,
+        "latency": latency,
+        "event_loop_lag": percentiles(lag),
+        "upstream_connects": int(connects),
+    }
+
+
+def lookup(report: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = report
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print metric changes against the baseline; return the ones that regressed past tolerance"""
+    regressions = []
+    print(f"\n📊 Compared with baseline (tolerance {tolerance:.0%}):")
+    for path, worse in COMPARED_METRICS.items():
+        current, previous = lookup(report, path), lookup(baseline, path)
+        if current is None or previous is None:
+            continue
+        if previous == 0:
+            change = 0.0 if current == 0 else float("inf")
+        else:
+            change = (current - previous) / previous
+        regressed = change > tolerance if worse == "higher" else change < -tolerance
+        # Loop lag and error rate are tiny numbers; ignore sub-millisecond / sub-1% noise
+        if path.startswith("event_loop_lag") and abs(current - previous) < 1.0:
+            regressed = False
+        if path == "error_rate" and current - previous < 0.01:
+            regressed = False
+        marker = "❌" if regressed else "✅"
+        print(f"  {marker} {path}: {previous} -> {current} ({change:+.1%})")
+        if regressed:
+            regressions.append(path)
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\n🏁 {report['succeeded']}/{report['requests']} succeeded in {report['elapsed_seconds']}s "
+          f"({report['throughput_rps']} req/s), statuses {report['statuses']}, "
+          f"cache hit rate {report['cache_hit_rate']:.0%}, {report['upstream_connects']} new upstream connections")
+    print(f"{'':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(report["latency"].items()) + [("loop lag", report["event_loop_lag"])]
+    for name, stats in rows:
+        cells = [f"{stats[key]:>10}" if stats.get(key) is not None else f"{'-':>10}" for key in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{name:<12}{stats['count']:>8}{''.join(cells)}")
+
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    if args.workload:
+        workload = load_workload(args.workload, rng, args.skip_ratio)
+        workload = [workload[i % len(workload)] for i in range(args.requests or len(workload))]
+    else:
+        workload = synthetic_workload(args.requests or 100, rng, args.skip_ratio)
+    if args.styles:
+        styles = args.styles.split(",")
+        for item in workload:
+            item["style"] = styles[rng.randrange(len(styles))]
+
+    config = {
+        "mode": args.mode, "endpoint": args.endpoint, "requests": len(workload), "concurrency": args.concurrency,
+        "rate": args.rate, "cache": not args.no_cache, "seed": args.seed, "workload": args.workload or "synthetic",
+        "skip_ratio": args.skip_ratio,
+    }
+
+    if args.mode == "inprocess":
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+        os.environ.setdefault("MOCK_MODE", "true")
+        os.environ.setdefault("MOCK_SEED", str(args.seed))
+        from app.main import app
+        from app.config import settings
+        from app.rate_limiter import limiter
+        limiter.enabled = args.rate_limits
+        config["mock_mode"] = settings.mock_mode
+        headers = {"Authorization": f"Bearer {settings.api_secret_key}"}
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://benchmark"
+        lifespan = app.router.lifespan_context(app)
+    else:
+        headers = {"Authorization": f"Bearer {args.token}"}
+        transport = None
+        base_url = args.url
+        lifespan = None
+
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    monitor = LoopLagMonitor()
+    if lifespan is not None:
+        await lifespan.__aenter__()
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url=base_url, headers=headers, timeout=timeout, limits=limits
+        ) as client:
+            metrics_text = (await client.get("/metrics")).text
+            if args.warmup:
+                await run_load(client, workload[:args.warmup], args.endpoint, args.concurrency, not args.no_cache, None)
+                metrics_text = (await client.get("/metrics")).text
+            before, connects_before = stage_buckets(metrics_text), upstream_connects(metrics_text)
+            monitor.start()
+            results, elapsed = await run_load(
+                client, workload, args.endpoint, args.concurrency, not args.no_cache, args.rate
+            )
+            await monitor.stop()
+            metrics_text = (await client.get("/metrics")).text
+            after, connects = stage_buckets(metrics_text), upstream_connects(metrics_text) - connects_before
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    stages = {stage: histogram_percentiles(before.get(stage, {}), buckets) for stage, buckets in after.items()}
+    return build_report(results, elapsed, monitor.samples, stages, config, connects)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Answer Architect API")
+    parser.add_argument("--mode", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--url", default="http://localhost:8000", help="Server for --mode http")
+    parser.add_argument("--token", default=os.getenv("API_SECRET_KEY", "your-secret-key-here"))
+    parser.add_argument("--endpoint", default=None,
+                        help="Defaults to /prompt/debug in-process (per-request stage timings) and /prompt over HTTP")
+    parser.add_argument("--workload", help="JSONL file of prompts; omit for a synthetic mix")
+    parser.add_argument("--requests", type=int, default=None, help="Number of requests (workload files are cycled)")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=None, help="Open-loop arrival rate in requests/second")
+    parser.add_argument("--styles", help="Comma-separated styles to draw from instead of the workload's")
+    parser.add_argument("--skip-ratio", type=float, default=0.2, help="Share of synthetic requests with skip_refinement")
+    parser.add_argument("--no-cache", action="store_true", help="Send cache=false so every request goes upstream")
+    parser.add_argument("--warmup", type=int, default=0, help="Requests to send before measuring")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--rate-limits", action="store_true", help="Keep the API rate limits on in-process")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--save-baseline", help="Write the JSON report here as the new baseline")
+    parser.add_argument("--baseline", help="Compare against this baseline report")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression (0.10 = 10%%)")
+    args = parser.parse_args()
+    if args.endpoint is None:
+        args.endpoint = "/prompt/debug" if args.mode == "inprocess" else "/prompt"
+
+    print(f"🚀 Benchmarking {args.mode} {args.endpoint} with concurrency {args.concurrency}...")
+    report = asyncio.run(benchmark(args))
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"💾 Report written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print("⚠️  Baseline was recorded with a different configuration; comparison may be misleading")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Regressed: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
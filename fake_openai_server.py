@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions API, with injectable faults
+
+Point the API at it with OPENAI_BASE_URL=http://localhost:8081/v1 (and
+MOCK_MODE=false) to exercise retries, hedging and the circuit breaker:
+
+    python fake_openai_server.py --error-rate 0.2 --rate-limit-rate 0.1 --tail-rate 0.05
+
+To measure connection handshakes, serve it over TLS with a self-signed certificate
+and trust that certificate with UPSTREAM_CA_BUNDLE:
+
+    openssl req -x509 -newkey rsa:2048 -nodes -days 30 -subj "/CN=localhost" \
+        -addext "subjectAltName=DNS:localhost" -keyout fake_openai_key.pem -out fake_openai_cert.pem
+    python fake_openai_server.py --port 8443 --ssl-certfile fake_openai_cert.pem --ssl-keyfile fake_openai_key.pem
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake OpenAI")
+faults = argparse.Namespace(
+    latency=0.2, tail_rate=0.0, tail_latency=3.0,
+    error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, down=False
+)
+stats = {"requests": 0, "errors": 0, "rate_limited": 0, "slow": 0}
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def build_answer(prompt: str) -> str:
+    return f"Fake answer to: {prompt[:200]}"
+
+
+def error_response(status_code: int, message: str, error_type: str, headers=None) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": error_type, "param": None, "code": None}},
+        headers=headers
+    )
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """Answer like /v1/chat/completions, failing or stalling at the configured rates"""
+    stats["requests"] += 1
+    body = await request.json()
+    prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+    model = body.get("model", "gpt-4o-mini")
+
+    if faults.down or random.random() < faults.error_rate:
+        stats["errors"] += 1
+        return error_response(500, "The server had an error while processing your request.", "server_error")
+    if random.random() < faults.rate_limit_rate:
+        stats["rate_limited"] += 1
+        return error_response(429, "Rate limit reached.", "requests", {"retry-after": str(faults.retry_after)})
+
+    delay = faults.latency
+    if random.random() < faults.tail_rate:
+        stats["slow"] += 1
+        delay = faults.tail_latency
+    await asyncio.sleep(delay)
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    answer = build_answer(prompt)
+    usage = {
+        "prompt_tokens": count_tokens(prompt),
+        "completion_tokens": count_tokens(answer),
+        "total_tokens": count_tokens(prompt) + count_tokens(answer)
+    }
+
+    if not body.get("stream"):
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    async def events():
+        def chunk(delta, finish_reason=None, chunk_usage=None, choices=True):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else [],
+            }
+            if chunk_usage is not None:
+                payload["usage"] = chunk_usage
+            return f"data: {json.dumps(payload)}\n\n"
+
+        yield chunk({"role": "assistant", "content": ""})
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            yield chunk({"content": word if i == 0 else " " + word})
+            await asyncio.sleep(0.01)
+        yield chunk({}, "stop")
+        if include_usage:
+            yield chunk({}, chunk_usage=usage, choices=False)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/v1/models")
+async def list_models():
+    """Cheap authenticated-looking endpoint, used by clients to warm up connections"""
+    return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "fake"}]}
+
+
+@app.get("/stats")
+async def get_stats():
+    return {**stats, "faults": vars(faults)}
+
+
+@app.post("/faults")
+async def set_faults(request: Request):
+    """Change fault injection at runtime, e.g. {"down": true} to trip the circuit breaker"""
+    for key, value in (await request.json()).items():
+        if hasattr(faults, key):
+            setattr(faults, key, value)
+    return vars(faults)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=faults.latency, help="Normal response delay in seconds")
+    parser.add_argument("--tail-rate", type=float, default=faults.tail_rate, help="Fraction of slow responses")
+    parser.add_argument("--tail-latency", type=float, default=faults.tail_latency, help="Delay of slow responses")
+    parser.add_argument("--error-rate", type=float, default=faults.error_rate, help="Fraction of 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=faults.rate_limit_rate, help="Fraction of 429 responses")
+    parser.add_argument("--retry-after", type=float, default=faults.retry_after, help="Retry-After sent with 429s")
+    parser.add_argument("--down", action="store_true", help="Fail every request")
+    parser.add_argument("--ssl-certfile", help="Serve HTTPS with this certificate")
+    parser.add_argument("--ssl-keyfile", help="Private key for --ssl-certfile")
+    parser.add_argument("--keep-alive-timeout", type=int, default=75, help="Seconds idle connections stay open")
+    args = parser.parse_args()
+
+    for key in vars(faults):
+        setattr(faults, key, getattr(args, key))
+    scheme = "https" if args.ssl_certfile else "http"
+    print(f"🧪 Fake OpenAI listening on {scheme}://{args.host}:{args.port}/v1")
+    uvicorn.run(
+        app, host=args.host, port=args.port, ssl_certfile=args.ssl_certfile, ssl_keyfile=args.ssl_keyfile,
+        timeout_keep_alive=args.keep_alive_timeout
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -155,7 +155,7 @@ function App() {
 
           {/* Response Display */}
           <div className="animate-fadeIn">
-            <ResponseDisplay response={response} />
+            <ResponseDisplay response={response} isStreaming={isLoading} />
           </div>
         </div>
       </main>
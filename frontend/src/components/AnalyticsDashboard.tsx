@@ -12,8 +12,25 @@ interface AnalyticsData {
   error?: string;
 }
 
+interface StageLatency {
+  count: number;
+  p50_ms: number | null;
+  p95_ms: number | null;
+  p99_ms: number | null;
+}
+
+interface MetricsSummary {
+  latency: { [stage: string]: StageLatency };
+  requests: number;
+  errors: number;
+  rate_limited: number;
+  cache_hits: number;
+  coalesced: number;
+}
+
 export const AnalyticsDashboard: React.FC = () => {
   const [analytics, setAnalytics] = useState<AnalyticsData | null>(null);
+  const [metrics, setMetrics] = useState<MetricsSummary | null>(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string>('');
 
@@ -30,6 +47,14 @@ export const AnalyticsDashboard: React.FC = () => {
     }
   };
 
+  const fetchMetrics = async () => {
+    try {
+      setMetrics(await apiService.getMetricsSummary());
+    } catch (err) {
+      // Latency panel is best-effort; keep showing the last values
+    }
+  };
+
   useEffect(() => {
     fetchAnalytics();
     // Refresh every 30 seconds
@@ -37,6 +62,17 @@ export const AnalyticsDashboard: React.FC = () => {
     return () => clearInterval(interval);
   }, []);
 
+  useEffect(() => {
+    fetchMetrics();
+    // Latency percentiles are cheap to compute, so poll them more often
+    const interval = setInterval(fetchMetrics, 5000);
+    return () => clearInterval(interval);
+  }, []);
+
+  const formatMs = (ms: number | null | undefined): string => {
+    return ms === null || ms === undefined ? '—' : `${ms.toFixed(0)}ms`;
+  };
+
   const formatUptime = (seconds: number): string => {
     const hours = Math.floor(seconds / 3600);
     const minutes = Math.floor((seconds % 3600) / 60);
@@ -188,6 +224,45 @@ export const AnalyticsDashboard: React.FC = () => {
         </div>
       </div>
 
+      {metrics && (
+        <div className="mt-6">
+          <h4 className="text-md font-semibold text-gray-900 mb-3">Latency (recent requests)</h4>
+          <div className="overflow-x-auto">
+            <table className="min-w-full text-sm">
+              <thead>
+                <tr className="text-left text-gray-600">
+                  <th className="p-2">Stage</th>
+                  <th className="p-2">Samples</th>
+                  <th className="p-2">p50</th>
+                  <th className="p-2">p95</th>
+                  <th className="p-2">p99</th>
+                </tr>
+              </thead>
+              <tbody>
+                {['refinement', 'generation', 'total'].map((stage) => {
+                  const latency = metrics.latency[stage];
+                  return (
+                    <tr key={stage} className="bg-gray-50 border-t border-white">
+                      <td className="p-2 font-medium text-gray-700 capitalize">{stage}</td>
+                      <td className="p-2 text-gray-600">{latency ? latency.count : 0}</td>
+                      <td className="p-2 text-gray-600">{formatMs(latency?.p50_ms)}</td>
+                      <td className="p-2 text-gray-600">{formatMs(latency?.p95_ms)}</td>
+                      <td className="p-2 text-gray-600">{formatMs(latency?.p99_ms)}</td>
+                    </tr>
+                  );
+                })}
+              </tbody>
+            </table>
+          </div>
+          <div className="mt-3 flex flex-wrap gap-4 text-sm text-gray-600">
+            <span>Errors: <span className="font-semibold text-gray-900">{metrics.errors}</span></span>
+            <span>Rate limited: <span className="font-semibold text-gray-900">{metrics.rate_limited}</span></span>
+            <span>Cache hits: <span className="font-semibold text-gray-900">{metrics.cache_hits}</span></span>
+            <span>Coalesced: <span className="font-semibold text-gray-900">{metrics.coalesced}</span></span>
+          </div>
+        </div>
+      )}
+
       {analytics.error && (
         <div className="mt-4 p-3 bg-red-50 border border-red-200 rounded-lg">
           <p className="text-sm text-red-700">{analytics.error}</p>
@@ -48,11 +48,20 @@ export const PromptForm: React.FC<PromptFormProps> = ({
         skip_refinement: skipRefinement
       };
 
-      const response = debugMode 
-        ? await apiService.submitPromptDebug(styledPrompt)
-        : await apiService.submitPrompt(styledPrompt);
-      
-      onResponse(response);
+      if (debugMode) {
+        const response = await apiService.submitPromptDebug(styledPrompt);
+        onResponse(response);
+      } else {
+        // Stream the answer so it renders as tokens arrive
+        let streamed = '';
+        await apiService.streamPrompt(styledPrompt, {
+          onToken: (text) => {
+            streamed += text;
+            onResponse({ response: streamed });
+          },
+          onDone: (response) => onResponse(response),
+        });
+      }
       setHasSubmitted(true);
     } catch (error) {
       onError(error instanceof Error ? error.message : 'An error occurred');
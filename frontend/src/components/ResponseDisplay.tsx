@@ -3,13 +3,14 @@ import { PromptResponse, DebugPromptResponse } from '../types/api';
 
 interface ResponseDisplayProps {
   response: PromptResponse | DebugPromptResponse | null;
+  isStreaming?: boolean;
 }
 
 const isDebugResponse = (response: PromptResponse | DebugPromptResponse): response is DebugPromptResponse => {
   return 'raw_input' in response;
 };
 
-export const ResponseDisplay: React.FC<ResponseDisplayProps> = ({ response }) => {
+export const ResponseDisplay: React.FC<ResponseDisplayProps> = ({ response, isStreaming = false }) => {
   const [copiedStates, setCopiedStates] = useState<{[key: string]: boolean}>({});
 
   if (!response) return null;
@@ -78,9 +79,9 @@ export const ResponseDisplay: React.FC<ResponseDisplayProps> = ({ response }) =>
               />
             </div>
             <div className="mt-3 flex flex-wrap gap-4 text-sm text-gray-600">
-              <span className="bg-white/50 px-2 py-1 rounded-lg">Model: <span className="font-semibold text-gray-900">{response.model_used}</span></span>
+              <span className="bg-white/50 px-2 py-1 rounded-lg">Model: <span className="font-semibold text-gray-900">{response.refinement_model && response.refinement_model !== response.model_used ? `${response.refinement_model} → ${response.model_used}` : response.model_used}</span></span>
               <span className="bg-white/50 px-2 py-1 rounded-lg">Total: <span className="font-semibold text-gray-900">{formatTime(response.processing_time_ms)}</span></span>
-              <span className="bg-white/50 px-2 py-1 rounded-lg">Refinement: <span className="font-semibold text-gray-900">{formatTime(response.refinement_time_ms)}</span></span>
+              <span className="bg-white/50 px-2 py-1 rounded-lg">Refinement: <span className="font-semibold text-gray-900">{response.refinement_bypassed ? `skipped (saved ${formatTime(response.refinement_saved_ms)})` : response.refinement_cached ? `cached (saved ${formatTime(response.refinement_saved_ms)})` : formatTime(response.refinement_time_ms)}</span></span>
               <span className="bg-white/50 px-2 py-1 rounded-lg">Generation: <span className="font-semibold text-gray-900">{formatTime(response.generation_time_ms)}</span></span>
             </div>
           </div>
@@ -155,13 +156,16 @@ export const ResponseDisplay: React.FC<ResponseDisplayProps> = ({ response }) =>
           </div>
           <div className="mt-3 flex flex-wrap gap-4 text-sm text-gray-600">
             <span className="bg-white/50 px-2 py-1 rounded-lg">Model: <span className="font-semibold text-gray-900">{response.model_used}</span></span>
-            <span className="bg-white/50 px-2 py-1 rounded-lg">Processing Time: <span className="font-semibold text-gray-900">{formatTime(response.processing_time_ms)}</span></span>
+            <span className="bg-white/50 px-2 py-1 rounded-lg">Processing Time: <span className="font-semibold text-gray-900">{isStreaming ? 'Streaming...' : formatTime(response.processing_time_ms)}</span></span>
           </div>
         </div>
         
         <div className="p-6">
           <div className="prose max-w-none">
-            <div className="text-gray-800 whitespace-pre-wrap font-medium leading-relaxed">{response.response}</div>
+            <div className="text-gray-800 whitespace-pre-wrap font-medium leading-relaxed">
+              {response.response}
+              {isStreaming && <span className="inline-block w-2 h-4 ml-0.5 align-text-bottom bg-gray-500 animate-pulse" />}
+            </div>
           </div>
         </div>
       </div>
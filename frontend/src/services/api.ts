@@ -1,4 +1,4 @@
-import { PromptRequest, PromptResponse, DebugPromptResponse, HealthResponse, ApiError } from '../types/api';
+import { PromptRequest, PromptResponse, DebugPromptResponse, HealthResponse, ApiError, StreamHandlers } from '../types/api';
 
 // Use /api for Docker deployment, localhost for development
 const API_BASE_URL = process.env.REACT_APP_API_URL || 
@@ -40,6 +40,55 @@ class ApiService {
     });
   }
 
+  async streamPrompt(request: PromptRequest, handlers: StreamHandlers): Promise<void> {
+    const response = await fetch(`${API_BASE_URL}/prompt/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${API_TOKEN}`,
+        'Accept': 'text/event-stream',
+      },
+      body: JSON.stringify(request),
+    });
+
+    if (!response.ok || !response.body) {
+      const errorData: ApiError = await response.json();
+      throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    // Server-Sent Events are separated by a blank line
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const message = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        let event = 'message';
+        let data = '';
+        for (const line of message.split('\n')) {
+          if (line.startsWith('event:')) event = line.slice(6).trim();
+          else if (line.startsWith('data:')) data += line.slice(5).trim();
+        }
+        if (!data) continue;
+
+        const payload = JSON.parse(data);
+        if (event === 'refinement') handlers.onRefinement?.(payload);
+        else if (event === 'token') handlers.onToken(payload.text);
+        else if (event === 'done') handlers.onDone(payload);
+        else if (event === 'error') throw new Error(payload.detail);
+      }
+    }
+  }
+
   async submitPromptDebug(request: PromptRequest): Promise<DebugPromptResponse> {
     return this.makeRequest<DebugPromptResponse>('/prompt/debug', {
       method: 'POST',
@@ -50,6 +99,10 @@ class ApiService {
   async getAnalytics(): Promise<any> {
     return this.makeRequest<any>('/analytics/stats');
   }
+
+  async getMetricsSummary(): Promise<any> {
+    return this.makeRequest<any>('/metrics/summary');
+  }
 }
 
 export const apiService = new ApiService(); 
\ No newline at end of file
@@ -2,6 +2,7 @@ export interface PromptRequest {
   text: string;
   style?: string;
   skip_refinement?: boolean;
+  cache?: boolean;
 }
 
 export interface PromptResponse {
@@ -15,9 +16,33 @@ export interface DebugPromptResponse {
   refined_prompt: string;
   final_response: string;
   model_used: string;
+  refinement_model?: string | null;
   processing_time_ms?: number;
   refinement_time_ms?: number;
   generation_time_ms?: number;
+  cache_hit?: boolean;
+  semantic_similarity?: number | null;
+  refinement_cached?: boolean;
+  refinement_bypassed?: boolean;
+  refinement_saved_ms?: number;
+  coalesced?: boolean;
+  speculative_winner?: 'direct' | 'refined' | null;
+  speculative_saved_ms?: number | null;
+}
+
+export interface StreamRefinementEvent {
+  refinement_time_ms: number;
+  skipped: boolean;
+  cached?: boolean;
+  refinement_cached?: boolean;
+  refinement_bypassed?: boolean;
+  refinement_saved_ms?: number;
+}
+
+export interface StreamHandlers {
+  onRefinement?: (event: StreamRefinementEvent) => void;
+  onToken: (text: string) => void;
+  onDone: (response: PromptResponse) => void;
 }
 
 export interface HealthResponse {
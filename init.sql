@@ -1,20 +1,90 @@
 -- Initialize the Answer Architect database
 
-CREATE TABLE IF NOT EXISTS prompt_logs (
+-- Each distinct prompt/answer text is stored once (existing databases: run migrations/001_prompt_blobs.sql)
+CREATE TABLE IF NOT EXISTS prompt_blobs (
     id SERIAL PRIMARY KEY,
-    timestamp TIMESTAMPTZ DEFAULT NOW(),
-    raw_input TEXT NOT NULL,
-    refined_prompt TEXT NOT NULL,
-    final_output TEXT NOT NULL,
+    digest BYTEA NOT NULL UNIQUE,  -- SHA-256 of the UTF-8 text
+    size INTEGER NOT NULL,
+    encoding VARCHAR(8) NOT NULL DEFAULT 'none',  -- none, zlib or zstd (LOG_BLOB_COMPRESSION)
+    content TEXT,
+    data BYTEA
+);
+
+-- Long texts are compressed by TOAST; lz4 is faster than the default pglz (PostgreSQL 14+)
+ALTER TABLE prompt_blobs ALTER COLUMN content SET COMPRESSION lz4;
+
+-- Range-partitioned by period (LOG_PARTITION_PERIOD); the app creates upcoming partitions and
+-- archives expired ones (LOG_RETENTION_DAYS). Existing databases: migrations/002_partition_prompt_log_entries.sql
+CREATE TABLE IF NOT EXISTS prompt_log_entries (
+    id SERIAL,
+    timestamp TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    raw_input_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    refined_prompt_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    final_output_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
     user_ip VARCHAR(45),
-    model_used VARCHAR(50)
+    model_used VARCHAR(50),
+    refinement_model VARCHAR(50),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catches rows outside every period partition
+CREATE TABLE IF NOT EXISTS prompt_log_entries_default PARTITION OF prompt_log_entries DEFAULT;
+
+-- Create indexes for better query performance (each partition gets its own)
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_timestamp ON prompt_log_entries(timestamp);
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_user_ip ON prompt_log_entries(user_ip);
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_model_used ON prompt_log_entries(model_used);
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_raw_input_id ON prompt_log_entries(raw_input_id);
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_final_output_id ON prompt_log_entries(final_output_id);
+
+-- The original prompt_logs columns, for existing queries and dashboards
+CREATE OR REPLACE VIEW prompt_logs AS
+SELECT e.id, e.timestamp,
+       r.content AS raw_input, p.content AS refined_prompt, f.content AS final_output,
+       e.user_ip, e.model_used, e.refinement_model
+FROM prompt_log_entries e
+JOIN prompt_blobs r ON r.id = e.raw_input_id
+JOIN prompt_blobs p ON p.id = e.refined_prompt_id
+JOIN prompt_blobs f ON f.id = e.final_output_id;
+
+-- Full-text index over each distinct raw_input and final_output text, filled by the log writer
+-- (GET /logs/search). The configuration must match LOG_SEARCH_LANGUAGE. Existing databases: migrations/003_log_search.sql
+CREATE TABLE IF NOT EXISTS prompt_search (
+    blob_id INTEGER PRIMARY KEY REFERENCES prompt_blobs(id) ON DELETE CASCADE,
+    body TEXT NOT NULL,
+    document TSVECTOR GENERATED ALWAYS AS (to_tsvector('english'::regconfig, body)) STORED
 );
 
--- Create indexes for better query performance
-CREATE INDEX IF NOT EXISTS idx_prompt_logs_timestamp ON prompt_logs(timestamp);
-CREATE INDEX IF NOT EXISTS idx_prompt_logs_user_ip ON prompt_logs(user_ip);
-CREATE INDEX IF NOT EXISTS idx_prompt_logs_model_used ON prompt_logs(model_used);
+CREATE INDEX IF NOT EXISTS ix_prompt_search_document ON prompt_search USING GIN (document);
+
+-- Shared tier of the response cache
+CREATE TABLE IF NOT EXISTS response_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_response_cache_expires_at ON response_cache(expires_at);
+
+-- Pre-aggregated analytics rollups (maintained by the log writer)
+CREATE TABLE IF NOT EXISTS prompt_stats (
+    id SERIAL PRIMARY KEY,
+    granularity VARCHAR(10) NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    model_used VARCHAR(50) NOT NULL DEFAULT '',
+    request_count INTEGER NOT NULL DEFAULT 0,
+    user_sketch BYTEA,
+    CONSTRAINT uq_prompt_stats_bucket UNIQUE (granularity, bucket_start, model_used)
+);
 
 -- Grant permissions
-GRANT ALL PRIVILEGES ON TABLE prompt_logs TO gpt_user;
-GRANT USAGE, SELECT ON SEQUENCE prompt_logs_id_seq TO gpt_user; 
\ No newline at end of file
+GRANT ALL PRIVILEGES ON TABLE prompt_blobs TO gpt_user;
+GRANT ALL PRIVILEGES ON TABLE prompt_log_entries TO gpt_user;
+GRANT SELECT ON prompt_logs TO gpt_user;
+GRANT ALL PRIVILEGES ON TABLE prompt_search TO gpt_user;
+GRANT ALL PRIVILEGES ON TABLE response_cache TO gpt_user;
+GRANT ALL PRIVILEGES ON TABLE prompt_stats TO gpt_user;
+GRANT USAGE, SELECT ON SEQUENCE prompt_stats_id_seq TO gpt_user;
+GRANT USAGE, SELECT ON SEQUENCE prompt_blobs_id_seq TO gpt_user;
+GRANT USAGE, SELECT ON SEQUENCE prompt_log_entries_id_seq TO gpt_user; 
\ No newline at end of file
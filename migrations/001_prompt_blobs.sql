@@ -0,0 +1,77 @@
+-- Move an existing prompt_logs table onto deduplicated text storage (PostgreSQL 11+)
+-- The app refuses to start until this has run. python -m app.migrate_legacy_logs does the
+-- same in batches; this does it in one pass, which is much faster for large tables.
+-- Run it while the app is stopped:
+--   psql -d your_database -f migrations/001_prompt_blobs.sql
+-- The old table is kept as prompt_logs_legacy; drop it once the view checks out.
+
+BEGIN;
+
+-- Databases created before model routing
+ALTER TABLE prompt_logs ADD COLUMN IF NOT EXISTS refinement_model VARCHAR(50);
+
+CREATE TABLE IF NOT EXISTS prompt_blobs (
+    id SERIAL PRIMARY KEY,
+    digest BYTEA NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    encoding VARCHAR(8) NOT NULL DEFAULT 'none',
+    content TEXT,
+    data BYTEA
+);
+
+ALTER TABLE prompt_blobs ALTER COLUMN content SET COMPRESSION lz4;
+
+CREATE TABLE IF NOT EXISTS prompt_log_entries (
+    id SERIAL PRIMARY KEY,
+    timestamp TIMESTAMPTZ DEFAULT NOW(),
+    raw_input_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    refined_prompt_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    final_output_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    user_ip VARCHAR(45),
+    model_used VARCHAR(50),
+    refinement_model VARCHAR(50)
+);
+
+-- Same digest as the app computes: SHA-256 of the UTF-8 text
+INSERT INTO prompt_blobs (digest, size, encoding, content)
+SELECT sha256(convert_to(t, 'UTF8')), octet_length(t), 'none', t
+FROM (
+    SELECT raw_input AS t FROM prompt_logs
+    UNION SELECT refined_prompt FROM prompt_logs
+    UNION SELECT final_output FROM prompt_logs
+) texts
+ON CONFLICT (digest) DO NOTHING;
+
+INSERT INTO prompt_log_entries (
+    id, timestamp, raw_input_id, refined_prompt_id, final_output_id, user_ip, model_used, refinement_model
+)
+SELECT l.id, l.timestamp, r.id, p.id, f.id, l.user_ip, l.model_used, l.refinement_model
+FROM prompt_logs l
+JOIN prompt_blobs r ON r.digest = sha256(convert_to(l.raw_input, 'UTF8'))
+JOIN prompt_blobs p ON p.digest = sha256(convert_to(l.refined_prompt, 'UTF8'))
+JOIN prompt_blobs f ON f.digest = sha256(convert_to(l.final_output, 'UTF8'));
+
+SELECT setval(pg_get_serial_sequence('prompt_log_entries', 'id'), COALESCE((SELECT MAX(id) FROM prompt_log_entries), 0) + 1, false);
+
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_timestamp ON prompt_log_entries(timestamp);
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_user_ip ON prompt_log_entries(user_ip);
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_model_used ON prompt_log_entries(model_used);
+
+ALTER TABLE prompt_logs RENAME TO prompt_logs_legacy;
+
+CREATE VIEW prompt_logs AS
+SELECT e.id, e.timestamp,
+       r.content AS raw_input, p.content AS refined_prompt, f.content AS final_output,
+       e.user_ip, e.model_used, e.refinement_model
+FROM prompt_log_entries e
+JOIN prompt_blobs r ON r.id = e.raw_input_id
+JOIN prompt_blobs p ON p.id = e.refined_prompt_id
+JOIN prompt_blobs f ON f.id = e.final_output_id;
+
+GRANT ALL PRIVILEGES ON TABLE prompt_blobs TO gpt_user;
+GRANT ALL PRIVILEGES ON TABLE prompt_log_entries TO gpt_user;
+GRANT SELECT ON prompt_logs TO gpt_user;
+GRANT USAGE, SELECT ON SEQUENCE prompt_blobs_id_seq TO gpt_user;
+GRANT USAGE, SELECT ON SEQUENCE prompt_log_entries_id_seq TO gpt_user;
+
+COMMIT;
@@ -0,0 +1,74 @@
+-- Convert a plain prompt_log_entries table (migrations/001_prompt_blobs.sql) into monthly range
+-- partitions, which the retention job can detach and archive (PostgreSQL 12+). Run it while the app
+-- is stopped:
+--   psql -d your_database -f migrations/002_partition_prompt_log_entries.sql
+
+BEGIN;
+
+-- Stored timestamps are UTC; this makes ::timestamp agree whether the old column had a time zone or not
+SET LOCAL timezone = 'UTC';
+
+ALTER TABLE prompt_log_entries RENAME TO prompt_log_entries_unpartitioned;
+ALTER INDEX IF EXISTS ix_prompt_log_entries_timestamp RENAME TO ix_prompt_log_entries_unpartitioned_timestamp;
+ALTER INDEX IF EXISTS ix_prompt_log_entries_user_ip RENAME TO ix_prompt_log_entries_unpartitioned_user_ip;
+ALTER INDEX IF EXISTS ix_prompt_log_entries_model_used RENAME TO ix_prompt_log_entries_unpartitioned_model_used;
+
+CREATE TABLE prompt_log_entries (
+    id INTEGER NOT NULL DEFAULT nextval('prompt_log_entries_id_seq'),
+    timestamp TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    raw_input_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    refined_prompt_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    final_output_id INTEGER NOT NULL REFERENCES prompt_blobs(id),
+    user_ip VARCHAR(45),
+    model_used VARCHAR(50),
+    refinement_model VARCHAR(50),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE prompt_log_entries_default PARTITION OF prompt_log_entries DEFAULT;
+
+-- One partition per month that has rows (the app adds upcoming ones)
+DO $$
+DECLARE
+    month TIMESTAMP;
+BEGIN
+    FOR month IN
+        SELECT DISTINCT date_trunc('month', COALESCE(timestamp::timestamp, NOW()::timestamp))
+        FROM prompt_log_entries_unpartitioned
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE prompt_log_entries_p%s PARTITION OF prompt_log_entries FOR VALUES FROM (%L) TO (%L)',
+            to_char(month, 'YYYYMM'), month, month + INTERVAL '1 month'
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO prompt_log_entries (
+    id, timestamp, raw_input_id, refined_prompt_id, final_output_id, user_ip, model_used, refinement_model
+)
+SELECT id, COALESCE(timestamp::timestamp, NOW()::timestamp), raw_input_id, refined_prompt_id, final_output_id,
+       user_ip, model_used, refinement_model
+FROM prompt_log_entries_unpartitioned;
+
+CREATE INDEX ix_prompt_log_entries_timestamp ON prompt_log_entries(timestamp);
+CREATE INDEX ix_prompt_log_entries_user_ip ON prompt_log_entries(user_ip);
+CREATE INDEX ix_prompt_log_entries_model_used ON prompt_log_entries(model_used);
+
+-- The view still points at the old table
+DROP VIEW prompt_logs;
+CREATE VIEW prompt_logs AS
+SELECT e.id, e.timestamp,
+       r.content AS raw_input, p.content AS refined_prompt, f.content AS final_output,
+       e.user_ip, e.model_used, e.refinement_model
+FROM prompt_log_entries e
+JOIN prompt_blobs r ON r.id = e.raw_input_id
+JOIN prompt_blobs p ON p.id = e.refined_prompt_id
+JOIN prompt_blobs f ON f.id = e.final_output_id;
+
+ALTER SEQUENCE prompt_log_entries_id_seq OWNED BY prompt_log_entries.id;
+DROP TABLE prompt_log_entries_unpartitioned;
+
+GRANT ALL PRIVILEGES ON TABLE prompt_log_entries TO gpt_user;
+GRANT SELECT ON prompt_logs TO gpt_user;
+
+COMMIT;
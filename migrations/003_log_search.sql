@@ -0,0 +1,33 @@
+-- Add the full-text log search index (GET /logs/search) to an existing database (PostgreSQL 12+)
+-- The app creates the same objects at startup and indexes stored texts in the background; this
+-- indexes them in one pass, which is much faster for large logs. Change 'english' to match
+-- LOG_SEARCH_LANGUAGE if you set it. Run it while the app is stopped:
+--   psql -d your_database -f migrations/003_log_search.sql
+
+BEGIN;
+
+-- Search hits are joined back to their entries through these (each partition gets its own)
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_raw_input_id ON prompt_log_entries(raw_input_id);
+CREATE INDEX IF NOT EXISTS ix_prompt_log_entries_final_output_id ON prompt_log_entries(final_output_id);
+
+CREATE TABLE IF NOT EXISTS prompt_search (
+    blob_id INTEGER PRIMARY KEY REFERENCES prompt_blobs(id) ON DELETE CASCADE,
+    body TEXT NOT NULL,
+    document TSVECTOR GENERATED ALWAYS AS (to_tsvector('english'::regconfig, body)) STORED
+);
+
+-- Uncompressed texts used as an input or an answer; the app indexes zlib/zstd texts at startup
+INSERT INTO prompt_search (blob_id, body)
+SELECT b.id, b.content
+FROM prompt_blobs b
+WHERE b.encoding = 'none'
+  AND (EXISTS (SELECT 1 FROM prompt_log_entries e WHERE e.raw_input_id = b.id)
+       OR EXISTS (SELECT 1 FROM prompt_log_entries e WHERE e.final_output_id = b.id))
+ON CONFLICT (blob_id) DO NOTHING;
+
+-- Built after the bulk insert, which is faster than maintaining it row by row
+CREATE INDEX IF NOT EXISTS ix_prompt_search_document ON prompt_search USING GIN (document);
+
+GRANT ALL PRIVILEGES ON TABLE prompt_search TO gpt_user;
+
+COMMIT;
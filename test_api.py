@@ -6,6 +6,7 @@ Simple test script for the Answer Architect API
 import requests
 import json
 import os
+import time
 from typing import Dict, Any
 
 # Configuration
@@ -55,6 +56,50 @@ def test_debug_endpoint():
     print(f"Response: {json.dumps(result['response'], indent=2)}")
     return result['status_code'] == 200
 
+def test_stream_endpoint():
+    """Test the streaming prompt endpoint"""
+    print("\n🔍 Testing streaming prompt endpoint...")
+    headers = {
+        "Authorization": f"Bearer {API_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    response = requests.post(
+        f"{BASE_URL}/prompt/stream",
+        headers=headers,
+        json={"text": "explain neural networks", "style": "concise"},
+        stream=True
+    )
+    events = [line[len("event: "):] for line in response.iter_lines(decode_unicode=True)
+              if line and line.startswith("event: ")]
+    print(f"Status: {response.status_code}")
+    print(f"Events: {events[0] if events else None} ... {events[-1] if events else None} ({len(events)} total)")
+    return response.status_code == 200 and events[:1] == ["refinement"] and events[-1:] == ["done"]
+
+def test_batch_endpoint():
+    """Test the batch prompt endpoint"""
+    print("\n🔍 Testing batch prompt endpoint...")
+    test_data = {"items": [{"text": "what is an API"}, {"text": "what is REST", "style": "concise"}]}
+    result = make_request("/prompt/batch", test_data)
+    print(f"Status: {result['status_code']}")
+    print(f"Response: succeeded={result['response'].get('succeeded')} failed={result['response'].get('failed')}")
+    return result['status_code'] == 200 and result['response'].get('succeeded') == 2
+
+def test_jobs_endpoint():
+    """Test queueing a job and polling for its result"""
+    print("\n🔍 Testing job queue endpoints...")
+    result = make_request("/jobs", {"text": "summarize the history of the internet", "style": "detailed"})
+    print(f"Status: {result['status_code']}")
+    if result['status_code'] != 202:
+        return False
+    job_id = result['response']['job_id']
+    for _ in range(60):
+        job = make_request(f"/jobs/{job_id}")['response']
+        if job['status'] in ("succeeded", "failed"):
+            break
+        time.sleep(1)
+    print(f"Job {job_id}: {job['status']}")
+    return job['status'] == "succeeded" and bool(job['result'])
+
 def test_root_endpoint():
     """Test the root endpoint"""
     print("\n🔍 Testing root endpoint...")
@@ -74,6 +119,9 @@ def main():
         ("Root Endpoint", test_root_endpoint),
         ("Main Prompt Endpoint", test_main_endpoint),
         ("Debug Endpoint", test_debug_endpoint),
+        ("Streaming Endpoint", test_stream_endpoint),
+        ("Batch Endpoint", test_batch_endpoint),
+        ("Job Queue", test_jobs_endpoint),
     ]
     
     results = []
@@ -0,0 +1,52 @@
+import asyncio
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from app.cache import FlightAbandoned, SingleFlight, refinement_cache, response_cache
+from app.config import settings
+
+LOCAL_ROUTE = {"name": "local-llama", "model": "llama3", "backend": "local", "base_url": "http://localhost:8080/v1"}
+
+
+def test_response_key_changes_with_model_routes(monkeypatch):
+    before = response_cache.key_for("what is a b-tree", "balanced", False)
+    monkeypatch.setattr(settings, "model_routes", [LOCAL_ROUTE])
+    assert response_cache.key_for("what is a b-tree", "balanced", False) != before
+
+
+def test_response_key_ignores_api_key_rotation(monkeypatch):
+    monkeypatch.setattr(settings, "model_routes", [dict(LOCAL_ROUTE, api_key="old")])
+    before = response_cache.key_for("what is a b-tree", "balanced", False)
+    monkeypatch.setattr(settings, "model_routes", [dict(LOCAL_ROUTE, api_key="new")])
+    assert response_cache.key_for("what is a b-tree", "balanced", False) == before
+
+
+def test_refinement_key_changes_with_model_routes(monkeypatch):
+    before = refinement_cache.key_for("what is a b-tree", "balanced")
+    monkeypatch.setattr(settings, "model_routes", [LOCAL_ROUTE])
+    assert refinement_cache.key_for("what is a b-tree", "balanced") != before
+
+
+def test_waiters_share_a_stream_leaders_result():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.lead("k")
+        waiter = asyncio.ensure_future(flights.do("k", lambda: asyncio.sleep(0, result="own call")))
+        await asyncio.sleep(0)
+        leader.set_result("streamed")
+        return await waiter
+
+    assert asyncio.run(scenario()) == ("streamed", True)
+
+
+def test_waiters_make_their_own_call_when_the_leader_is_abandoned():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.lead("k")
+        waiter = asyncio.ensure_future(flights.do("k", lambda: asyncio.sleep(0, result="own call")))
+        await asyncio.sleep(0)
+        leader.set_exception(FlightAbandoned())
+        return await waiter, flights.deduplicated
+
+    assert asyncio.run(scenario()) == (("own call", False), 0)
@@ -0,0 +1,40 @@
+import asyncio
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from app.config import Settings, settings
+from app.prompt_classifier import HELD_OUT_EXAMPLES, TRAINING_EXAMPLES, VALIDATION_EXAMPLES, PromptClassifier
+
+BYPASS_THRESHOLD = 0.85
+MIN_HELD_OUT_PRECISION = 0.9
+
+
+def test_held_out_examples_are_not_trained_or_tuned_on():
+    seen = {text for text, _ in TRAINING_EXAMPLES + VALIDATION_EXAMPLES}
+    assert not [text for text, _ in HELD_OUT_EXAMPLES if text in seen]
+
+
+def test_held_out_precision_at_bypass_threshold():
+    result = PromptClassifier().evaluate(HELD_OUT_EXAMPLES, BYPASS_THRESHOLD)
+    assert result["precision"] >= MIN_HELD_OUT_PRECISION, result
+
+
+def test_vague_questions_are_refined():
+    classifier = PromptClassifier()
+    assert classifier.score("Who is the president?") < BYPASS_THRESHOLD
+    assert classifier.score("Explain quantum entanglement") < BYPASS_THRESHOLD
+
+
+def test_bypass_is_opt_in():
+    assert Settings.model_fields["refinement_bypass_enabled"].default is False
+
+
+def test_warm_up_trains_only_when_bypass_is_enabled(monkeypatch):
+    classifier = PromptClassifier()
+    monkeypatch.setattr(settings, "refinement_bypass_enabled", False)
+    asyncio.run(classifier.warm_up())
+    assert classifier._weights is None
+    monkeypatch.setattr(settings, "refinement_bypass_enabled", True)
+    asyncio.run(classifier.warm_up())
+    assert classifier._weights is not None
@@ -0,0 +1,87 @@
+import asyncio
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pytest
+
+from app.config import settings
+from app.resilience import CircuitOpen, Resilience, UpstreamUnavailable
+
+
+@pytest.fixture
+def breaker_settings(monkeypatch):
+    monkeypatch.setattr(settings, "circuit_breaker_failure_threshold", 1)
+    monkeypatch.setattr(settings, "circuit_breaker_cooldown_seconds", 0.05)
+    monkeypatch.setattr(settings, "upstream_max_attempts", 1)
+    monkeypatch.setattr(settings, "upstream_hedge_enabled", False)
+
+
+async def fail(model):
+    raise UpstreamUnavailable("down")
+
+
+async def succeed(model):
+    return "ok"
+
+
+async def hang(model):
+    await asyncio.Event().wait()
+
+
+def test_cancelled_probe_does_not_keep_circuit_shut(breaker_settings):
+    async def scenario():
+        resilience = Resilience()
+        with pytest.raises(UpstreamUnavailable):
+            await resilience.call("m", fail)
+        with pytest.raises(CircuitOpen):
+            await resilience.call("m", succeed)
+        await asyncio.sleep(0.06)
+
+        probe = asyncio.ensure_future(resilience.call("m", hang))
+        await asyncio.sleep(0)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+
+        assert resilience.breaker("m").state == "half_open"
+        assert await resilience.call("m", succeed) == "ok"
+        assert resilience.breaker("m").state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_failed_probe_reopens_circuit(breaker_settings):
+    async def scenario():
+        resilience = Resilience()
+        with pytest.raises(UpstreamUnavailable):
+            await resilience.call("m", fail)
+        await asyncio.sleep(0.06)
+        with pytest.raises(UpstreamUnavailable):
+            await resilience.call("m", fail)
+        assert resilience.breaker("m").state == "open"
+
+    asyncio.run(scenario())
+
+
+def test_other_calls_ending_do_not_free_the_probe_slot(breaker_settings):
+    async def scenario():
+        resilience = Resilience()
+        # Admitted while closed, still running when the circuit opens and goes half-open
+        early = asyncio.ensure_future(resilience.call("m", hang))
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamUnavailable):
+            await resilience.call("m", fail)
+        await asyncio.sleep(0.06)
+        probe = asyncio.ensure_future(resilience.call("m", hang))
+        await asyncio.sleep(0)
+
+        early.cancel()
+        await asyncio.gather(early, return_exceptions=True)
+        with pytest.raises(CircuitOpen):
+            await resilience.call("m", succeed)
+
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        assert await resilience.call("m", succeed) == "ok"
+
+    asyncio.run(scenario())
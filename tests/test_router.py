@@ -0,0 +1,60 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pytest
+
+from app.config import settings
+from app.resilience import Resilience
+from app.router import ModelRouter
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(settings, "model_routes", [
+        {"name": "broken", "backend": "mock"},  # First, so it wins ties
+        {"name": "good", "backend": "mock"},
+    ])
+    monkeypatch.setattr(settings, "model_router_min_samples", 5)
+    monkeypatch.setattr(settings, "model_router_explore_ratio", 0.0)
+    monkeypatch.setattr(settings, "circuit_breaker_failure_threshold", 3)
+    monkeypatch.setattr(settings, "circuit_breaker_cooldown_seconds", 0.0)  # Half-open straight away
+    breakers = Resilience()
+    monkeypatch.setattr("app.router.resilience", breakers)
+    return ModelRouter(), breakers
+
+
+def call(router, breakers, stage="generation"):
+    """Choose a route and report the call the way GPTService does"""
+    name = router.choose(stage, "balanced")
+    breaker = breakers.breaker(name)
+    if name == "broken":
+        router.observe(name, stage, "balanced", 100.0, None, ok=False)
+        breaker.record_failure()
+    else:
+        router.observe(name, stage, "balanced", 800.0, 200, ok=True)
+        breaker.record_success()
+    return name
+
+
+def test_always_failing_route_stops_being_chosen(router):
+    router, breakers = router
+    chosen = [call(router, breakers) for _ in range(50)]
+    assert chosen.count("broken") <= settings.model_router_min_samples
+    assert chosen[-20:] == ["good"] * 20
+
+
+def test_half_open_route_is_skipped_while_another_is_healthy(router):
+    router, breakers = router
+    for _ in range(3):
+        breakers.breaker("broken").record_failure()
+    assert breakers.breaker("broken").state == "half_open"
+    assert {router.choose("generation", "balanced") for _ in range(10)} == {"good"}
+
+
+def test_failing_route_without_latency_scores_worse_than_a_measured_one(router):
+    router, _ = router
+    router.observe("good", "generation", "balanced", 800.0, 200, ok=True)
+    router.observe("broken", "generation", "balanced", 100.0, None, ok=False)
+    good, broken = router.routes["good"], router.routes["broken"]
+    assert router.score(broken, "generation", "balanced") > router.score(good, "generation", "balanced")
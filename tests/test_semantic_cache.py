@@ -0,0 +1,51 @@
+import asyncio
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pytest
+
+from app.config import settings
+from app.semantic_cache import SemanticCache
+
+SWAPPED = [
+    ("is python faster than java", "is java faster than python"),
+    ("convert celsius to fahrenheit", "convert fahrenheit to celsius"),
+    ("translate english to french", "translate french to english"),
+    ("how to convert a string to an int in python", "how to convert an int to a string in python"),
+]
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(settings, "semantic_cache_enabled", True)
+    monkeypatch.setattr(settings, "semantic_cache_model", "")
+    return SemanticCache()
+
+
+@pytest.mark.parametrize("style", ["balanced", "casual"])
+def test_order_swapped_questions_miss(cache, style):
+    async def scenario():
+        for first, second in SWAPPED:
+            await cache.set(first, style, False, {"final_answer": first})
+        return [await cache.get(second, style, False) for _, second in SWAPPED]
+
+    assert asyncio.run(scenario()) == [None] * len(SWAPPED)
+
+
+def test_same_question_still_hits(cache):
+    async def scenario():
+        await cache.set("Is Python faster than Java?", "balanced", False, {"final_answer": "it depends"})
+        return await cache.get("is python faster than java", "balanced", False)
+
+    match = asyncio.run(scenario())
+    assert match is not None and match[0] == {"final_answer": "it depends"}
+
+
+def test_route_change_misses(cache, monkeypatch):
+    async def scenario():
+        await cache.set("is python faster than java", "balanced", False, {"final_answer": "old route"})
+        monkeypatch.setattr(settings, "model_routes", [{"name": "local-llama", "model": "llama3", "backend": "local"}])
+        return await cache.get("is python faster than java", "balanced", False)
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,46 @@
+import asyncio
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from app.cache import response_cache
+from app.config import settings
+from app.gpt_service import Refinement, gpt_service
+
+
+def run_speculative(monkeypatch, preferred):
+    cached = []
+
+    async def direct(raw_input, style, priority):
+        return "direct answer", 1.0, "direct-model"
+
+    async def refine(raw_input, style, use_cache=True, priority="interactive"):
+        return Refinement("refined prompt", 1.0)
+
+    async def generate(refined_prompt, style, priority):
+        return "refined answer", 1.0, "refined-model"
+
+    async def cache_answer(cache_key, raw_input, style, skip_refinement, *rest):
+        cached.append((cache_key, skip_refinement))
+
+    monkeypatch.setattr(settings, "speculative_policy", "length")
+    monkeypatch.setattr(settings, "speculative_max_direct_chars", 1000 if preferred == "direct" else 0)
+    monkeypatch.setattr(gpt_service, "generate_direct_answer", direct)
+    monkeypatch.setattr(gpt_service, "refine_prompt_cached", refine)
+    monkeypatch.setattr(gpt_service, "generate_final_answer", generate)
+    monkeypatch.setattr(gpt_service, "cache_answer", cache_answer)
+    key = response_cache.key_for("what is a b-tree", "balanced", False)
+    result = asyncio.run(gpt_service._run_speculative("what is a b-tree", "balanced", True, key, "interactive"))
+    return result, cached
+
+
+def test_direct_win_is_cached_as_skip_refinement(monkeypatch):
+    result, cached = run_speculative(monkeypatch, "direct")
+    assert result.speculative_winner == "direct"
+    assert cached == [(response_cache.key_for("what is a b-tree", "balanced", True), True)]
+
+
+def test_refined_win_is_cached_as_refined(monkeypatch):
+    result, cached = run_speculative(monkeypatch, "refined")
+    assert result.speculative_winner == "refined"
+    assert cached == [(response_cache.key_for("what is a b-tree", "balanced", False), False)]